@@ -4,19 +4,24 @@ from langchain.callbacks.base import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 from langchain.agents import initialize_agent, AgentType
 from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from typing import List, Optional, Dict, Any
 from bson import ObjectId
 
 import pandas as pd
 import logging
-import functools
+import os
+import threading
 import re
 import asyncio
-import unicodedata
-import unidecode
 import difflib
 
-from api.embed import similarity, embed_question
+from api.embed import decode_embedding, embed_question, embedding_matrix, top_k_similar, iter_chunk_batches, get_chunks, get_chunk_texts
+from api.index import ChunkIndex, get_org_index
+from api.tabular import StoredTable, format_column_stats, open_table, plain_values, get_legacy_table, get_value_index, query_classifier, select_sheets, table_cache
+from api.value_index import normalize_value
+from api.tabular_aggregates import answer_directly
+from api.lexical import bm25_search, load_lexical_index, reciprocal_rank_fusion
 from api.schemas.agents import convert_messages_to_dict
 from api.database import agents_db, connectors_db, knowledge_db
 
@@ -53,16 +58,35 @@ def _clean_tool_name(name: str, prefix: str) -> Dict[str, str]:
     llm_label = name.strip()
     return {"tool_name": tool_name, "llm_label": llm_label}
 
+# How many candidates each ranking contributes to reciprocal-rank fusion.
+FUSION_CANDIDATES = 20
+# Above this many chunks, documents that have a lexical index are not streamed in full: only
+# the best LEXICAL_PREFILTER_CANDIDATES BM25 matches get their embeddings scored.
+LEXICAL_PREFILTER_MIN_CHUNKS = 2000
+LEXICAL_PREFILTER_CANDIDATES = 256
+# Tables are analyzed with one LLM call each, at most this many at a time; a table that takes
+# longer than the timeout (seconds) is answered from its schema summary instead.
+TABULAR_ANALYSIS_CONCURRENCY = int(os.getenv("TABULAR_ANALYSIS_CONCURRENCY", "4"))
+TABULAR_ANALYSIS_TIMEOUT = float(os.getenv("TABULAR_ANALYSIS_TIMEOUT", "30"))
+# How many agents keep their compiled graph, tools and context documents in memory.
+AGENT_GRAPH_CACHE_SIZE = int(os.getenv("AGENT_GRAPH_CACHE_SIZE", "64"))
+
 async def retrieve_relevant_context(
     question: str | list,
     context_docs: List[Dict[str, Any]],
     top_n: int = 3,
     top_rows: int = 10,
+    index: Optional[ChunkIndex] = None,
 ) -> str:
     """
     Retrieve the most relevant context from a list of context_docs for the given question.
-    For text documents: uses embedding similarity to select top-n chunks (unchanged).
-    For tabular CSV/Excel documents: reconstructs DataFrame and uses a Pandas agent to generate context.
+    For text documents: uses embedding similarity to select top-n chunks. Documents given by
+    `context_id` are read from knowledge_chunks: those in the org's vector `index` are searched
+    through it, the rest are streamed in batches and scored exactly. Documents that carry a
+    `lexical_index` are also ranked with BM25, and the two rankings are merged with
+    reciprocal-rank fusion so exact identifiers are found even when embeddings miss them.
+    For tabular CSV/Excel documents: loads the stored Parquet table (or legacy data_json) and uses a Pandas agent to generate context.
+    Tables over TABLE_IN_MEMORY_ROWS rows are not loaded; they are queried through column scans (StoredTable).
     The result merges tabular agent outputs with the text-based top-n chunks.
     """
 
@@ -83,7 +107,51 @@ async def retrieve_relevant_context(
 
     tabular_context_outputs = []
     tabular_file_keys = set()
+    # Text chunks are keyed by (context_id, ordinal), or by ("inline", doc, chunk) for chunks
+    # passed in directly, so vector and lexical hits on the same chunk can be fused.
+    text_chunks = []
+    text_keys = []
+    text_embeddings = []
     text_chunks_scored = []
+    indexed_context_ids = []
+    stored_context_ids = []
+    lexical_indexes = {}
+    unembedded_chunks = []
+
+    def _collect_text_chunk(chunk_text, chunk, key):
+        # Document chunks are never embedded on the query path; chunks without a stored
+        # embedding are skipped until the backfill job has embedded them.
+        chunk_emb = decode_embedding(chunk.get("embedding"))
+        if not chunk_emb.size:
+            unembedded_chunks.append(key)
+            return
+        if len(chunk_emb) != len(question_emb):
+            raise ValueError(f"embedding has {len(chunk_emb)} dimensions, expected {len(question_emb)}")
+        text_chunks.append(chunk_text)
+        text_keys.append(key)
+        text_embeddings.append(chunk_emb)
+
+    def _score_collected_chunks(depth):
+        # Fold the collected chunks into the running top candidates, so streamed batches never pile up.
+        if not text_chunks:
+            return
+        for chunk_idx, sim in top_k_similar(question_emb, embedding_matrix(text_embeddings), depth):
+            text_chunks_scored.append((sim, text_keys[chunk_idx], text_chunks[chunk_idx]))
+        text_chunks_scored.sort(reverse=True, key=lambda x: x[0])
+        del text_chunks_scored[depth:]
+        text_chunks.clear()
+        text_keys.clear()
+        text_embeddings.clear()
+
+    def _collect_stored_chunks(chunks):
+        for chunk in chunks:
+            chunk_text = chunk.get("text", "")
+            if not chunk_text.strip():
+                continue
+            try:
+                _collect_text_chunk(chunk_text, chunk, (str(chunk["context_id"]), chunk["ordinal"]))
+            except Exception as exc:
+                logger.warning("Failed to score chunk #%s of context %s: %s", chunk.get("ordinal"), chunk.get("context_id"), exc)
 
     for idx, doc in enumerate(context_docs):
         try:
@@ -96,6 +164,17 @@ async def retrieve_relevant_context(
                 logger.debug("Document is tabular, will process with Pandas agent later: file_key=%r", file_key)
                 continue
 
+            if doc.get("context_id") and "chunks" not in doc:
+                if doc.get("lexical_index") is not None:
+                    lexical_indexes[doc["context_id"]] = doc["lexical_index"]
+                if index is not None and index.has_context(doc["context_id"]):
+                    indexed_context_ids.append(doc["context_id"])
+                    logger.debug("Document %s will be searched through the vector index.", doc["context_id"])
+                else:
+                    stored_context_ids.append(doc["context_id"])
+                    logger.debug("Document %s will be streamed from knowledge_chunks.", doc["context_id"])
+                continue
+
             if "chunks" in doc and isinstance(doc["chunks"], list):
                 logger.debug("Document contains %d chunks.", len(doc["chunks"]))
                 for chunk_idx, chunk in enumerate(doc["chunks"]):
@@ -104,42 +183,35 @@ async def retrieve_relevant_context(
                         logger.debug("Skipping empty chunk #%d in doc #%d.", chunk_idx, idx)
                         continue
                     try:
-                        chunk_emb = chunk.get("embedding") or embed_question(chunk_text[:2000])
-                        sim = similarity(question_emb, chunk_emb)
-                        text_chunks_scored.append((sim, chunk_text))
-                        logger.debug("Chunk #%d in doc #%d: similarity=%.4f", chunk_idx, idx, sim)
+                        _collect_text_chunk(chunk_text, chunk, ("inline", idx, chunk_idx))
                     except Exception as exc:
-                        logger.warning("Failed to embed/score chunk #%d in doc #%d: %s", chunk_idx, idx, exc)
+                        logger.warning("Failed to score chunk #%d in doc #%d: %s", chunk_idx, idx, exc)
             elif doc.get("text"):
                 chunk_text = doc["text"]
                 try:
-                    chunk_emb = doc.get("embedding") or embed_question(chunk_text[:2000])
-                    sim = similarity(question_emb, chunk_emb)
-                    text_chunks_scored.append((sim, chunk_text))
-                    logger.debug("Single text doc #%d: similarity=%.4f", idx, sim)
+                    _collect_text_chunk(chunk_text, doc, ("inline", idx, None))
                 except Exception as exc:
-                    logger.warning("Failed to embed/score single text doc #%d: %s", idx, exc)
+                    logger.warning("Failed to score single text doc #%d: %s", idx, exc)
         except Exception as exc:
             logger.error("Exception processing doc #%d: %s", idx, exc)
 
-    @functools.lru_cache(maxsize=32)
-    def _cached_load_df(file_key, data_json):
+    def _load_cached_table(doc):
+        """Return (table, value index, column stats); legacy data_json tables have neither."""
         try:
-            if data_json:
-                return pd.read_json(data_json, orient="split")
-        except Exception:
-            return None
-        return None
+            cache_key = doc.get("context_id") or doc.get("file_key")
+            if doc.get("table"):
+                stats = doc.get("column_stats")
+                return open_table(cache_key, doc["table"], stats), get_value_index(cache_key, doc["table"]), stats
+            return get_legacy_table(cache_key, doc["data_json"]), None, None
+        except Exception as exc:
+            logger.error("Failed to load table for %s: %s", doc.get("file_key"), exc)
+            return None, None, None
 
     async def _async_load_df(file_key, tabular_docs):
-        data_json = None
-        for doc in tabular_docs:
-            if "data_json" in doc and doc["data_json"]:
-                data_json = doc["data_json"]
-                break
-        if data_json:
+        stored = next((doc for doc in tabular_docs if doc.get("table") or doc.get("data_json")), None)
+        if stored:
             loop = asyncio.get_running_loop()
-            df = await loop.run_in_executor(None, _cached_load_df, file_key, data_json)
+            return await loop.run_in_executor(None, _load_cached_table, stored)
         else:
             rows = []
             header = None
@@ -160,30 +232,11 @@ async def retrieve_relevant_context(
                 df = pd.DataFrame(rows)
             else:
                 df = None
-        return df
+        return df, None, None
 
     # Normalization/fuzzy helpers: only normalize queries, not DataFrame values
     def _normalize_query(s):
-        if not isinstance(s, str):
-            s = str(s)
-        s = unicodedata.normalize("NFKC", s)
-        s = s.casefold()
-        s = unidecode.unidecode(s)
-        return s
-
-    def _find_best_column_match(query_col, df_columns):
-        # Only normalize the query_col; keep df_columns as-is for LLM reporting
-        norm_query = _normalize_query(query_col)
-        norm_cols = {col: _normalize_query(col) for col in df_columns}
-        for col, norm_col in norm_cols.items():
-            if norm_query == norm_col:
-                return col
-        close = difflib.get_close_matches(norm_query, norm_cols.values(), n=1, cutoff=0.8)
-        if close:
-            for col, norm_col in norm_cols.items():
-                if norm_col == close[0]:
-                    return col
-        return None
+        return normalize_value(s)
 
     def _find_best_value_match(query_val, col_values):
         # Only normalize the query_val; keep col_values as-is for LLM reporting
@@ -198,100 +251,271 @@ async def retrieve_relevant_context(
             return col_values[idx]
         return None
 
+    def _best_value_match(df, col, query_val, value_index=None):
+        """Closest cell value of `col`, through the table's value index when it has one."""
+        column_index = value_index.get(col) if value_index else None
+        if column_index is not None:
+            return column_index.best_match(query_val)
+        col_data = df[col].dropna().astype(str).tolist()
+        return _find_best_value_match(query_val, col_data)
+
     def _classify_query(question, df):
         """Classify the query type for a DataFrame question."""
-        q = _normalize_query(question)
-        if re.match(r"^\s*list all\b", q) or re.match(r"^\s*show all\b", q):
-            return "list_all"
-        for col in df.columns:
-            norm_col = _normalize_query(col)
-            if re.search(rf"\b{norm_col}\b.*\b(is|=|equals|named|with|of|to)\b.*\b([\w@.\- ]+)", q):
-                return "filter_exact"
-        if re.search(r"(contains|starts with|ends with|pattern)", q):
-            return "filter_pattern"
-        if re.search(r"\b(average|mean|sum|total|count|min|max)\b", q):
-            return "aggregate"
-        if re.search(r"(info for|details for|row for|record for)", q):
-            return "full_row"
-        return "unknown"
-
-    def _extract_column_value(question, df):
+        return query_classifier(df).classify(question)
+
+    def _extract_column_value(question, df, value_index=None):
         """Extract column and value for filtering, using normalization/fuzzy on query only."""
-        q = _normalize_query(question)
-        # Try pattern: <col> is/equals/with <val>
-        for col in df.columns:
-            norm_col = _normalize_query(col)
-            m = re.search(rf"\b{norm_col}\b.*\b(is|=|equals|named|with|of|to)\b\s*['\"]?([\w@.\- ]+)['\"]?", q)
-            if m:
-                candidate_val = m.group(2).strip()
-                col_data = df[col].dropna().astype(str).tolist()
-                best_val = _find_best_value_match(candidate_val, col_data)
-                return col, best_val if best_val is not None else candidate_val
-        # Try pattern: <col> ... <val>
-        m = re.search(r"\b([\w@.\- ]+)\b.*\b(is|=|equals|named|with|of|to)\b\s*['\"]?([\w@.\- ]+)['\"]?", q)
-        if m:
-            candidate_col = m.group(1).strip()
-            candidate_val = m.group(3).strip()
-            best_col = _find_best_column_match(candidate_col, df.columns)
-            if best_col:
-                col_data = df[best_col].dropna().astype(str).tolist()
-                best_val = _find_best_value_match(candidate_val, col_data)
-                return best_col, best_val if best_val is not None else candidate_val
-        return None, None
+        col, candidate_val = query_classifier(df).column_value(question)
+        if col is None:
+            return None, None
+        best_val = _best_value_match(df, col, candidate_val, value_index)
+        return col, best_val if best_val is not None else candidate_val
 
     def _extract_pattern(question, df):
-        q = _normalize_query(question)
-        m = re.search(r"(?:contains|starts with|ends with)\s+['\"]?([\w@.\- ]+)['\"]?", q, re.IGNORECASE)
-        if m:
-            return m.group(1).strip()
-        return None
+        return query_classifier(df).pattern(question)
 
     def _extract_pattern_column(question, df):
-        q = _normalize_query(question)
-        for col in df.columns:
-            norm_col = _normalize_query(col)
-            if re.search(rf"\b{norm_col}\b", q):
-                return col
-        words = re.findall(r"\b[\w@.\- ]+\b", q)
-        for word in words:
-            best_col = _find_best_column_match(word, df.columns)
-            if best_col:
-                return best_col
-        return None
+        return query_classifier(df).pattern_column(question)
 
     def _extract_aggregate(question, df):
-        agg_map = {
-            "average": "mean",
-            "mean": "mean",
-            "sum": "sum",
-            "total": "sum",
-            "count": "count",
-            "min": "min",
-            "max": "max"
-        }
-        q = _normalize_query(question)
-        for agg_word, agg_func in agg_map.items():
-            m = re.search(rf"{agg_word}\s+(?:of\s+)?([\w_ ]+)", q, re.IGNORECASE)
-            if m:
-                candidate_col = m.group(1).strip()
-                best_col = _find_best_column_match(candidate_col, df.columns)
-                if best_col:
-                    return agg_func, best_col
-        return None, None
+        return query_classifier(df).aggregate(question)
 
-    def _extract_row_identifier(question, df):
-        q = _normalize_query(question)
-        m = re.search(r"(?:info for|details for|row for|record for)\s+['\"]?([\w@.\- ]+)['\"]?", q, re.IGNORECASE)
-        if m:
-            val = m.group(1).strip()
+    def _match_rows(df, col, value, contains=False, value_index=None):
+        """
+        Rows whose normalized `col` equals (or contains) the normalized `value`. Compared with
+        vectorized string operations on the cached normalized column, or on the value index.
+        """
+        if isinstance(df, StoredTable):
+            column_index = value_index.get(col) if value_index else None
+            if contains and column_index is not None:
+                return df.filter_values(col, column_index.containing(value))
+            return df.filter_normalized(col, value, contains)
+        normalized = table_cache.normalized_column(df, col)
+        norm_value = _normalize_query(value)
+        mask = normalized.str.contains(norm_value, regex=False, na=False) if contains else normalized.eq(norm_value)
+        return df[mask.to_numpy(dtype=bool)]
+
+    def _rows_matching_value(df, col, val, value_index=None):
+        """Rows whose `col` equals `val` after normalization, else those of the closest fuzzy match."""
+        column_index = value_index.get(col) if value_index else None
+        if column_index is not None:
+            values = column_index.matches(val)
+            if isinstance(df, StoredTable):
+                return df.filter_values(col, values)
+            series = df[col]
+            if pd.api.types.is_numeric_dtype(series):
+                return df[series.isin(pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").dropna())]
+            # All the matched values share one normalized form.
+            return _match_rows(df, col, values[0]) if values else df.head(0)
+        # Only normalize/fuzzy-match the query value, not the DataFrame values
+        filtered = _match_rows(df, col, val)
+        if filtered.empty:
+            best_val = _best_value_match(df, col, val)
+            if best_val is not None:
+                filtered = _match_rows(df, col, best_val)
+        return filtered
+
+    def _aggregate_column(df, col, agg_func):
+        if isinstance(df, StoredTable):
+            return df.aggregate(col, agg_func)
+        return getattr(plain_values(df[col]), agg_func)()
+
+    def _extract_row_identifier(question, df, value_index=None):
+        val = query_classifier(df).row_identifier(question)
+        if val is not None:
             # Try to find which column this value matches best
             for col in df.columns:
-                col_data = df[col].dropna().astype(str).tolist()
-                best_val = _find_best_value_match(val, col_data)
+                best_val = _best_value_match(df, col, val, value_index)
                 if best_val is not None:
                     return col, best_val
         return None, None
 
+    def _summarize_table(filename, df, value_index, stats):
+        """
+        Run the classified query against one table; returns (schema_summary, filter_failed).
+        When the query cannot be applied, the stored column stats describe the whole table.
+        """
+        query_type = _classify_query(question_text, df)
+        logger.info("Classified query as %r for table %s", query_type, filename)
+        output = None
+        desc = ""
+        filter_failed = False
+        if query_type == "list_all":
+            MAX_ROWS = 20
+            output = df.head(MAX_ROWS)
+            desc = f"List of all records (showing first {MAX_ROWS} rows):"
+        elif query_type == "filter_exact":
+            col, val = _extract_column_value(question_text, df, value_index)
+            if col and val:
+                filtered = _rows_matching_value(df, col, val, value_index)
+                if filtered.empty:
+                    filter_failed = True
+                    output = df.head(20)
+                    desc = f"No exact or fuzzy match for {col} = '{val}'; showing sample rows:"
+                else:
+                    output = filtered
+                    desc = f"Filtered rows where {col} == '{val}' (query normalized/fuzzy):"
+            else:
+                filter_failed = True
+                output = df.head(20)
+                desc = "Could not infer filter; showing sample rows:"
+        elif query_type == "filter_pattern":
+            pattern = _extract_pattern(question_text, df)
+            col = _extract_pattern_column(question_text, df)
+            if col and pattern:
+                filtered = _match_rows(df, col, pattern, contains=True, value_index=value_index)
+                if filtered.empty:
+                    filter_failed = True
+                    output = df.head(20)
+                    desc = f"No rows where {col} contains '{pattern}' (query normalized); showing sample rows:"
+                else:
+                    output = filtered
+                    desc = f"Rows where {col} contains '{pattern}':"
+            else:
+                filter_failed = True
+                output = df.head(20)
+                desc = "Could not infer pattern/column; showing sample rows:"
+        elif query_type == "aggregate":
+            agg_func, col = _extract_aggregate(question_text, df)
+            if agg_func and col:
+                if agg_func == "count":
+                    result = _aggregate_column(df, col, "count")
+                    output = pd.DataFrame({f"count_{col}": [result]})
+                    desc = f"Count of {col}:"
+                else:
+                    try:
+                        result = _aggregate_column(df, col, agg_func)
+                    except Exception:
+                        result = None
+                    output = pd.DataFrame({f"{agg_func}_{col}": [result]})
+                    desc = f"{agg_func.title()} of {col}:"
+            else:
+                filter_failed = True
+                if stats:
+                    output = df.head(20)
+                    desc = "Could not infer aggregation; showing sample rows:"
+                else:
+                    output = df.describe(include='all').T
+                    desc = "Could not infer aggregation; showing describe():"
+        elif query_type == "full_row":
+            col, val = _extract_row_identifier(question_text, df, value_index)
+            if col and val:
+                filtered = _rows_matching_value(df, col, val, value_index)
+                if filtered.empty:
+                    filter_failed = True
+                    output = df.head(20)
+                    desc = f"No full row found for {col} = '{val}'; showing sample rows:"
+                else:
+                    output = filtered
+                    desc = f"Full row for {col} == '{val}':"
+            else:
+                filter_failed = True
+                output = df.head(20)
+                desc = "Could not infer row identifier; showing sample rows:"
+        else:
+            filter_failed = False
+            output = df.head(20)
+            desc = "Sample of data (unclassified query):"
+
+        # If filter failed or output is empty, provide the full DataFrame/sample to LLM for reasoning
+        if output is None or output.empty:
+            filter_failed = True
+            output = df.head(20)
+            desc = "No matching rows found; showing sample rows:"
+
+        N_HEAD = min(5, len(output))
+        sample_csv = output.head(N_HEAD).to_csv(index=False)
+        if filter_failed and stats:
+            summary_stats = f"Column statistics (of all {len(df)} rows):\n{format_column_stats(stats)}"
+        else:
+            try:
+                summary_stats = f"Summary statistics (of result rows):\n{output.describe(include='all').to_string()}"
+            except Exception:
+                summary_stats = "Summary statistics (of result rows):\n"
+        schema_summary = (
+            f"Table '{filename}':\n"
+            f"Columns: {', '.join(df.columns)}\n"
+            f"Column types: {', '.join(str(dtype) for dtype in df.dtypes)}\n"
+            f"{desc}\n"
+            f"Sample of {len(output)} rows (showing first {N_HEAD} rows):\n{sample_csv}\n"
+            f"{summary_stats}\n"
+        )
+        return schema_summary, filter_failed
+
+    def _table_prompt(schema_summary, filter_failed):
+        return (
+            f"You are given a table from the organization's knowledge base.\n"
+            f"{schema_summary}\n"
+            f"User's question: {question_text}\n"
+            f"Answer the user's question using only the data provided above. "
+            f"Do not invent any information. "
+            f"Do not apologize, ask the user to wait, or add any procedural commentary. "
+            f"Do not describe your reasoning steps. "
+            f"Only provide a concise, factual answer based on the provided rows or summary statistics. "
+            f"If the answer cannot be determined from the provided data, explicitly state that the knowledge base does not contain the information."
+            + (
+                "\nNote: The filtered subset for your query was empty or could not be determined, so you are given a sample of the full table. Please reason using the available data."
+                if filter_failed else ""
+            )
+        )
+
+    def _fallback_summary(filename, df):
+        return (
+            f"Table '{filename}':\n"
+            f"Columns: {', '.join(df.columns)}\n"
+            f"Column types: {', '.join(str(dtype) for dtype in df.dtypes)}\n"
+            f"Sample rows:\n{df.head(5).to_csv(index=False)}\n"
+        )
+
+    def _direct_answer(filename, df):
+        query_type = _classify_query(question_text, df)
+        if query_type not in ("aggregate", "list_all"):
+            return None
+        return answer_directly(question_text, query_type, df, filename)
+
+    async def _analyze_table(file_key, sheet, df, value_index, stats, semaphore):
+        """
+        Answer the question from one table. list_all questions and confidently parsed aggregates
+        are computed directly; anything else gets its own LLM call. A table whose query or LLM
+        call fails or exceeds TABULAR_ANALYSIS_TIMEOUT degrades to its schema summary.
+        """
+        filename = "_".join(file_key.split("_")[1:]) if file_key else "unknown"
+        if sheet is not None:
+            filename = f"{filename} [{sheet}]"
+        if df is None or df.empty:
+            logger.warning("No valid DataFrame found for tabular file: %s", filename)
+            return None
+        prepared = {}
+
+        async def _run():
+            loop = asyncio.get_running_loop()
+            direct = await loop.run_in_executor(None, _direct_answer, filename, df)
+            if direct is not None:
+                return direct
+            prepared["summary"], filter_failed = await loop.run_in_executor(
+                None, _summarize_table, filename, df, value_index, stats
+            )
+            llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+            response = await llm.ainvoke([HumanMessage(content=_table_prompt(prepared["summary"], filter_failed))])
+            return response.content if hasattr(response, "content") else str(response)
+
+        async with semaphore:
+            try:
+                answer = await asyncio.wait_for(_run(), timeout=TABULAR_ANALYSIS_TIMEOUT)
+                return f"📊 Table context from '{filename}':\n{answer}"
+            except asyncio.TimeoutError:
+                logger.warning("Analysis of table %s timed out after %.0fs", filename, TABULAR_ANALYSIS_TIMEOUT)
+            except Exception as exc:
+                logger.error("Failed to analyze table %s: %s", filename, exc)
+        summary = prepared.get("summary")
+        if summary is None:
+            try:
+                summary = _fallback_summary(filename, df)
+            except Exception as exc:
+                logger.error("Failed to summarize table %s: %s", filename, exc)
+                summary = f"Table '{filename}'\n"
+        return f"📊 Table context from '{filename}' (not analyzed; schema summary only):\n{summary}"
+
     if tabular_file_keys:
         logger.info("Loading tabular DataFrames for %d file_keys...", len(tabular_file_keys))
         tabular_file_key_list = list(tabular_file_keys)
@@ -299,170 +523,106 @@ async def retrieve_relevant_context(
             file_key: [doc for doc in context_docs if doc.get("file_key") == file_key and doc.get("is_tabular", False)]
             for file_key in tabular_file_key_list
         }
+        # (file_key, sheet name, docs) per table to analyze. Only the sheets of a workbook that
+        # the question refers to are loaded.
+        tabular_units = []
+        for file_key in tabular_file_key_list:
+            workbook = next((doc for doc in tabular_docs_map[file_key] if doc.get("sheets")), None)
+            if workbook is None:
+                tabular_units.append((file_key, None, tabular_docs_map[file_key]))
+                continue
+            sheets = select_sheets(question_text, workbook["sheets"])
+            logger.info(
+                "Selected %d of %d sheets of %s: %s",
+                len(sheets), len(workbook["sheets"]), file_key, [sheet["name"] for sheet in sheets],
+            )
+            for sheet in sheets:
+                sheet_doc = {**workbook, "table": sheet["table"], "column_stats": sheet.get("column_stats")}
+                tabular_units.append((file_key, sheet["name"], [sheet_doc]))
 
         dfs = await asyncio.gather(*[
-            _async_load_df(file_key, tabular_docs_map[file_key]) for file_key in tabular_file_key_list
+            _async_load_df(file_key, docs) for file_key, _, docs in tabular_units
         ])
 
-        for file_key, df in zip(tabular_file_key_list, dfs):
-            filename = "_".join(file_key.split("_")[1:]) if file_key else "unknown"
-            if df is not None and not df.empty:
-                try:
-                    query_type = _classify_query(question_text, df)
-                    logger.info("Classified query as %r for table %s", query_type, filename)
-                    output = None
-                    desc = ""
-                    filter_failed = False
-                    if query_type == "list_all":
-                        MAX_ROWS = 20
-                        output = df.head(MAX_ROWS)
-                        desc = f"List of all records (showing first {MAX_ROWS} rows):"
-                    elif query_type == "filter_exact":
-                        col, val = _extract_column_value(question_text, df)
-                        if col and val:
-                            # Only normalize/fuzzy-match the query value, not the DataFrame values
-                            mask = df[col].astype(str).apply(lambda x: _normalize_query(x) == _normalize_query(val))
-                            if not mask.any():
-                                col_data = df[col].dropna().astype(str).tolist()
-                                best_val = _find_best_value_match(val, col_data)
-                                if best_val is not None:
-                                    mask = df[col].astype(str).apply(lambda x: _normalize_query(x) == _normalize_query(best_val))
-                            filtered = df[mask]
-                            if filtered.empty:
-                                filter_failed = True
-                                output = df.head(20)
-                                desc = f"No exact or fuzzy match for {col} = '{val}'; showing sample rows:"
-                            else:
-                                output = filtered
-                                desc = f"Filtered rows where {col} == '{val}' (query normalized/fuzzy):"
-                        else:
-                            filter_failed = True
-                            output = df.head(20)
-                            desc = "Could not infer filter; showing sample rows:"
-                    elif query_type == "filter_pattern":
-                        pattern = _extract_pattern(question_text, df)
-                        col = _extract_pattern_column(question_text, df)
-                        if col and pattern:
-                            norm_pattern = _normalize_query(pattern)
-                            def match_func(x):
-                                try:
-                                    return norm_pattern in _normalize_query(x)
-                                except Exception:
-                                    return False
-                            filtered = df[df[col].astype(str).apply(match_func)]
-                            if filtered.empty:
-                                filter_failed = True
-                                output = df.head(20)
-                                desc = f"No rows where {col} contains '{pattern}' (query normalized); showing sample rows:"
-                            else:
-                                output = filtered
-                                desc = f"Rows where {col} contains '{pattern}':"
-                        else:
-                            filter_failed = True
-                            output = df.head(20)
-                            desc = "Could not infer pattern/column; showing sample rows:"
-                    elif query_type == "aggregate":
-                        agg_func, col = _extract_aggregate(question_text, df)
-                        if agg_func and col:
-                            if agg_func == "count":
-                                result = df[col].count()
-                                output = pd.DataFrame({f"count_{col}": [result]})
-                                desc = f"Count of {col}:"
-                            else:
-                                try:
-                                    result = getattr(df[col], agg_func)()
-                                except Exception:
-                                    result = None
-                                output = pd.DataFrame({f"{agg_func}_{col}": [result]})
-                                desc = f"{agg_func.title()} of {col}:"
-                        else:
-                            filter_failed = True
-                            output = df.describe(include='all').T
-                            desc = "Could not infer aggregation; showing describe():"
-                    elif query_type == "full_row":
-                        col, val = _extract_row_identifier(question_text, df)
-                        if col and val:
-                            mask = df[col].astype(str).apply(lambda x: _normalize_query(x) == _normalize_query(val))
-                            if not mask.any():
-                                col_data = df[col].dropna().astype(str).tolist()
-                                best_val = _find_best_value_match(val, col_data)
-                                if best_val is not None:
-                                    mask = df[col].astype(str).apply(lambda x: _normalize_query(x) == _normalize_query(best_val))
-                            filtered = df[mask]
-                            if filtered.empty:
-                                filter_failed = True
-                                output = df.head(20)
-                                desc = f"No full row found for {col} = '{val}'; showing sample rows:"
-                            else:
-                                output = filtered
-                                desc = f"Full row for {col} == '{val}':"
-                        else:
-                            filter_failed = True
-                            output = df.head(20)
-                            desc = "Could not infer row identifier; showing sample rows:"
-                    else:
-                        filter_failed = False
-                        output = df.head(20)
-                        desc = "Sample of data (unclassified query):"
-
-                    # If filter failed or output is empty, provide the full DataFrame/sample to LLM for reasoning
-                    if output is None or output.empty:
-                        filter_failed = True
-                        output = df.head(20)
-                        desc = "No matching rows found; showing sample rows:"
-
-                    N_HEAD = min(5, len(output))
-                    sample_csv = output.head(N_HEAD).to_csv(index=False)
-                    try:
-                        summary_stats = output.describe(include='all').to_string()
-                    except Exception:
-                        summary_stats = ""
-                    schema_summary = (
-                        f"Table '{filename}':\n"
-                        f"Columns: {', '.join(df.columns)}\n"
-                        f"Column types: {', '.join(str(df[col].dtype) for col in df.columns)}\n"
-                        f"{desc}\n"
-                        f"Sample of {len(output)} rows (showing first {N_HEAD} rows):\n{sample_csv}\n"
-                        f"Summary statistics (of result rows):\n{summary_stats}\n"
-                    )
-
-                    llm_prompt = (
-                        f"You are given a table from the organization's knowledge base.\n"
-                        f"{schema_summary}\n"
-                        f"User's question: {question_text}\n"
-                        f"Answer the user's question using only the data provided above. "
-                        f"Do not invent any information. "
-                        f"Do not apologize, ask the user to wait, or add any procedural commentary. "
-                        f"Do not describe your reasoning steps. "
-                        f"Only provide a concise, factual answer based on the provided rows or summary statistics. "
-                        f"If the answer cannot be determined from the provided data, explicitly state that the knowledge base does not contain the information."
-                        + (
-                            "\nNote: The filtered subset for your query was empty or could not be determined, so you are given a sample of the full table. Please reason using the available data."
-                            if filter_failed else ""
-                        )
-                    )
-                    try:
-                        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-                        response = await llm.ainvoke([HumanMessage(content=llm_prompt)])
-                        answer = response.content if hasattr(response, "content") else str(response)
-                    except Exception as exc:
-                        logger.error("Failed LLM call for tabular file %s: %s", filename, exc)
-                        answer = f"⚠️ Error analyzing table '{filename}': {exc}"
-                    tabular_context_outputs.append(f"📊 Table context from '{filename}':\n{answer}")
-                except Exception as exc:
-                    logger.error("Error during DataFrame query-classification/execution for %s: %s", filename, exc)
-                    tabular_context_outputs.append(f"⚠️ Error handling table '{filename}': {exc}")
-            else:
-                logger.warning("No valid DataFrame found for tabular file: %s", filename)
+        semaphore = asyncio.Semaphore(TABULAR_ANALYSIS_CONCURRENCY)
+        analyses = await asyncio.gather(*[
+            _analyze_table(file_key, sheet, df, value_index, stats, semaphore)
+            for (file_key, sheet, _), (df, value_index, stats) in zip(tabular_units, dfs)
+        ])
+        tabular_context_outputs.extend(analysis for analysis in analyses if analysis)
 
     selected_contexts = []
-    if text_chunks_scored:
-        text_chunks_scored.sort(reverse=True, key=lambda x: x[0])
-        logger.info("Sorted %d text chunks by similarity.", len(text_chunks_scored))
-        top_text_chunks = text_chunks_scored[:top_n]
-        for i, (sim, text) in enumerate(top_text_chunks):
-            logger.debug("Selected top text chunk #%d with similarity %.4f", i, sim)
-            selected_contexts.append(text)
+    depth = max(top_n, FUSION_CANDIDATES) if lexical_indexes else top_n
+    lexical_hits = []
+    if lexical_indexes:
+        try:
+            lexical_hits = bm25_search(lexical_indexes, question_text, depth)
+        except Exception as exc:
+            logger.error("Lexical search failed: %s", exc)
+
+    _score_collected_chunks(depth)
+    if stored_context_ids:
+        try:
+            prefiltered = [cid for cid in stored_context_ids if cid in lexical_indexes]
+            prefilter_chunks = sum(lexical_indexes[cid].chunk_count for cid in prefiltered)
+            candidates = []
+            if prefilter_chunks > LEXICAL_PREFILTER_MIN_CHUNKS:
+                candidates = bm25_search(
+                    {cid: lexical_indexes[cid] for cid in prefiltered},
+                    question_text,
+                    LEXICAL_PREFILTER_CANDIDATES,
+                )
+            if candidates:
+                _collect_stored_chunks(get_chunks([(cid, ordinal) for cid, ordinal, _ in candidates], with_embeddings=True))
+                _score_collected_chunks(depth)
+                logger.info("Scored %d lexical candidates out of %d chunks.", len(candidates), prefilter_chunks)
+                streamed_context_ids = [cid for cid in stored_context_ids if cid not in lexical_indexes]
+            else:
+                streamed_context_ids = stored_context_ids
+            streamed = 0
+            if streamed_context_ids:
+                for batch in iter_chunk_batches(streamed_context_ids, with_embeddings=True):
+                    _collect_stored_chunks(batch)
+                    streamed += len(batch)
+                    _score_collected_chunks(depth)
+                logger.info("Scored %d streamed chunks from %d documents.", streamed, len(streamed_context_ids))
+        except Exception as exc:
+            logger.error("Failed to stream chunks from knowledge_chunks: %s", exc)
+    if indexed_context_ids:
+        try:
+            hits = index.search(question_emb, depth, context_ids=indexed_context_ids)
+            for context_id, ordinal, sim in hits:
+                text_chunks_scored.append((sim, (context_id, ordinal), None))
+            logger.info("Searched vector index over %d documents.", len(indexed_context_ids))
+        except Exception as exc:
+            logger.error("Vector index search failed: %s", exc)
+    text_chunks_scored.sort(reverse=True, key=lambda x: x[0])
+    if unembedded_chunks:
+        logger.warning(
+            "Skipped %d chunks without embeddings (first: %s); run `python -m api.jobs.backfill_embeddings`.",
+            len(unembedded_chunks), unembedded_chunks[0],
+        )
+
+    chunk_texts = {key: text for _, key, text in text_chunks_scored}
+    if lexical_hits:
+        vector_ranking = [key for _, key, _ in text_chunks_scored[:depth]]
+        lexical_ranking = [(context_id, ordinal) for context_id, ordinal, _ in lexical_hits]
+        ranked = reciprocal_rank_fusion([vector_ranking, lexical_ranking])
+        logger.debug("Fused %d vector and %d lexical candidates.", len(vector_ranking), len(lexical_ranking))
+    else:
+        ranked = [(key, sim) for sim, key, _ in text_chunks_scored]
+    top_ranked = ranked[:top_n]
+    missing = [key for key, _ in top_ranked if chunk_texts.get(key) is None and key[0] != "inline"]
+    if missing:
+        try:
+            chunk_texts.update(get_chunk_texts(missing))
+        except Exception as exc:
+            logger.error("Failed to fetch chunk texts: %s", exc)
+    top_text_chunks = [(score, chunk_texts.get(key) or "") for key, score in top_ranked]
+    top_text_chunks = [(score, text) for score, text in top_text_chunks if text.strip()]
+    for i, (score, text) in enumerate(top_text_chunks):
+        logger.debug("Selected top text chunk #%d with score %.4f", i, score)
+        selected_contexts.append(text)
 
     if tabular_context_outputs:
         logger.info("Appending %d tabular context outputs.", len(tabular_context_outputs))
@@ -474,11 +634,269 @@ async def retrieve_relevant_context(
 
     logger.info("Returning %d selected context blocks (text: %d, tabular: %d).",
                 len(selected_contexts),
-                len(text_chunks_scored[:top_n]),
+                len(top_text_chunks),
                 len(tabular_context_outputs))
     final_context = "\n\n".join(selected_contexts)
     return final_context
 
+class AgentGraphCache:
+    """
+    Thread-safe LRU cache of what get_agent_graph builds for an agent that does not depend on
+    the question: the compiled graph, its tools and the context documents it retrieves from.
+    Entries are keyed by agent id and hold the version stamp they were built for (see
+    _agent_version), so an agent changed by another worker is rebuilt on its next question;
+    routes that change an agent invalidate it here as well. Cached graphs are shared between
+    requests and carry no per-request state.
+    """
+
+    def __init__(self, max_entries: int = AGENT_GRAPH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, agent_id, version) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(str(agent_id))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(str(agent_id))
+            self.hits += 1
+            return entry[1]
+
+    def set(self, agent_id, version, setup: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[str(agent_id)] = (version, setup)
+            self._entries.move_to_end(str(agent_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, agent_id=None, connector_id=None) -> int:
+        """Drops the entry of `agent_id`, or of every agent using `connector_id`."""
+        with self._lock:
+            if agent_id is not None:
+                keys = [str(agent_id)] if str(agent_id) in self._entries else []
+            else:
+                keys = [
+                    key for key, (_, setup) in self._entries.items()
+                    if str(connector_id) in setup["connector_ids"]
+                ]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+agent_graph_cache = AgentGraphCache()
+
+def _agent_version(agent: dict) -> tuple:
+    """
+    Version stamp of an agent: its updated_at, its context list, and the updated_at of its
+    context documents and connectors. The jobs that rebuild a document's indexes, stats or
+    table bump its updated_at, so agents using it are rebuilt.
+    """
+    connector_ids = agent.get("connector_ids", [])
+    connectors = connectors_db.find({"_id": {"$in": connector_ids}}, {"updated_at": 1}) if connector_ids else []
+    context_ids = [ObjectId(context_id) for context_id in agent.get("context", [])]
+    contexts = knowledge_db.find({"_id": {"$in": context_ids}}, {"updated_at": 1}) if context_ids else []
+    return (
+        str(agent.get("updated_at")),
+        tuple(str(context_id) for context_id in context_ids),
+        tuple(sorted((str(c["_id"]), str(c.get("updated_at"))) for c in contexts)),
+        tuple(sorted((str(c["_id"]), str(c.get("updated_at"))) for c in connectors)),
+    )
+
+async def _build_agent_setup(selected_agent: dict, organization_id: ObjectId) -> Dict[str, Any]:
+    """
+    The compiled graph, tools, connector descriptions and context documents of an agent,
+    everything get_agent_graph needs that does not depend on the question.
+    """
+    active_tools = []
+
+    async def get_search_web_tool():
+        from api.tools.web import get_search_web_tool
+        return get_search_web_tool()
+
+    builtin_tool_factories = {"search_web": get_search_web_tool}
+    connector_tool_factory_map = {
+        "google_sheet": "api.tools.google_sheet.get_google_sheet_tool",
+        "google_drive": "api.tools.google_drive.get_google_drive_tool",
+        "source_pdf": "api.tools.pdf_source.get_pdf_source_tool",
+        "source_uri": "api.tools.uri_source.get_uri_source_tool"
+    }
+
+    import importlib
+    for tool_name in selected_agent.get("tools", []):
+        factory = builtin_tool_factories.get(tool_name)
+        if factory:
+            active_tools.append(await factory())
+
+    connector_ids = selected_agent.get("connector_ids", [])
+    if connector_ids:
+        agent_connectors = list(connectors_db.find({"_id": {"$in": connector_ids}}))
+        for connector in agent_connectors:
+            try:
+                connector_type = connector.get("connector_type")
+                tool_factory_path = connector_tool_factory_map.get(connector_type)
+                if not tool_factory_path:
+                    continue
+                module_path, func_name = tool_factory_path.rsplit(".", 1)
+                tool_factory = getattr(importlib.import_module(module_path), func_name)
+                names = _clean_tool_name(connector["name"], connector_type)
+                tool_name = names["tool_name"]
+                llm_label = names["llm_label"]
+
+                if connector_type in ["source_pdf", "source_uri"]:
+                    active_tools.append(tool_factory(settings=connector["settings"], name=tool_name))
+                else:
+                    active_tools.append(tool_factory(
+                        settings=connector["settings"], name=tool_name, llm_label=llm_label, connector_id=str(connector["_id"]),
+                    ))
+            except Exception:
+                pass
+
+    for tool in active_tools:
+        if hasattr(tool, "run"):
+            original_run = tool.run
+            if callable(original_run):
+                async def logging_run(input_text, original_run=original_run, tool=tool):
+                    output = await original_run(input_text)
+                    return output
+                tool.run = logging_run
+
+    available_sources = []
+    for tool in active_tools:
+        tool_name = getattr(tool, 'name', 'unknown')
+        llm_label = getattr(tool, 'llm_label', tool_name)
+        description = getattr(tool, 'description', 'No description provided.')
+        available_sources.append(f"- {llm_label}: {description}")
+    connectors_text = "\n".join(available_sources)
+
+    context_ids = selected_agent.get("context", [])
+
+    context_docs = []
+    context_text = ""
+    logger = logging.getLogger("context_retriever")
+    for context_entry_id in context_ids:
+        entry_doc = knowledge_db.find_one({"_id": ObjectId(context_entry_id)}, {"chunks": 0})
+        if not entry_doc:
+            continue
+
+        filename = "_".join(entry_doc.get("file_key", "").split("_")[1:]) if entry_doc.get("file_key") else ""
+
+        if entry_doc.get("is_tabular", False):
+            entry_exp = "The data is structured as a tabular CSV DataFrame. Use the provided data to answer questions accurately.\n"
+            data_json = entry_doc.get("data_json")
+            logger.info("Tabular context detected for file_key %s", entry_doc.get("file_key"))
+            if entry_doc.get("table"):
+                context_docs.append({
+                    "table": entry_doc["table"],
+                    "context_id": str(entry_doc["_id"]),
+                    "file_key": entry_doc.get("file_key"),
+                    "column_stats": entry_doc.get("column_stats"),
+                    "sheets": entry_doc.get("sheets"),
+                    "is_tabular": True
+                })
+            elif data_json:
+                logger.info("Adding tabular entry to context_docs with data_json for file_key %s", entry_doc.get("file_key"))
+                context_docs.append({
+                    "data_json": data_json,
+                    "context_id": str(entry_doc["_id"]),
+                    "file_key": entry_doc.get("file_key"),
+                    "is_tabular": True
+                })
+            else:
+                logger.warning("No stored table or data_json found for tabular context entry with file_key %s", entry_doc.get("file_key"))
+        else:
+            entry_exp = "The data is text, it is likely a document that you have access to. Use the provided context from the file to answer question accordingly.\n"
+            if "text" in entry_doc:
+                context_docs.append(entry_doc)
+            else:
+                try:
+                    lexical_index = load_lexical_index(entry_doc.get("lexical_index"))
+                except Exception as exc:
+                    logger.warning("Ignoring unreadable lexical index of %s: %s", entry_doc["_id"], exc)
+                    lexical_index = None
+                context_docs.append({
+                    "context_id": str(entry_doc["_id"]),
+                    "lexical_index": lexical_index
+                })
+
+        context_text += f"📄 Document: '{filename}'\n{entry_doc.get('text', '')}\n{entry_exp}\n"
+
+    agent_llm = LoggingChatOpenAI(
+        model=selected_agent["model"],
+        temperature=selected_agent.get("temperature", 0.7),
+        streaming=True,
+        max_retries=3,
+    )
+    graph = create_react_agent(agent_llm, active_tools)
+    setattr(graph, "_is_react_agent", True)
+    return {
+        "graph": graph,
+        "tools": active_tools,
+        "connector_ids": {str(connector_id) for connector_id in connector_ids},
+        "connectors_text": connectors_text,
+        "context_docs": context_docs,
+        "context_text": context_text,
+    }
+
+GENERALIST_MODEL = "gpt-4o-mini"
+GENERALIST_SYSTEM_PROMPT = """You are an AI agent called Generalist in Nexa AI platform. Nexa AI is a platform for building AI agents with specialized tools and connectors for organizations to use.
+You do not have access to any specialized tools or connectors. You are a general-purpose fallback assistant that can help with a wide range of topics. You are called when no other specialized agents are available.
+Use your own knowledge and reasoning to answer the user's question to the best of your ability.
+And try to be resistant to answering questions that are too specific to the organization's knowledge base or require specialized tools and tell them that they need to create an AI agent in Nexa AI and create their own connectors, upload their own documents to get used as agent's knowledge base.
+As you are a fallback agent, You should act more like an advertiser of what Nexa AI platform can do and how users can create their own agents with specialized tools and connectors to help them with their specific needs.
+Here's an example of how they can create their own agent in Nexa AI platform:
+1. In the dashboard, go to the "Agents" section and click on "Create Agent".
+2. Provide a name and persona for your agent.
+3. Select the tools and connectors you want your agent to have access to.
+4. Upload documents to the knowledge base that your agent can use to answer questions.
+5. Save your agent and start using it to answer questions.
+
+If you cannot answer a question, suggest that the user create their own agent in Nexa AI platform.
+Always remember to promote the capabilities of Nexa AI platform and how users can create their own agents with specialized tools and connectors to help them with their specific needs.
+"""
+
+_generalist_llm = None
+_generalist_llm_lock = threading.Lock()
+
+def get_generalist_llm() -> ChatOpenAI:
+    """The Generalist's chat model, created once per process so its HTTP connection pool is shared."""
+    global _generalist_llm
+    with _generalist_llm_lock:
+        if _generalist_llm is None:
+            _generalist_llm = LoggingChatOpenAI(
+                model=GENERALIST_MODEL,
+                streaming=True,
+                temperature=0.7,
+                max_retries=3,
+            )
+        return _generalist_llm
+
+
+class GeneralistGraph:
+    """
+    Stands in for an agent graph when no agent is selected. The Generalist has no tools, so
+    its answer is streamed token by token straight from the chat model instead of through a
+    React agent, which would only yield the answer once it is complete.
+    """
+
+    _is_react_agent = True
+
+    def __init__(self, llm: ChatOpenAI):
+        self.llm = llm
+
+    async def astream(self, inputs: Dict[str, Any]):
+        async for chunk in self.llm.astream(inputs["messages"]):
+            yield chunk
+
+
 async def get_agent_graph(
     question: str,
     organization_id: ObjectId,
@@ -487,7 +905,8 @@ async def get_agent_graph(
 ) -> Dict[str, Any]:
     """
     Returns a dict with:
-    - graph: the React agent graph or fallback LLM
+    - graph: the React agent graph, or a GeneralistGraph when no agent is selected
+    - system_prompt: the system prompt for this question (cached graphs do not carry it)
     - messages: the chat history in dict form
     - final_agent_name: the agent's name
     - final_agent_id: the agent's id (str) or None
@@ -524,101 +943,18 @@ async def get_agent_graph(
     else:
         selected_agent = None
 
-    active_tools = []
-
-    async def get_search_web_tool():
-        from api.tools.web import get_search_web_tool
-        return get_search_web_tool()
-
-    builtin_tool_factories = {"search_web": get_search_web_tool}
-    connector_tool_factory_map = {
-        "google_sheet": "api.tools.google_sheet.get_google_sheet_tool",
-        "google_drive": "api.tools.google_drive.get_google_drive_tool",
-        "source_pdf": "api.tools.pdf_source.get_pdf_source_tool",
-        "source_uri": "api.tools.uri_source.get_uri_source_tool"
-    }
-
     if selected_agent:
-        import importlib
-        for tool_name in selected_agent.get("tools", []):
-            factory = builtin_tool_factories.get(tool_name)
-            if factory:
-                active_tools.append(await factory())
-
-        connector_ids = selected_agent.get("connector_ids", [])
-        if connector_ids:
-            agent_connectors = list(connectors_db.find({"_id": {"$in": connector_ids}}))
-            for connector in agent_connectors:
-                try:
-                    connector_type = connector.get("connector_type")
-                    tool_factory_path = connector_tool_factory_map.get(connector_type)
-                    if not tool_factory_path:
-                        continue
-                    module_path, func_name = tool_factory_path.rsplit(".", 1)
-                    tool_factory = getattr(importlib.import_module(module_path), func_name)
-                    names = _clean_tool_name(connector["name"], connector_type)
-                    tool_name = names["tool_name"]
-                    llm_label = names["llm_label"]
-
-                    if connector_type in ["source_pdf", "source_uri"]:
-                        active_tools.append(tool_factory(settings=connector["settings"], name=tool_name))
-                    else:
-                        active_tools.append(tool_factory(settings=connector["settings"], name=tool_name, llm_label=llm_label))
-                except Exception:
-                    pass
-
-        for tool in active_tools:
-            if hasattr(tool, "run"):
-                original_run = tool.run
-                if callable(original_run):
-                    async def logging_run(input_text, original_run=original_run, tool=tool):
-                        output = await original_run(input_text)
-                        return output
-                    tool.run = logging_run
-
-        available_sources = []
-        for tool in active_tools:
-            tool_name = getattr(tool, 'name', 'unknown')
-            llm_label = getattr(tool, 'llm_label', tool_name)
-            description = getattr(tool, 'description', 'No description provided.')
-            available_sources.append(f"- {llm_label}: {description}")
-        connectors_text = "\n".join(available_sources)
-
-        context_ids = selected_agent.get("context", [])
-
-        context_docs = []
-        context_text = ""
-        logger = logging.getLogger("context_retriever")
-        for context_entry_id in context_ids:
-            entry_doc = knowledge_db.find_one({"_id": ObjectId(context_entry_id)})
-            if not entry_doc:
-                continue
-
-            filename = "_".join(entry_doc.get("file_key", "").split("_")[1:]) if entry_doc.get("file_key") else ""
-
-            if entry_doc.get("is_tabular", False):
-                entry_exp = "The data is structured as a tabular CSV DataFrame. Use the provided data to answer questions accurately.\n"
-                data_json = entry_doc.get("data_json")
-                logger.info("Tabular context detected for file_key %s", entry_doc.get("file_key"))
-                if data_json:
-                    logger.info("Adding tabular entry to context_docs with data_json for file_key %s", entry_doc.get("file_key"))
-                    context_docs.append({
-                        "data_json": data_json,
-                        "file_key": entry_doc.get("file_key"),
-                        "is_tabular": True
-                    })
-                else:
-                    logger.warning("No data_json found for tabular context entry with file_key %s", entry_doc.get("file_key"))
-            else:
-                entry_exp = "The data is text, it is likely a document that you have access to. Use the provided context from the file to answer question accordingly.\n"
-                if "chunks" in entry_doc:
-                    context_docs.extend(entry_doc["chunks"])
-                elif "text" in entry_doc:
-                    context_docs.append(entry_doc)
-
-            context_text += f"📄 Document: '{filename}'\n{entry_doc.get('text', '')}\n{entry_exp}\n"
-
-        relevant_context = await retrieve_relevant_context(question, context_docs)
+        version = _agent_version(selected_agent)
+        setup = agent_graph_cache.get(selected_agent["_id"], version)
+        if setup is None:
+            setup = await _build_agent_setup(selected_agent, organization_id)
+            agent_graph_cache.set(selected_agent["_id"], version, setup)
+        active_tools = setup["tools"]
+        connectors_text = setup["connectors_text"]
+        context_text = setup["context_text"]
+
+        index = get_org_index(organization_id) if selected_agent.get("context") else None
+        relevant_context = await retrieve_relevant_context(question, setup["context_docs"], index=index)
 
         system_prompt = f"""
             You are an AI agent built by user in Nexa AI platform. Nexa AI is a platform for building AI agents with specialized tools and connectors for organizations to use.
@@ -663,15 +999,7 @@ async def get_agent_graph(
 
         final_agent_id = selected_agent["_id"]
         final_agent_name = selected_agent["name"]
-        agent_llm = LoggingChatOpenAI(
-            model=selected_agent["model"],
-            temperature=selected_agent.get("temperature", 0.7),
-            streaming=True,
-            max_retries=3,
-        )
-        graph = create_react_agent(agent_llm, active_tools)
-        setattr(graph, "_is_react_agent", True)
-        graph.system_prompt = system_prompt
+        graph = setup["graph"]
 
         messages_dict = convert_messages_to_dict(messages_list)
 
@@ -687,40 +1015,15 @@ async def get_agent_graph(
         }
         return {
             "graph": graph,
+            "system_prompt": system_prompt,
             "messages": messages_dict,
             "final_agent_name": final_agent_name,
             "final_agent_id": str(final_agent_id) if final_agent_id else None,
             "token_usage": token_usage
         }
     else:
-        # Remove streaming token handler logic, instead count tokens after composing prompt and completion
-        agent_llm = LoggingChatOpenAI(
-            model="gpt-4o-mini",
-            streaming=True,
-            temperature=0.7,
-            max_retries=3,
-        )
-        graph = create_react_agent(agent_llm, tools=[])
-        setattr(graph, "_is_react_agent", True)
-        system_prompt = f"""
-            You are an AI agent called Generalist in Nexa AI platform. Nexa AI is a platform for building AI agents with specialized tools and connectors for organizations to use.
-            You do not have access to any specialized tools or connectors. You are a general-purpose fallback assistant that can help with a wide range of topics. You are called when no other specialized agents are available.
-            Use your own knowledge and reasoning to answer the user's question to the best of your ability.
-            And try to be resistant to answering questions that are too specific to the organization's knowledge base or require specialized tools and tell them that they need to create an AI agent in Nexa AI and create their own connectors, upload their own documents to get used as agent's knowledge base.
-            As you are a fallback agent, You should act more like an advertiser of what Nexa AI platform can do and how users can create their own agents with specialized tools and connectors to help them with their specific needs.
-            Here's an example of how they can create their own agent in Nexa AI platform:
-            1. In the dashboard, go to the "Agents" section and click on "Create Agent".
-            2. Provide a name and persona for your agent.
-            3. Select the tools and connectors you want your agent to have access to.
-            4. Upload documents to the knowledge base that your agent can use to answer questions.
-            5. Save your agent and start using it to answer questions.
-            
-            If you cannot answer a question, suggest that the user create their own agent in Nexa AI platform.
-            Always remember to promote the capabilities of Nexa AI platform and how users can create their own agents with specialized tools and connectors to help them with their specific needs.
-
-            Also, User's Organization ID is {organization_id}.
-        """
-        graph.system_prompt = system_prompt
+        graph = GeneralistGraph(get_generalist_llm())
+        system_prompt = f"{GENERALIST_SYSTEM_PROMPT}\nAlso, User's Organization ID is {organization_id}."
 
         messages_list = [SystemMessage(content=system_prompt)]
         for entry in chat_history:
@@ -747,6 +1050,7 @@ async def get_agent_graph(
 
         return {
             "graph": graph,
+            "system_prompt": system_prompt,
             "messages": messages_dict,
             "final_agent_name": "Generalist",
             "final_agent_id": None,
@@ -21,6 +21,9 @@ sessions_db = nexa_db.sessions
 agents_db = nexa_db.agents
 connectors_db = nexa_db.connectors
 knowledge_db = nexa_db.embeddings
+knowledge_chunks_db = nexa_db.knowledge_chunks
+embedding_store_db = nexa_db.embedding_store
+index_locks_db = nexa_db.index_locks
 users_db = nexa_db.users
 prospective_users_db = nexa_db.prospective_users
 orgs_db = nexa_db.organizations
\ No newline at end of file
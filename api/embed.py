@@ -1,32 +1,301 @@
 from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import CharacterTextSplitter
 from langchain_community.callbacks.manager import get_openai_callback
+from collections import OrderedDict
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
 from datetime import datetime
+from typing import Iterable, Iterator
 
+import os
+import re
+import hashlib
+import logging
+import time
+import functools
+import threading
+import unicodedata
+import tiktoken
 import numpy as np
 import pandas as pd
 
-from api.database import knowledge_db
+from api.database import knowledge_db, knowledge_chunks_db, embedding_store_db
+from api.lexical import LexicalIndex, delete_lexical_index, save_lexical_index
+
+logger = logging.getLogger(__name__)
 
 embedding_model = OpenAIEmbeddings()
 
-def embed(text: str, chunk_size: int = 1000, overlap: int = 200) -> list:
-    text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    chunks = text_splitter.split_text(text)
-    
-    if not chunks:
-        return []
+# Chunks sent to the embedding API per request while streaming a document in.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Chunk size and overlap are counted in cl100k_base tokens, so Persian and English text
+# get comparable chunks.
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+QUESTION_MAX_TOKENS = 8000
+_UNIT_BOUNDARY = re.compile(r"(?<=[.!?؟…])[ \t]+|[ \t]*\n\s*")
+
+class EmbeddingCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# Chunk embeddings are stored as BSON Binary holding little-endian floats; the user-defined
+# subtype records the element width. Documents written before this still hold lists of doubles.
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+_EMBEDDING_SUBTYPES = {"float32": USER_DEFINED_SUBTYPE, "float16": USER_DEFINED_SUBTYPE + 1}
+_EMBEDDING_DTYPES = {USER_DEFINED_SUBTYPE: np.dtype("<f4"), USER_DEFINED_SUBTYPE + 1: np.dtype("<f2")}
+
+def encode_embedding(embedding, dtype: str = None) -> Binary:
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype not in _EMBEDDING_SUBTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    if isinstance(embedding, Binary) and embedding.subtype == _EMBEDDING_SUBTYPES[dtype]:
+        return embedding
+    array = decode_embedding(embedding).astype(_EMBEDDING_DTYPES[_EMBEDDING_SUBTYPES[dtype]])
+    return Binary(array.tobytes(), _EMBEDDING_SUBTYPES[dtype])
+
+def decode_embedding(value) -> np.ndarray:
+    """
+    Decode a stored embedding into a 1-D array. Packed binary values are viewed in place with
+    np.frombuffer (read-only, no copy); legacy lists of doubles are converted to float32.
+    """
+    if isinstance(value, Binary) and value.subtype in _EMBEDDING_DTYPES:
+        return np.frombuffer(value, dtype=_EMBEDDING_DTYPES[value.subtype])
+    if value is None:
+        return np.empty(0, dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+question_embedding_cache = EmbeddingCache(
+    maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("EMBEDDING_CACHE_TTL", "3600")),
+)
+
+def _normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", question)).strip()
+
+def embed(
+    text: str,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    stats: dict = None,
+    use_store: bool = True,
+) -> list:
+    batches = embed_stream([text], chunk_tokens, overlap_tokens, stats=stats, use_store=use_store)
+    return [chunk for batch in batches for chunk in batch]
+
+def _content_hash(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+def embed_texts(texts: list, stats: dict = None) -> list:
+    """
+    Embed texts through the content-addressed embedding store, keyed by SHA-256 of the model
+    name and text. Texts already in the store reuse their vector; only unseen ones are sent to
+    OpenAI. `stats`, if given, has its "reused" and "embedded" counts increased.
+    """
+    model = embedding_model.model
+    keys = [_content_hash(text, model) for text in texts]
+    vectors = {}
+    try:
+        for document in embedding_store_db.find({"_id": {"$in": list(set(keys))}}, {"embedding": 1}):
+            vectors[document["_id"]] = decode_embedding(document["embedding"])
+    except Exception as e:
+        logger.warning(f"Embedding store lookup failed, embedding {len(texts)} chunks from scratch: {e}")
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        new_documents = []
+        for key, vector in zip(missing, embedding_model.embed_documents(list(missing.values()))):
+            vectors[key] = vector
+            new_documents.append({
+                "_id": key,
+                "model": model,
+                "embedding": encode_embedding(vector),
+                "created_at": datetime.utcnow(),
+            })
+        try:
+            embedding_store_db.insert_many(new_documents, ordered=False)
+        except BulkWriteError:
+            # Another upload stored some of the same chunks first; their vectors are identical.
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to add {len(new_documents)} embeddings to the store: {e}")
+
+    if stats is not None:
+        stats["embedded"] = stats.get("embedded", 0) + len(missing)
+        stats["reused"] = stats.get("reused", 0) + len(texts) - len(missing)
+    return [vectors[key] for key in keys]
+
+def _iter_text_units(pieces: Iterable[str]) -> Iterator[tuple]:
+    # Cut streamed text into sentences (or lines) and yield them as (text, ends_paragraph),
+    # keeping the trailing whitespace so joining units gives back the original text. A boundary
+    # touching the end of the buffer may still grow with the next piece, so it waits.
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        start = 0
+        for match in _UNIT_BOUNDARY.finditer(buffer):
+            if match.end() == len(buffer):
+                break
+            yield buffer[start:match.end()], match.group().count("\n") > 1
+            start = match.end()
+        buffer = buffer[start:]
+    if buffer:
+        yield buffer, True
+
+def _split_oversized_unit(text: str, chunk_tokens: int) -> Iterator[tuple]:
+    # A sentence longer than the budget is packed word by word; a single word longer than
+    # the budget is cut on token boundaries.
+    encoding = _token_encoding()
+    words, words_tokens = [], 0
+    for word in re.findall(r"\S+\s*|\s+", text):
+        tokens = count_tokens(word)
+        if tokens > chunk_tokens:
+            if words:
+                yield "".join(words), words_tokens
+                words, words_tokens = [], 0
+            ids = encoding.encode(word, disallowed_special=())
+            for i in range(0, len(ids), chunk_tokens):
+                yield encoding.decode(ids[i:i + chunk_tokens]), len(ids[i:i + chunk_tokens])
+            continue
+        if words and words_tokens + tokens > chunk_tokens:
+            yield "".join(words), words_tokens
+            words, words_tokens = [], 0
+        words.append(word)
+        words_tokens += tokens
+    if words:
+        yield "".join(words), words_tokens
+
+def _chunk_stream(pieces: Iterable[str], chunk_tokens: int, overlap_tokens: int) -> Iterator[dict]:
+    """
+    Pack sentences into chunks of at most `chunk_tokens` tokens. A chunk also ends at a
+    paragraph break once it is half full; otherwise the next chunk starts with up to
+    `overlap_tokens` tokens of trailing sentences from the previous one.
+    """
+    current, current_tokens = [], 0
+
+    def flush(keep_overlap):
+        nonlocal current, current_tokens
+        text = "".join(unit for unit, _ in current).strip()
+        tail, tail_tokens = [], 0
+        if keep_overlap:
+            for unit, tokens in reversed(current):
+                if tail_tokens + tokens > overlap_tokens:
+                    break
+                tail.insert(0, (unit, tokens))
+                tail_tokens += tokens
+        current, current_tokens = tail, tail_tokens
+        return {"text": text, "token_count": count_tokens(text)} if text else None
 
-    embeddings = embedding_model.embed_documents(chunks)
-    
-    return [{"text": chunk, "embedding": emb} for chunk, emb in zip(chunks, embeddings)]
+    for unit, ends_paragraph in _iter_text_units(pieces):
+        tokens = count_tokens(unit)
+        parts = [(unit, tokens)] if tokens <= chunk_tokens else _split_oversized_unit(unit, chunk_tokens)
+        for part, part_tokens in parts:
+            if current and current_tokens + part_tokens > chunk_tokens:
+                chunk = flush(keep_overlap=True)
+                if chunk:
+                    yield chunk
+                if current_tokens + part_tokens > chunk_tokens:
+                    current, current_tokens = [], 0
+            current.append((part, part_tokens))
+            current_tokens += part_tokens
+        if ends_paragraph and current_tokens >= chunk_tokens // 2:
+            chunk = flush(keep_overlap=False)
+            if chunk:
+                yield chunk
+    if current:
+        chunk = flush(keep_overlap=False)
+        if chunk:
+            yield chunk
+
+def embed_stream(
+    pieces: Iterable[str],
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    batch_size: int = EMBED_BATCH_SIZE,
+    stats: dict = None,
+    use_store: bool = True,
+) -> Iterator[list]:
+    """
+    Chunk and embed a stream of text pieces (e.g. PDF pages), yielding lists of up to
+    `batch_size` {"text", "embedding", "token_count"} chunks as soon as they are embedded.
+    With `use_store`, vectors come from the embedding store where possible (see embed_texts).
+    """
+    def _embedded(batch):
+        texts = [chunk["text"] for chunk in batch]
+        embeddings = embed_texts(texts, stats) if use_store else embedding_model.embed_documents(texts)
+        return [dict(chunk, embedding=emb) for chunk, emb in zip(batch, embeddings)]
+
+    batch = []
+    for chunk in _chunk_stream(pieces, chunk_tokens, overlap_tokens):
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield _embedded(batch)
+            batch = []
+    if batch:
+        yield _embedded(batch)
 
 def embed_question(question: str) -> list:
-    chunks = embed(question, chunk_size=2000, overlap=0)
+    """
+    Embed a query string. Results are cached on the normalized text and the embedding model,
+    so repeated questions (e.g. suggested prompts) skip the OpenAI round trip.
+    """
+    normalized = _normalize_question(question)
+    cache_key = (embedding_model.model, normalized)
+    cached = question_embedding_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    chunks = embed(normalized, QUESTION_MAX_TOKENS, 0, use_store=False)
     if not chunks:
         return []
-    return chunks[0]["embedding"]
+    embedding = chunks[0]["embedding"]
+    question_embedding_cache.set(cache_key, tuple(embedding))
+    return embedding
 
 def embed_tabular(df: pd.DataFrame, org_id: ObjectId) -> ObjectId:
     columns = df.columns.tolist()
@@ -63,6 +332,143 @@ def similarity(vec1, vec2):
     similarity = dot_product / (norm1 * norm2)
     return similarity
 
+def embedding_matrix(embeddings: list) -> np.ndarray:
+    """Stack embeddings into a float32 matrix whose rows are L2-normalized."""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2:
+        return np.empty((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_similar(query_embedding, matrix: np.ndarray, k: int) -> list:
+    """
+    Score every row of a pre-normalized embedding matrix against the query with a single
+    matrix-vector product and return the best `k` rows as (row_index, score) pairs,
+    highest score first. Ties keep their original row order, like a stable sort would.
+    """
+    if k <= 0 or matrix.size == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    if query_norm == 0:
+        scores = np.zeros(matrix.shape[0], dtype=np.float32)
+    else:
+        scores = matrix @ (query / query_norm)
+
+    if k < scores.shape[0]:
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = np.lexsort((candidates, -scores[candidates]))[:k]
+    return [(int(candidates[i]), float(scores[candidates[i]])) for i in order]
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str) -> int:
+    return len(_token_encoding().encode(text, disallowed_special=()))
+
+def ensure_chunk_indexes():
+    knowledge_chunks_db.create_index([("context_id", ASCENDING), ("ordinal", ASCENDING)], unique=True)
+    knowledge_chunks_db.create_index([("org", ASCENDING), ("context_id", ASCENDING), ("ordinal", ASCENDING)])
+    # Only chunks still waiting for the embedding backfill are in this index.
+    knowledge_chunks_db.create_index(
+        [("needs_embedding", ASCENDING), ("_id", ASCENDING)],
+        partialFilterExpression={"needs_embedding": True},
+    )
+
+def save_chunks(context_id: ObjectId, org_id: ObjectId, chunks: list, batch_size: int = 500, start_ordinal: int = 0) -> int:
+    """
+    Write one knowledge_chunks document per chunk; `ordinal` is the chunk's position in `chunks`,
+    offset by `start_ordinal` when a document is saved in several calls.
+    """
+    saved = 0
+    batch = []
+    for ordinal, chunk in enumerate(chunks, start=start_ordinal):
+        text = chunk.get("text", "")
+        document = {
+            "context_id": context_id,
+            "org": org_id,
+            "ordinal": ordinal,
+            "text": text,
+            "token_count": chunk.get("token_count") or count_tokens(text),
+        }
+        if chunk.get("embedding") is not None and len(chunk["embedding"]):
+            document["embedding"] = encode_embedding(chunk["embedding"])
+        else:
+            document["needs_embedding"] = True
+        batch.append(document)
+        if len(batch) >= batch_size:
+            saved += len(knowledge_chunks_db.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        saved += len(knowledge_chunks_db.insert_many(batch, ordered=False).inserted_ids)
+    return saved
+
+def iter_chunk_batches(
+    context_ids,
+    with_embeddings: bool = False,
+    batch_size: int = 500,
+    org_id: ObjectId = None,
+):
+    """
+    Stream the chunks of one or more context documents in ordinal order, `batch_size` at a time.
+    Embeddings are only read from MongoDB when `with_embeddings` is set.
+    """
+    if isinstance(context_ids, (ObjectId, str)):
+        context_ids = [context_ids]
+    query = {"context_id": {"$in": [ObjectId(cid) for cid in context_ids]}}
+    if org_id is not None:
+        query["org"] = org_id
+    projection = {"_id": 0, "context_id": 1, "ordinal": 1, "text": 1, "token_count": 1}
+    if with_embeddings:
+        projection["embedding"] = 1
+    cursor = knowledge_chunks_db.find(query, projection).sort(
+        [("context_id", ASCENDING), ("ordinal", ASCENDING)]
+    ).batch_size(batch_size)
+    batch = []
+    for chunk in cursor:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_chunks(context_ids, with_embeddings: bool = False, batch_size: int = 500, org_id: ObjectId = None):
+    for batch in iter_chunk_batches(context_ids, with_embeddings, batch_size, org_id):
+        yield from batch
+
+def get_chunks(chunk_refs: list, with_embeddings: bool = False) -> list:
+    """Fetch specific chunks, given as (context_id, ordinal) pairs, in one query."""
+    ordinals_by_context = {}
+    for context_id, ordinal in chunk_refs:
+        ordinals_by_context.setdefault(str(context_id), []).append(int(ordinal))
+    if not ordinals_by_context:
+        return []
+    query = {"$or": [
+        {"context_id": ObjectId(context_id), "ordinal": {"$in": ordinals}}
+        for context_id, ordinals in ordinals_by_context.items()
+    ]}
+    projection = {"_id": 0, "context_id": 1, "ordinal": 1, "text": 1}
+    if with_embeddings:
+        projection["embedding"] = 1
+    return list(knowledge_chunks_db.find(query, projection))
+
+def get_chunk_texts(chunk_refs: list) -> dict:
+    """Fetch the text of specific chunks, given as (context_id, ordinal) pairs, keyed the same way."""
+    return {
+        (str(chunk["context_id"]), chunk["ordinal"]): chunk.get("text", "")
+        for chunk in get_chunks(chunk_refs)
+    }
+
+def delete_chunks(context_ids: list) -> int:
+    result = knowledge_chunks_db.delete_many({"context_id": {"$in": [ObjectId(cid) for cid in context_ids]}})
+    return result.deleted_count
+
 def save_embedding(
     chunks_with_embeddings: list,
     org_id: ObjectId,
@@ -72,7 +478,7 @@ def save_embedding(
 ) -> ObjectId:
     document = {
         "org": org_id,
-        "chunks": chunks_with_embeddings,
+        "chunk_count": len(chunks_with_embeddings),
         "created_at": datetime.utcnow(),
         "is_tabular": is_tabular
     }
@@ -81,14 +487,66 @@ def save_embedding(
     if metadata:
         document.update(metadata)
     result = knowledge_db.insert_one(document)
+    save_chunks(result.inserted_id, org_id, chunks_with_embeddings)
+    if not is_tabular:
+        lexical_index = LexicalIndex.build(chunk.get("text", "") for chunk in chunks_with_embeddings)
+        knowledge_db.update_one(
+            {"_id": result.inserted_id},
+            {"$set": {"lexical_index": save_lexical_index(result.inserted_id, lexical_index)}}
+        )
     return result.inserted_id
 
+def save_embedding_stream(
+    chunk_batches: Iterable[list],
+    org_id: ObjectId,
+    metadata: dict = None,
+    file_key: str = None,
+) -> ObjectId:
+    """
+    Like save_embedding, but for a text document whose chunks arrive in batches (see
+    embed_stream). Each batch is written as soon as it arrives; only chunk texts are kept
+    until the end, to build the lexical index. If the stream or a write fails, the document
+    and the chunks written so far are deleted before the error is re-raised. Returns None if
+    no chunk was produced.
+    """
+    context_id = None
+    texts = []
+    try:
+        for batch in chunk_batches:
+            if not batch:
+                continue
+            if context_id is None:
+                document = {"org": org_id, "chunk_count": 0, "created_at": datetime.utcnow(), "is_tabular": False}
+                if file_key is not None:
+                    document["file_key"] = file_key
+                if metadata:
+                    document.update(metadata)
+                context_id = knowledge_db.insert_one(document).inserted_id
+            save_chunks(context_id, org_id, batch, start_ordinal=len(texts))
+            texts.extend(chunk.get("text", "") for chunk in batch)
+        if context_id is not None:
+            knowledge_db.update_one(
+                {"_id": context_id},
+                {"$set": {
+                    "chunk_count": len(texts),
+                    "lexical_index": save_lexical_index(context_id, LexicalIndex.build(texts)),
+                }}
+            )
+    except Exception:
+        if context_id is not None:
+            logger.warning(f"Removing partially saved document {context_id} after a failed upload")
+            knowledge_db.delete_one({"_id": context_id})
+            delete_chunks([context_id])
+            delete_lexical_index(context_id)
+        raise
+    return context_id
+
 def get_embeddings(document_id: ObjectId) -> list:
-    result = knowledge_db.find_one({"_id": document_id})
-    if result and "chunks" in result:
-        return result["chunks"]
-    return []
+    return list(iter_chunks(document_id, with_embeddings=True))
 
 def delete_embeddings(document_id: ObjectId, org_id: ObjectId):
     result = knowledge_db.delete_one({"_id": document_id, "org": org_id})
-    return result.deleted_count > 0
\ No newline at end of file
+    if result.deleted_count > 0:
+        delete_chunks([document_id])
+        delete_lexical_index(document_id)
+    return result.deleted_count > 0
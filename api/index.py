@@ -0,0 +1,385 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import io
+import os
+import time
+import uuid
+import logging
+import threading
+
+import numpy as np
+from minio.error import S3Error
+from pymongo.errors import DuplicateKeyError
+
+from api.database import index_locks_db, minio_client
+
+logger = logging.getLogger(__name__)
+
+INDEX_BUCKET = "context-files"
+INDEX_PREFIX = "vector_index"
+INDEX_REFRESH_SECONDS = int(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "60"))
+# An org's index is rewritten under a lock document in index_locks. A lock older than
+# INDEX_LOCK_TTL_SECONDS belongs to a writer that died and can be taken over.
+INDEX_LOCK_TTL_SECONDS = int(os.getenv("VECTOR_INDEX_LOCK_TTL_SECONDS", "300"))
+INDEX_LOCK_WAIT_SECONDS = float(os.getenv("VECTOR_INDEX_LOCK_WAIT_SECONDS", "60"))
+INDEX_LOCK_POLL_SECONDS = 0.1
+
+# Below TRAIN_MIN_VECTORS the index is a flat matrix; above it, vectors are bucketed by a
+# k-means coarse quantizer (IVF) and only the closest NPROBE_RATIO of the lists are scanned.
+TRAIN_MIN_VECTORS = 2048
+EXACT_SEARCH_LIMIT = 4096
+RETRAIN_GROWTH = 2.0
+NPROBE_RATIO = 0.1
+KMEANS_ITERATIONS = 12
+ASSIGN_BATCH = 8192
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class ChunkIndex:
+    """
+    Inverted-file (IVF) approximate nearest neighbour index over the knowledge chunks of one
+    organization. Rows are addressed by (context_id, ordinal), where ordinal is the chunk's
+    position within its context document, so callers can map hits back to chunk text.
+    """
+
+    def __init__(self, dim: int = 0):
+        self.dim = dim
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.codes = np.empty(0, dtype=np.int32)
+        self.ordinals = np.empty(0, dtype=np.int32)
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.centroids = None
+        self.trained_size = 0
+        self.contexts: List[str] = []
+        self._context_codes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def has_context(self, context_id) -> bool:
+        return str(context_id) in self._context_codes
+
+    def add(self, context_id, embeddings: list, ordinals: List[int]):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] == 0:
+            return
+        with self._lock:
+            if len(self) == 0 and self.dim != matrix.shape[1]:
+                self.dim = matrix.shape[1]
+                self.vectors = np.empty((0, self.dim), dtype=np.float32)
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"embedding has {matrix.shape[1]} dimensions, index expects {self.dim}")
+            if self.has_context(context_id):
+                self._remove_codes([self._context_codes[str(context_id)]])
+
+            code = len(self.contexts)
+            self.contexts.append(str(context_id))
+            self._context_codes[str(context_id)] = code
+            matrix = _normalize(matrix)
+
+            self.vectors = np.vstack([self.vectors, matrix])
+            self.codes = np.concatenate([self.codes, np.full(matrix.shape[0], code, dtype=np.int32)])
+            self.ordinals = np.concatenate([self.ordinals, np.asarray(ordinals, dtype=np.int32)])
+            if self.centroids is not None:
+                self.assignments = np.concatenate([self.assignments, self._assign(matrix)])
+
+            if len(self) >= TRAIN_MIN_VECTORS and (
+                self.centroids is None or len(self) > self.trained_size * RETRAIN_GROWTH
+            ):
+                self._train()
+
+    def remove(self, context_ids: list) -> int:
+        with self._lock:
+            codes = [self._context_codes[str(cid)] for cid in context_ids if self.has_context(cid)]
+            if not codes:
+                return 0
+            return self._remove_codes(codes)
+
+    def _remove_codes(self, codes: List[int]) -> int:
+        keep = ~np.isin(self.codes, codes)
+        removed = int(len(self) - keep.sum())
+        self.vectors = self.vectors[keep]
+        self.codes = self.codes[keep]
+        self.ordinals = self.ordinals[keep]
+        if self.centroids is not None:
+            self.assignments = self.assignments[keep]
+        for code in codes:
+            self.contexts[code] = ""
+        self._compact_contexts()
+        return removed
+
+    def _compact_contexts(self):
+        """Renumber the context codes so `contexts` holds no slots of removed contexts."""
+        live = [code for code, context_id in enumerate(self.contexts) if context_id]
+        if len(live) < len(self.contexts):
+            remap = np.full(len(self.contexts), -1, dtype=np.int32)
+            remap[live] = np.arange(len(live), dtype=np.int32)
+            self.codes = remap[self.codes]
+            self.contexts = [self.contexts[code] for code in live]
+        self._context_codes = {context_id: code for code, context_id in enumerate(self.contexts)}
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        assignments = np.empty(matrix.shape[0], dtype=np.int32)
+        for start in range(0, matrix.shape[0], ASSIGN_BATCH):
+            batch = matrix[start:start + ASSIGN_BATCH]
+            assignments[start:start + ASSIGN_BATCH] = np.argmax(batch @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self):
+        n = len(self)
+        nlist = int(np.clip(np.sqrt(n), 16, 4096))
+        rng = np.random.default_rng(n)
+        sample_size = min(n, nlist * 64)
+        sample = self.vectors[rng.choice(n, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = self._assign(self.vectors)
+        self.trained_size = n
+        logger.info("Trained vector index with %d lists over %d vectors.", nlist, n)
+
+    def search(self, query_embedding, k: int, context_ids: Optional[list] = None) -> List[Tuple[str, int, float]]:
+        """
+        Return up to `k` (context_id, ordinal, score) hits with the highest cosine similarity,
+        restricted to `context_ids` when given.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        with self._lock:
+            if k <= 0 or len(self) == 0 or query.shape != (self.dim,) or query_norm == 0:
+                return []
+            query = query / query_norm
+            if context_ids is None:
+                mask = np.ones(len(self), dtype=bool)
+            else:
+                allowed = [self._context_codes[str(cid)] for cid in context_ids if self.has_context(cid)]
+                mask = np.isin(self.codes, allowed)
+
+            candidates = np.flatnonzero(mask)
+            if self.centroids is not None and candidates.shape[0] > EXACT_SEARCH_LIMIT:
+                centroid_order = np.argsort(-(self.centroids @ query))
+                nprobe = max(1, int(len(centroid_order) * NPROBE_RATIO))
+                probed = np.flatnonzero(mask & np.isin(self.assignments, centroid_order[:nprobe]))
+                while probed.shape[0] < k and nprobe < len(centroid_order):
+                    nprobe *= 2
+                    probed = np.flatnonzero(mask & np.isin(self.assignments, centroid_order[:nprobe]))
+                candidates = probed
+
+            if candidates.shape[0] == 0:
+                return []
+            scores = self.vectors[candidates] @ query
+            k = min(k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.lexsort((candidates[top], -scores[top]))]
+            return [
+                (self.contexts[self.codes[candidates[i]]], int(self.ordinals[candidates[i]]), float(scores[i]))
+                for i in top
+            ]
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            buffer = io.BytesIO()
+            np.savez(
+                buffer,
+                vectors=self.vectors,
+                codes=self.codes,
+                ordinals=self.ordinals,
+                assignments=self.assignments,
+                centroids=self.centroids if self.centroids is not None else np.empty((0, self.dim), dtype=np.float32),
+                contexts=np.array(self.contexts, dtype=str),
+                trained_size=np.array(self.trained_size),
+            )
+            return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ChunkIndex":
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            index = cls(dim=arrays["vectors"].shape[1])
+            index.vectors = arrays["vectors"]
+            index.codes = arrays["codes"]
+            index.ordinals = arrays["ordinals"]
+            index.assignments = arrays["assignments"]
+            index.centroids = arrays["centroids"] if arrays["centroids"].shape[0] else None
+            index.contexts = arrays["contexts"].tolist()
+            index.trained_size = int(arrays["trained_size"])
+        index._compact_contexts()
+        return index
+
+
+# Process-wide registry. Each worker keeps its own copy and re-reads the persisted index when
+# the object in MinIO changes. A stale copy is still safe to query: contexts it does not know
+# about are scored exactly by the caller, and hits are always filtered by the agent's context ids.
+# Writers hold the org's lock (see _org_index_lock) and reload the persisted object before
+# changing it, so one worker never overwrites another worker's additions or removals.
+_org_indexes: Dict[str, dict] = {}
+_org_locks = defaultdict(threading.Lock)
+
+
+def _index_object_name(org_key: str) -> str:
+    return f"{INDEX_PREFIX}/{org_key}.npz"
+
+
+def get_org_index(org_id, refresh: bool = False) -> Optional[ChunkIndex]:
+    """
+    The org's index, checked against the persisted object at most every INDEX_REFRESH_SECONDS.
+    With `refresh` the object is always checked, and an error reading it is raised instead
+    of falling back to the cached copy, because the caller is about to overwrite it.
+    """
+    org_key = str(org_id)
+    cached = _org_indexes.get(org_key)
+    now = time.monotonic()
+    if not refresh and cached and now - cached["checked_at"] < INDEX_REFRESH_SECONDS:
+        return cached["index"]
+
+    index = cached["index"] if cached else None
+    etag = cached["etag"] if cached else None
+    try:
+        stat = minio_client.stat_object(INDEX_BUCKET, _index_object_name(org_key))
+        if stat.etag != etag:
+            response = minio_client.get_object(INDEX_BUCKET, _index_object_name(org_key))
+            try:
+                index = ChunkIndex.from_bytes(response.read())
+            finally:
+                response.close()
+                response.release_conn()
+            etag = stat.etag
+    except Exception as e:
+        if refresh and not (isinstance(e, S3Error) and e.code == "NoSuchKey"):
+            raise
+        logger.debug(f"No persisted vector index for org {org_key}: {e}")
+
+    _org_indexes[org_key] = {"index": index, "etag": etag, "checked_at": now}
+    return index
+
+
+def _save_org_index(org_key: str, index: ChunkIndex):
+    data = index.to_bytes()
+    try:
+        result = minio_client.put_object(
+            bucket_name=INDEX_BUCKET,
+            object_name=_index_object_name(org_key),
+            data=io.BytesIO(data),
+            length=len(data),
+            content_type="application/octet-stream",
+        )
+    except Exception:
+        # The cached copy was changed in place and no longer matches the stored object.
+        _org_indexes.pop(org_key, None)
+        raise
+    _org_indexes[org_key] = {"index": index, "etag": result.etag, "checked_at": time.monotonic()}
+
+
+@contextmanager
+def _org_index_lock(org_key: str):
+    """
+    Hold the write lock of an org's index across worker processes: a document in index_locks
+    keyed by the org. A writer waits up to INDEX_LOCK_WAIT_SECONDS for another to finish.
+    """
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + INDEX_LOCK_WAIT_SECONDS
+    with _org_locks[org_key]:
+        while True:
+            now = datetime.utcnow()
+            lock = {"owner": owner, "expires_at": now + timedelta(seconds=INDEX_LOCK_TTL_SECONDS)}
+            try:
+                index_locks_db.insert_one({"_id": org_key, **lock})
+                break
+            except DuplicateKeyError:
+                taken = index_locks_db.update_one({"_id": org_key, "expires_at": {"$lt": now}}, {"$set": lock})
+                if taken.modified_count:
+                    logger.warning(f"Took over an expired vector index lock of org {org_key}")
+                    break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for the vector index lock of org {org_key}")
+            time.sleep(INDEX_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            index_locks_db.delete_one({"_id": org_key, "owner": owner})
+
+
+def add_to_org_index(org_id, context_id, chunks):
+    """
+    Index the embedded, non-empty chunks of a freshly saved context document. `chunks` may be
+    the embedded chunk list or chunks streamed back from knowledge_chunks, which carry their
+    own ordinal and packed embedding.
+    """
+    from api.embed import decode_embedding
+
+    org_key = str(org_id)
+    ordinals, embeddings = [], []
+    for position, chunk in enumerate(chunks):
+        embedding = decode_embedding(chunk.get("embedding"))
+        if embedding.size and chunk.get("text", "").strip():
+            ordinals.append(chunk.get("ordinal", position))
+            embeddings.append(embedding)
+    if not embeddings:
+        return
+    with _org_index_lock(org_key):
+        index = get_org_index(org_key, refresh=True) or ChunkIndex()
+        index.add(context_id, embeddings, ordinals)
+        _save_org_index(org_key, index)
+    logger.info(f"Indexed {len(embeddings)} chunks of context {context_id} for org {org_key}")
+
+
+def remove_from_org_index(org_id, context_ids: list):
+    org_key = str(org_id)
+    with _org_index_lock(org_key):
+        index = get_org_index(org_key, refresh=True)
+        if index is None or not index.remove(context_ids):
+            return
+        _save_org_index(org_key, index)
+    logger.info(f"Removed contexts {[str(cid) for cid in context_ids]} from vector index of org {org_key}")
+
+
+def rebuild_org_index(org_id) -> ChunkIndex:
+    """
+    Build an org's index from scratch out of the embedded chunks of its text context documents.
+    Tabular documents are left out, as they are when documents are indexed on upload.
+    """
+    from itertools import groupby
+    from api.database import knowledge_chunks_db, knowledge_db
+    from api.embed import decode_embedding
+
+    org_key = str(org_id)
+    index = ChunkIndex()
+    context_ids = [doc["_id"] for doc in knowledge_db.find({"org": org_id, "is_tabular": {"$ne": True}}, {"_id": 1})]
+    cursor = knowledge_chunks_db.find(
+        {"org": org_id, "context_id": {"$in": context_ids}, "embedding": {"$exists": True}},
+        {"_id": 0, "context_id": 1, "ordinal": 1, "text": 1, "embedding": 1},
+    ).sort([("context_id", 1), ("ordinal", 1)])
+    for context_id, chunks in groupby(cursor, key=lambda c: c["context_id"]):
+        chunks = [c for c in chunks if c.get("text", "").strip()]
+        if chunks:
+            index.add(context_id, [decode_embedding(c["embedding"]) for c in chunks], [c["ordinal"] for c in chunks])
+    with _org_index_lock(org_key):
+        _save_org_index(org_key, index)
+    logger.info(f"Rebuilt vector index for org {org_key}: {len(index)} chunks")
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    from bson import ObjectId
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rebuild the persisted vector index of one or more organizations.")
+    parser.add_argument("org_ids", nargs="+")
+    for org_id in parser.parse_args().org_ids:
+        rebuild_org_index(ObjectId(org_id))
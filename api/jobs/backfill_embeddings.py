@@ -0,0 +1,102 @@
+"""
+Embed knowledge chunks that were stored without an embedding. The query path never embeds
+document chunks, so until this job runs such chunks are only reachable through lexical search.
+
+Chunks waiting for an embedding carry `needs_embedding: true`, which is covered by a partial
+index. Chunks written before that flag existed can be flagged with --mark-missing (a one-off
+collection scan). Embedded contexts are re-added to their organization's vector index.
+
+Usage:
+    python -m api.jobs.backfill_embeddings [--mark-missing] [--batch-size 256] [--dry-run]
+"""
+from pymongo import UpdateOne
+
+import argparse
+import logging
+
+from api.database import knowledge_chunks_db
+from api.embed import ensure_chunk_indexes, embed_texts, encode_embedding, iter_chunks
+from api.index import add_to_org_index
+
+logger = logging.getLogger(__name__)
+
+
+def mark_missing_embeddings() -> int:
+    result = knowledge_chunks_db.update_many(
+        {
+            "needs_embedding": {"$exists": False},
+            "$or": [{"embedding": None}, {"embedding": {"$size": 0}}],
+        },
+        {"$set": {"needs_embedding": True}},
+    )
+    return result.modified_count
+
+
+def backfill_embeddings(batch_size: int = 256, dry_run: bool = False) -> dict:
+    """Embed flagged chunks `batch_size` at a time, walking the partial index in _id order."""
+    stats = {"chunks": 0, "embedded": 0, "reused": 0, "contexts": 0}
+    contexts = {}
+    last_id = None
+    while True:
+        query = {"needs_embedding": True}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(
+            knowledge_chunks_db.find(query, {"context_id": 1, "org": 1, "text": 1})
+            .sort("_id", 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        stats["chunks"] += len(batch)
+        if dry_run:
+            continue
+
+        embeddable = [chunk for chunk in batch if (chunk.get("text") or "").strip()]
+        vectors = embed_texts([chunk["text"] for chunk in embeddable], stats) if embeddable else []
+        operations = [
+            UpdateOne(
+                {"_id": chunk["_id"]},
+                {"$set": {"embedding": encode_embedding(vector)}, "$unset": {"needs_embedding": ""}},
+            )
+            for chunk, vector in zip(embeddable, vectors)
+        ]
+        # Empty chunks have nothing to embed; just clear their flag.
+        operations.extend(
+            UpdateOne({"_id": chunk["_id"]}, {"$unset": {"needs_embedding": ""}})
+            for chunk in batch
+            if not (chunk.get("text") or "").strip()
+        )
+        knowledge_chunks_db.bulk_write(operations, ordered=False)
+        for chunk in embeddable:
+            contexts[chunk["context_id"]] = chunk.get("org")
+        logger.info(f"Backfilled {stats['chunks']} chunks so far")
+
+    for context_id, org_id in contexts.items():
+        if org_id is None:
+            continue
+        try:
+            add_to_org_index(org_id, context_id, iter_chunks(context_id, with_embeddings=True))
+        except Exception as e:
+            logger.error(f"Failed to re-index context {context_id}: {e}")
+    stats["contexts"] = len(contexts)
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Embed knowledge chunks that have no stored embedding.")
+    parser.add_argument("--mark-missing", action="store_true", help="First flag unembedded chunks written before the flag existed.")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if not args.dry_run:
+        ensure_chunk_indexes()
+    if args.mark_missing and not args.dry_run:
+        logger.info(f"Flagged {mark_missing_embeddings()} chunks without embeddings")
+    stats = backfill_embeddings(batch_size=args.batch_size, dry_run=args.dry_run)
+    logger.info(
+        f"{'Would embed' if args.dry_run else 'Processed'} {stats['chunks']} chunks: "
+        f"{stats['embedded']} newly embedded, {stats['reused']} reused, {stats['contexts']} contexts re-indexed"
+    )
@@ -0,0 +1,57 @@
+"""
+Compute the column stats (null and distinct counts, ranges, histograms, top values) of
+spreadsheet tables that were stored before they were collected at ingestion. Parquet tables
+are read one row group at a time; legacy data_json tables are parsed once. Tables whose
+stats predate histograms and top values need --rebuild.
+
+Usage:
+    python -m api.jobs.build_column_stats [--rebuild] [--dry-run]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from api.database import knowledge_db
+from api.tabular import column_stats, get_legacy_table, stored_column_stats
+
+logger = logging.getLogger(__name__)
+
+
+def build_column_stats(rebuild: bool = False, dry_run: bool = False) -> dict:
+    stats = {"documents": 0, "failed": 0}
+    query = {"is_tabular": True, "$or": [{"table": {"$exists": True}}, {"data_json": {"$exists": True}}]}
+    if not rebuild:
+        query["column_stats"] = {"$exists": False}
+    cursor = knowledge_db.find(query, {"table": 1, "data_json": 1}, no_cursor_timeout=True)
+    try:
+        for doc in cursor:
+            stats["documents"] += 1
+            if dry_run:
+                continue
+            try:
+                if doc.get("table"):
+                    result = stored_column_stats(doc["table"])
+                else:
+                    result = column_stats(get_legacy_table(str(doc["_id"]), doc["data_json"]))
+            except Exception as e:
+                logger.error(f"Failed to compute column stats of context {doc['_id']}: {e}")
+                stats["failed"] += 1
+                continue
+            knowledge_db.update_one({"_id": doc["_id"]}, {"$set": {"column_stats": result, "updated_at": datetime.utcnow()}})
+            logger.info(f"Computed column stats of context {doc['_id']}")
+    finally:
+        cursor.close()
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compute column stats for stored spreadsheet tables.")
+    parser.add_argument("--rebuild", action="store_true", help="Also recompute tables that already have stats.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    stats = build_column_stats(rebuild=args.rebuild, dry_run=args.dry_run)
+    logger.info(
+        f"{'Would compute' if args.dry_run else 'Computed'} stats of {stats['documents'] - stats['failed']} of "
+        f"{stats['documents']} tables"
+    )
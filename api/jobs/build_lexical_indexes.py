@@ -0,0 +1,55 @@
+"""
+Build the BM25 lexical index of text context documents that were ingested before lexical
+retrieval existed, or that still carry their index inline instead of as a stored object.
+Chunk texts are streamed from knowledge_chunks one document at a time.
+
+Usage:
+    python -m api.jobs.build_lexical_indexes [--rebuild] [--dry-run]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from api.database import knowledge_db
+from api.embed import iter_chunks
+from api.lexical import LexicalIndex, save_lexical_index
+
+logger = logging.getLogger(__name__)
+
+
+def build_lexical_indexes(rebuild: bool = False, dry_run: bool = False) -> dict:
+    stats = {"documents": 0, "chunks": 0}
+    query = {"is_tabular": {"$ne": True}, "chunks": {"$exists": False}}
+    if not rebuild:
+        query["lexical_index.object_name"] = {"$exists": False}
+    cursor = knowledge_db.find(query, {"_id": 1}, no_cursor_timeout=True)
+    try:
+        for doc in cursor:
+            texts = [chunk.get("text", "") for chunk in iter_chunks(doc["_id"])]
+            stats["documents"] += 1
+            stats["chunks"] += len(texts)
+            if dry_run:
+                continue
+            knowledge_db.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {
+                    "lexical_index": save_lexical_index(doc["_id"], LexicalIndex.build(texts)),
+                    "updated_at": datetime.utcnow(),
+                }}
+            )
+            logger.info(f"Indexed {len(texts)} chunks of context {doc['_id']}")
+    finally:
+        cursor.close()
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build BM25 lexical indexes for text context documents.")
+    parser.add_argument("--rebuild", action="store_true", help="Also rebuild documents that already have an index.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    stats = build_lexical_indexes(rebuild=args.rebuild, dry_run=args.dry_run)
+    logger.info(
+        f"{'Would index' if args.dry_run else 'Indexed'} {stats['chunks']} chunks from {stats['documents']} documents"
+    )
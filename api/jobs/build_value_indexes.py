@@ -0,0 +1,53 @@
+"""
+Build the normalized value index of spreadsheet tables that were stored before value indexes
+existed. Each table is read one row group at a time.
+
+Usage:
+    python -m api.jobs.build_value_indexes [--rebuild] [--dry-run]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from api.database import knowledge_db
+from api.tabular import build_value_index, save_value_index, table_cache
+
+logger = logging.getLogger(__name__)
+
+
+def build_value_indexes(rebuild: bool = False, dry_run: bool = False) -> dict:
+    stats = {"documents": 0, "failed": 0}
+    query = {"is_tabular": True, "table": {"$exists": True}}
+    if not rebuild:
+        query["table.value_index"] = {"$exists": False}
+    cursor = knowledge_db.find(query, {"table": 1}, no_cursor_timeout=True)
+    try:
+        for doc in cursor:
+            stats["documents"] += 1
+            if dry_run:
+                continue
+            try:
+                meta = save_value_index(doc["_id"], build_value_index(doc["table"]))
+            except Exception as e:
+                logger.error(f"Failed to build value index of context {doc['_id']}: {e}")
+                stats["failed"] += 1
+                continue
+            knowledge_db.update_one({"_id": doc["_id"]}, {"$set": {"table.value_index": meta, "updated_at": datetime.utcnow()}})
+            table_cache.invalidate(doc["_id"])
+            logger.info(f"Built value index of context {doc['_id']}")
+    finally:
+        cursor.close()
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build normalized value indexes for stored spreadsheet tables.")
+    parser.add_argument("--rebuild", action="store_true", help="Also rebuild tables that already have an index.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    stats = build_value_indexes(rebuild=args.rebuild, dry_run=args.dry_run)
+    logger.info(
+        f"{'Would index' if args.dry_run else 'Indexed'} {stats['documents'] - stats['failed']} of "
+        f"{stats['documents']} tables"
+    )
@@ -0,0 +1,54 @@
+"""
+Move the `chunks` arrays embedded in knowledge_db documents into the knowledge_chunks
+collection, one document per chunk, and drop the arrays from their parent documents.
+Embeddings are packed into binary on the way. Safe to re-run: a document's chunks are
+replaced, not appended. Text documents also get their BM25 lexical index built.
+
+Usage:
+    python -m api.jobs.migrate_chunks [--dry-run]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from api.database import knowledge_db
+from api.embed import ensure_chunk_indexes, save_chunks, delete_chunks
+from api.lexical import LexicalIndex, save_lexical_index
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_chunks(dry_run: bool = False) -> dict:
+    stats = {"documents": 0, "chunks": 0}
+    if not dry_run:
+        ensure_chunk_indexes()
+    cursor = knowledge_db.find({"chunks": {"$exists": True}}, {"org": 1, "chunks": 1, "is_tabular": 1}, no_cursor_timeout=True)
+    try:
+        for doc in cursor:
+            chunks = [chunk for chunk in doc.get("chunks") or [] if isinstance(chunk, dict)]
+            stats["documents"] += 1
+            stats["chunks"] += len(chunks)
+            if dry_run:
+                continue
+            delete_chunks([doc["_id"]])
+            save_chunks(doc["_id"], doc.get("org"), chunks)
+            update = {"chunk_count": len(chunks), "updated_at": datetime.utcnow()}
+            if not doc.get("is_tabular"):
+                lexical_index = LexicalIndex.build(chunk.get("text", "") for chunk in chunks)
+                update["lexical_index"] = save_lexical_index(doc["_id"], lexical_index)
+            knowledge_db.update_one({"_id": doc["_id"]}, {"$unset": {"chunks": ""}, "$set": update})
+            logger.info(f"Moved {len(chunks)} chunks of context {doc['_id']}")
+    finally:
+        cursor.close()
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Move embedded chunk arrays into the knowledge_chunks collection.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    stats = migrate_chunks(dry_run=args.dry_run)
+    logger.info(
+        f"{'Would move' if args.dry_run else 'Moved'} {stats['chunks']} chunks from {stats['documents']} documents"
+    )
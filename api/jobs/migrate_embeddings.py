@@ -0,0 +1,67 @@
+"""
+Rewrite chunk embeddings stored as BSON double arrays into packed binary floats, and repack
+binary embeddings stored with another dtype than --dtype (e.g. float32 vectors into float16).
+Embeddings already packed with the target dtype are left untouched, so the job can be re-run.
+
+Usage:
+    python -m api.jobs.migrate_embeddings [--dtype float32|float16] [--batch-size 500] [--dry-run]
+"""
+from pymongo import UpdateOne
+
+import argparse
+import logging
+
+from api.database import knowledge_chunks_db
+from api.embed import encode_embedding, EMBEDDING_STORAGE_DTYPE
+
+logger = logging.getLogger(__name__)
+
+
+def _flush(operations: list, dry_run: bool) -> int:
+    if not operations or dry_run:
+        return len(operations)
+    result = knowledge_chunks_db.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+def migrate_embeddings(dtype: str = EMBEDDING_STORAGE_DTYPE, batch_size: int = 500, dry_run: bool = False) -> dict:
+    """
+    Encode every list-typed embedding in knowledge_chunks as `dtype`, and re-encode binary ones
+    packed with another dtype, `batch_size` chunks per bulk write. MongoDB cannot filter on a
+    Binary subtype, so packed embeddings are read and compared here.
+    """
+    stats = {"chunks": 0, "migrated_chunks": 0}
+    operations = []
+    cursor = knowledge_chunks_db.find(
+        {"$or": [{"embedding": {"$type": "array"}}, {"embedding": {"$type": "binData"}}]},
+        {"embedding": 1},
+        no_cursor_timeout=True,
+    ).batch_size(batch_size)
+    try:
+        for chunk in cursor:
+            stats["chunks"] += 1
+            encoded = encode_embedding(chunk["embedding"], dtype)
+            if encoded is chunk["embedding"]:
+                continue
+            operations.append(UpdateOne({"_id": chunk["_id"]}, {"$set": {"embedding": encoded}}))
+            if len(operations) >= batch_size:
+                stats["migrated_chunks"] += _flush(operations, dry_run)
+                logger.info(f"Migrated {stats['migrated_chunks']} chunks so far")
+                operations = []
+        stats["migrated_chunks"] += _flush(operations, dry_run)
+    finally:
+        cursor.close()
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pack chunk embeddings in knowledge_chunks into BSON Binary of one dtype.")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=EMBEDDING_STORAGE_DTYPE)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    stats = migrate_embeddings(dtype=args.dtype, batch_size=args.batch_size, dry_run=args.dry_run)
+    logger.info(
+        f"{'Would migrate' if args.dry_run else 'Migrated'} {stats['migrated_chunks']} of {stats['chunks']} chunks"
+    )
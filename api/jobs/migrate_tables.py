@@ -0,0 +1,54 @@
+"""
+Move spreadsheet data stored as `data_json` on knowledge_db documents into Parquet objects in
+the context-files bucket, keeping only the table metadata and column stats in MongoDB.
+
+Usage:
+    python -m api.jobs.migrate_tables [--dry-run]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+from api.database import knowledge_db
+from api.tabular import save_table, column_stats
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_tables(dry_run: bool = False) -> dict:
+    stats = {"documents": 0, "migrated": 0, "failed": 0}
+    cursor = knowledge_db.find({"data_json": {"$exists": True}}, {"data_json": 1}, no_cursor_timeout=True)
+    try:
+        for doc in cursor:
+            stats["documents"] += 1
+            if dry_run:
+                continue
+            try:
+                df = pd.read_json(doc["data_json"], orient="split") if doc.get("data_json") else None
+            except Exception as e:
+                logger.error(f"Cannot parse data_json of context {doc['_id']}: {e}")
+                stats["failed"] += 1
+                continue
+            update = {"$unset": {"data_json": ""}, "$set": {"updated_at": datetime.utcnow()}}
+            if df is not None:
+                update["$set"].update({"table": save_table(doc["_id"], df), "column_stats": column_stats(df)})
+            knowledge_db.update_one({"_id": doc["_id"]}, update)
+            stats["migrated"] += 1
+            logger.info(f"Migrated table of context {doc['_id']}")
+    finally:
+        cursor.close()
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Move data_json spreadsheet blobs into Parquet objects.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    stats = migrate_tables(dry_run=args.dry_run)
+    if args.dry_run:
+        logger.info(f"Would migrate {stats['documents']} tables")
+    else:
+        logger.info(f"Migrated {stats['migrated']} of {stats['documents']} tables ({stats['failed']} failed)")
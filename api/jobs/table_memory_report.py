@@ -0,0 +1,54 @@
+"""
+Report the pandas memory of each stored spreadsheet table with default dtypes and with the
+compact dtypes chosen at ingestion (narrowed integers, categoricals and parsed dates). The
+figures are recorded in `table.memory_bytes` when a table is ingested; tables stored before
+that are listed without them.
+
+Usage:
+    python -m api.jobs.table_memory_report [--org ORG_ID]
+"""
+import argparse
+import logging
+
+from bson import ObjectId
+
+from api.database import knowledge_db
+
+logger = logging.getLogger(__name__)
+
+
+def table_memory_report(org: str = None) -> dict:
+    stats = {"tables": 0, "unmeasured": 0, "default_bytes": 0, "compact_bytes": 0}
+    query = {"is_tabular": True, "table": {"$exists": True}}
+    if org:
+        query["org"] = ObjectId(org)
+    projection = {"file_key": 1, "table.num_rows": 1, "table.memory_bytes": 1}
+    print(f"{'context':<24} {'rows':>10} {'default (B)':>14} {'compact (B)':>14} {'saved':>7}  file")
+    for doc in knowledge_db.find(query, projection):
+        stats["tables"] += 1
+        table = doc["table"]
+        memory = table.get("memory_bytes")
+        if not memory:
+            stats["unmeasured"] += 1
+            print(f"{str(doc['_id']):<24} {table.get('num_rows', 0):>10} {'-':>14} {'-':>14} {'-':>7}  {doc.get('file_key', '')}")
+            continue
+        stats["default_bytes"] += memory["default"]
+        stats["compact_bytes"] += memory["compact"]
+        saved = 1 - memory["compact"] / memory["default"] if memory["default"] else 0
+        print(
+            f"{str(doc['_id']):<24} {table.get('num_rows', 0):>10} {memory['default']:>14} "
+            f"{memory['compact']:>14} {saved:>7.0%}  {doc.get('file_key', '')}"
+        )
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Report default vs compact pandas memory of stored tables.")
+    parser.add_argument("--org", help="Only report tables of this organization.")
+    args = parser.parse_args()
+    stats = table_memory_report(org=args.org)
+    logger.info(
+        f"{stats['tables']} tables ({stats['unmeasured']} unmeasured): {stats['default_bytes']} -> "
+        f"{stats['compact_bytes']} bytes in memory"
+    )
@@ -0,0 +1,244 @@
+from bson.binary import Binary
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import io
+import re
+import bisect
+import logging
+import unicodedata
+
+import numpy as np
+
+from api.database import minio_client
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_BUCKET = "context-files"
+LEXICAL_INDEX_PREFIX = "lexical_index"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+# Arabic and Persian keyboards produce different code points for the same letters, and both
+# have their own digits. Fold everything onto one Persian spelling with ASCII digits so that
+# "كتاب" matches "کتاب" and "۱۲۳" matches "123".
+_CHAR_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ؤ": "و",
+    "‌": "", "‍": "", "ـ": "",
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+_DIACRITICS = re.compile("[ً-ٰٟۖ-ۭ]")
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+_SEPARATORS = re.compile(r"[-./:_]")
+
+STOPWORDS = frozenset("""
+a an and are as at be by do does for from how in is it of on or that the this to was were what which who with
+و در به از که این آن با را برای است بود هم تا یک می ها های ای یا اما اگر نیز شود شده کرد کند چه چی
+""".split())
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).translate(_CHAR_MAP)
+    return _DIACRITICS.sub("", text).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into search terms. Identifiers such as "INV-2023/0042" are kept whole and
+    also split into their parts, so both the full code and its pieces can match.
+    """
+    tokens = []
+    for match in _TOKEN.finditer(normalize_text(text)):
+        word = match.group()
+        parts = [p for p in _SEPARATORS.split(word) if p]
+        if len(parts) > 1:
+            tokens.append(word)
+        for part in parts:
+            if part not in STOPWORDS and (len(part) > 1 or part.isdigit()):
+                tokens.append(part)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of one context document. Postings are kept in CSR
+    form: the postings of terms[i] are ordinals[offsets[i]:offsets[i + 1]] with matching
+    term frequencies, all int32. The index of a large document can outgrow a BSON document,
+    so it is stored as an .npz object next to the context's file (see save_lexical_index);
+    documents indexed before that carry it inline, in the form of to_document.
+    """
+
+    def __init__(self, terms: List[str], offsets, ordinals, frequencies, lengths):
+        self.terms = terms
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.ordinals = np.asarray(ordinals, dtype=np.int32)
+        self.frequencies = np.asarray(frequencies, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+
+    @property
+    def chunk_count(self) -> int:
+        return int(np.count_nonzero(self.lengths))
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalIndex":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for ordinal, text in enumerate(texts):
+            tokens = tokenize(text or "")
+            lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((ordinal, count))
+
+        terms = sorted(postings)
+        offsets = [0]
+        ordinals, frequencies = [], []
+        for term in terms:
+            for ordinal, count in postings[term]:
+                ordinals.append(ordinal)
+                frequencies.append(count)
+            offsets.append(len(ordinals))
+        return cls(terms, offsets, ordinals, frequencies, lengths)
+
+    def postings(self, term: str):
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.ordinals[start:end], self.frequencies[start:end]
+
+    def to_document(self) -> dict:
+        return {
+            "terms": self.terms,
+            "offsets": Binary(self.offsets.astype("<i4").tobytes()),
+            "ordinals": Binary(self.ordinals.astype("<i4").tobytes()),
+            "frequencies": Binary(self.frequencies.astype("<i4").tobytes()),
+            "lengths": Binary(self.lengths.astype("<i4").tobytes()),
+        }
+
+    @classmethod
+    def from_document(cls, document: dict) -> "LexicalIndex":
+        return cls(
+            document["terms"],
+            np.frombuffer(document["offsets"], dtype="<i4"),
+            np.frombuffer(document["ordinals"], dtype="<i4"),
+            np.frombuffer(document["frequencies"], dtype="<i4"),
+            np.frombuffer(document["lengths"], dtype="<i4"),
+        )
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            terms=np.array(self.terms, dtype=str),
+            offsets=self.offsets,
+            ordinals=self.ordinals,
+            frequencies=self.frequencies,
+            lengths=self.lengths,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LexicalIndex":
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(
+                arrays["terms"].tolist(),
+                arrays["offsets"],
+                arrays["ordinals"],
+                arrays["frequencies"],
+                arrays["lengths"],
+            )
+
+
+def _lexical_index_object_name(context_id) -> str:
+    return f"{LEXICAL_INDEX_PREFIX}/{context_id}.npz"
+
+
+def save_lexical_index(context_id, index: LexicalIndex) -> dict:
+    """Store a context's lexical index as an object and return the metadata kept on its document."""
+    data = index.to_bytes()
+    object_name = _lexical_index_object_name(context_id)
+    result = minio_client.put_object(
+        bucket_name=LEXICAL_INDEX_BUCKET,
+        object_name=object_name,
+        data=io.BytesIO(data),
+        length=len(data),
+        content_type="application/octet-stream",
+    )
+    return {"object_name": object_name, "etag": result.etag, "size_bytes": len(data)}
+
+
+def load_lexical_index(meta: Optional[dict]) -> Optional[LexicalIndex]:
+    """The lexical index described by a document's `lexical_index` field, stored or inline."""
+    if not meta:
+        return None
+    if "object_name" not in meta:
+        return LexicalIndex.from_document(meta)
+    response = minio_client.get_object(LEXICAL_INDEX_BUCKET, meta["object_name"])
+    try:
+        return LexicalIndex.from_bytes(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def delete_lexical_index(context_id):
+    try:
+        minio_client.remove_object(LEXICAL_INDEX_BUCKET, _lexical_index_object_name(context_id))
+    except Exception as e:
+        logger.warning(f"Failed to remove lexical index of context {context_id}: {e}")
+
+
+def bm25_search(indexes: Dict[str, LexicalIndex], query: str, k: int) -> List[Tuple[str, int, float]]:
+    """
+    Rank the chunks of several context documents against `query` with BM25. Document
+    frequencies and the average chunk length are taken over all given documents together.
+    Returns up to `k` (context_id, ordinal, score) hits with a positive score.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not indexes or k <= 0:
+        return []
+    total_chunks = sum(index.chunk_count for index in indexes.values())
+    if total_chunks == 0:
+        return []
+    avg_length = sum(int(index.lengths.sum()) for index in indexes.values()) / total_chunks
+
+    postings = {cid: {term: index.postings(term) for term in terms} for cid, index in indexes.items()}
+    doc_freq = {
+        term: sum(len(p[term][0]) for p in postings.values() if p[term] is not None)
+        for term in terms
+    }
+
+    hits = []
+    for context_id, index in indexes.items():
+        scores = np.zeros(index.lengths.shape[0], dtype=np.float64)
+        for term in terms:
+            if postings[context_id][term] is None:
+                continue
+            ordinals, frequencies = postings[context_id][term]
+            df = doc_freq[term]
+            idf = np.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[ordinals] / avg_length)
+            np.add.at(scores, ordinals, idf * frequencies * (BM25_K1 + 1) / (frequencies + norm))
+        for ordinal in np.flatnonzero(scores > 0):
+            hits.append((context_id, int(ordinal), float(scores[ordinal])))
+
+    hits.sort(key=lambda hit: hit[2], reverse=True)
+    return hits[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[list], k: int = RRF_K) -> List[Tuple[object, float]]:
+    """Fuse ranked lists of keys into one list of (key, score), best first: score = sum 1 / (k + rank)."""
+    scores: Dict[object, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
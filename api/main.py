@@ -95,6 +95,9 @@ def create_initial_sysadmin():
 
 create_initial_sysadmin()
 
+from api.embed import ensure_chunk_indexes
+ensure_chunk_indexes()
+
 SERVER_URL = os.getenv("SERVER_URL", "http://localhost")
 UI_PORT = os.getenv("UI_PORT", "3000")
 API_PORT = os.getenv("API_PORT", "8000")
@@ -12,10 +12,12 @@ import tiktoken
 import uuid
 
 from api.schemas.agents import QueryRequest, save_chat_history, update_chat_history_entry
-from api.agent import get_agent_graph
+from api.agent import agent_graph_cache, get_agent_graph
 from api.database import sessions_db, agents_db, connectors_db, knowledge_db, orgs_db, users_db, minio_client
 from api.schemas.agents import Agent, AgentCreate, AgentUpdate, agent_doc_to_model
 from api.embed import delete_embeddings
+from api.index import remove_from_org_index
+from api.tabular import delete_table
 from api.auth import verify_token, oauth2_scheme
 
 router = APIRouter(tags=["Agent"])
@@ -256,7 +258,7 @@ async def ask(
 
     async def response_generator():
         full_answer = ""
-        input_messages = _prepare_astream_input(graph, None, chat_history, query.query)
+        input_messages = _prepare_astream_input(graph, agent_graph.get("system_prompt"), chat_history, query.query)
         encoding = tiktoken.encoding_for_model(agent_doc.get("model_name", "gpt-3.5-turbo")) if agent_doc else tiktoken.encoding_for_model("gpt-3.5-turbo")
         system_messages = [m for m in input_messages if isinstance(m, SystemMessage)]
         chat_messages = [m for m in input_messages if isinstance(m, (HumanMessage, AIMessage))]
@@ -395,7 +397,7 @@ async def edit_message(
     async def response_generator():
         try:
             full_answer = ""
-            input_messages = _prepare_astream_input(graph, system_content=None, chat_history=truncated_history, query_text=query)
+            input_messages = _prepare_astream_input(graph, system_content=agent_graph.get("system_prompt"), chat_history=truncated_history, query_text=query)
             # tiktoken-based counting as in /ask
             # Try to get model_name from agent_doc if available, fallback to gpt-3.5-turbo
             import tiktoken
@@ -566,6 +568,7 @@ def update_agent(agent_id: str, agent_update: AgentUpdate, token: str = Depends(
         {"_id": ObjectId(agent_id)},
         {"$set": update_data}
     )
+    agent_graph_cache.invalidate(agent_id)
     updated_agent = agents_db.find_one({"_id": ObjectId(agent_id)})
     agent_model = agent_doc_to_model(updated_agent)
     return Agent(**agent_model)
@@ -596,7 +599,7 @@ def delete_agent(agent_id: str, token: str = Depends(oauth2_scheme)):
     for entry in context_entries:
         if isinstance(entry, ObjectId):
             context_id = entry
-            context_doc = knowledge_db.find_one({"_id": context_id})
+            context_doc = knowledge_db.find_one({"_id": context_id}, {"file_key": 1, "table": 1, "sheets": 1})
             if not context_doc:
                 logger.warning(f"Context document with id {context_id} not found in knowledge_db.")
                 continue
@@ -615,17 +618,24 @@ def delete_agent(agent_id: str, token: str = Depends(oauth2_scheme)):
                 logger.error(f"Failed to remove file {file_key} from Minio for context {context_id}: {str(e)}")
         else:
             logger.info(f"No file_key present for context {context_id}")
+        delete_table(context_doc["_id"], context_doc.get("table"), context_doc.get("sheets"))
         try:
-            delete_embeddings(context_doc, org_id)
+            delete_embeddings(context_doc["_id"], org_id)
             logger.info(f"Deleted embeddings for context {context_id}")
         except Exception as e:
             logger.error(f"Failed to delete embeddings for context {context_id}: {str(e)}")
 
+    try:
+        remove_from_org_index(org_id, context_entries)
+    except Exception as e:
+        logger.error(f"Failed to remove contexts of agent {agent_id} from the vector index: {str(e)}")
+
     try:
         result = agents_db.delete_one({"_id": ObjectId(agent_id), "org": org_id})
         if result.deleted_count == 0:
             logger.error(f"Failed to delete agent {agent_id}")
             raise HTTPException(status_code=404, detail="Agent not found or you do not have permission to delete it.")
+        agent_graph_cache.invalidate(agent_id)
         logger.info(f"Agent {agent_id} deleted successfully")
     except Exception as e:
         logger.exception(f"Unexpected error when deleting agent {agent_id}")
@@ -7,6 +7,9 @@ import datetime
 from api.schemas.connectors import Connector, ConnectorCreate, ConnectorUpdate
 from api.auth import verify_token, oauth2_scheme
 from api.database import connectors_db, agents_db
+from api.agent import agent_graph_cache
+from api.tools.google_clients import google_clients
+from api.tools.google_sheet import sheet_range_cache
 
 router = APIRouter(tags=["Connectors"])
 
@@ -71,6 +74,7 @@ def update_connector(connector_id: str, connector_update: ConnectorUpdate, token
         if connectors_db.find_one({"_id": {"$ne": ObjectId(connector_id)}, "org": org_id, "name": update_data["name"]}):
             raise HTTPException(status_code=400, detail=f"A connector named '{update_data['name']}' already exists.")
 
+    update_data["updated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
     result = connectors_db.update_one(
         {"_id": ObjectId(connector_id), "org": org_id},
         {"$set": update_data}
@@ -78,6 +82,9 @@ def update_connector(connector_id: str, connector_update: ConnectorUpdate, token
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Connector not found.")
+    agent_graph_cache.invalidate(connector_id=connector_id)
+    google_clients.invalidate(connector_id)
+    sheet_range_cache.invalidate(connector_id)
 
     updated_connector = connectors_db.find_one({"_id": ObjectId(connector_id)})
     return Connector(**updated_connector)
@@ -102,6 +109,9 @@ def delete_connector(connector_id: str, token: str = Depends(oauth2_scheme)):
         {"org": org_id},
         {"$pull": {"connector_ids": ObjectId(connector_id)}}
     )
+    agent_graph_cache.invalidate(connector_id=connector_id)
+    google_clients.invalidate(connector_id)
+    sheet_range_cache.invalidate(connector_id)
 
     return {"message": f"Connector '{connector_id}' deleted successfully."}
 
@@ -130,11 +140,14 @@ def update_connector_settings(connector_id: str, settings: dict, token: str = De
     
     result = connectors_db.update_one(
         {"_id": ObjectId(connector_id)},
-        {"$set": {"settings": settings}}
+        {"$set": {"settings": settings, "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}}
     )
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Connector not found.")
+    agent_graph_cache.invalidate(connector_id=connector_id)
+    google_clients.invalidate(connector_id)
+    sheet_range_cache.invalidate(connector_id)
     
     return {"message": f"Settings for connector '{connector_id}' updated successfully."}
 
@@ -205,6 +218,7 @@ def add_connector_to_agent(agent_id: str, connector_id: str, token: str = Depend
 
     if update_result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Agent not found during update.")
+    agent_graph_cache.invalidate(agent_id)
 
     return {"message": f"Connector '{connector_id}' added to agent '{agent_id}' successfully."}
 
@@ -234,5 +248,6 @@ def delete_connector_from_agent(agent_id: str, connector_id: str, token: str = D
 
     if update_result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Agent not found during update.")
+    agent_graph_cache.invalidate(agent_id)
     
     return {"message": f"Connector '{connector_id}' removed from agent '{agent_id}' successfully."}
\ No newline at end of file
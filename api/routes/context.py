@@ -5,14 +5,16 @@ from bson import ObjectId
 import io
 import logging
 
-from api.embed import embed, save_embedding, get_embeddings, get_openai_callback
+from api.embed import embed, embed_stream, save_embedding, save_embedding_stream, get_embeddings, iter_chunks, delete_chunks, get_openai_callback
 from api.database import agents_db, knowledge_db, minio_client
+from api.index import add_to_org_index, remove_from_org_index
+from api.lexical import delete_lexical_index
+from api.tabular import ingest_table, delete_table, table_cache
+from api.agent import agent_graph_cache
 from api.auth import verify_token, oauth2_scheme
 from api.schemas.context import (
-    extract_text_from_pdf,
+    iter_pdf_pages,
     extract_text_from_docx,
-    extract_table_from_excel,
-    extract_table_from_csv,
 )
 
 router = APIRouter(tags=["Context Management"])
@@ -20,6 +22,27 @@ router = APIRouter(tags=["Context Management"])
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fields that can be large (legacy spreadsheet JSON and embedded chunks, indexes) and are never
+# needed to describe a context entry.
+CONTEXT_METADATA_PROJECTION = {"data_json": 0, "chunks": 0, "lexical_index": 0}
+
+def stored_structured_data(context_entry: dict) -> dict:
+    """
+    Schema, sample, shape and column stats of a tabular context, as stored at ingestion. For a
+    workbook with several sheets they describe the first one, and `sheets` lists them all.
+    """
+    structured_data = {
+        "schema": context_entry.get("schema", {}),
+        "sample": context_entry.get("sample", []),
+        "shape": tuple(context_entry.get("shape", ())),
+        "column_stats": context_entry.get("column_stats", {}),
+    }
+    if context_entry.get("sheets"):
+        structured_data["sheets"] = [
+            {key: value for key, value in sheet.items() if key != "table"} for sheet in context_entry["sheets"]
+        ]
+    return structured_data
+
 def process_context_embedding(
     agent_id: str,
     user_org_id,
@@ -34,30 +57,25 @@ def process_context_embedding(
         is_tabular = False
         context_id = None
         token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        embedding_stats = {"reused": 0, "embedded": 0}
         with get_openai_callback() as cb:
             if content_type == "application/pdf":
-                text = extract_text_from_pdf(file_content)
-                if not text.strip():
+                pages = (page + "\n" for page in iter_pdf_pages(file_content))
+                context_id = save_embedding_stream(embed_stream(pages, stats=embedding_stats), user_org_id, file_key=file_key)
+                if context_id is None:
                     logger.error("No extractable text in PDF.")
                     return
-                chunks_with_embeddings = embed(text)
-                logger.info(f"Generated embeddings for PDF: {len(chunks_with_embeddings)} chunks")
-                if not chunks_with_embeddings:
-                    logger.error("Failed to generate embeddings for PDF.")
-                    return
-                context_id = save_embedding(chunks_with_embeddings, user_org_id)
-                logger.info(f"Saved PDF embeddings to DB with context_id={context_id}")
-                knowledge_db.update_one(
-                    {"_id": context_id},
-                    {"$set": {"file_key": file_key, "is_tabular": False}}
-                )
-                logger.info(f"Updated knowledge_db for PDF context {context_id}")
+                logger.info(f"Saved streamed PDF embeddings to DB with context_id={context_id}")
+                try:
+                    add_to_org_index(user_org_id, context_id, iter_chunks(context_id, with_embeddings=True))
+                except Exception as e:
+                    logger.error(f"Failed to index PDF context {context_id}: {e}")
             elif content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
                 text = extract_text_from_docx(file_content)
                 if not text.strip():
                     logger.error("No extractable text in DOCX.")
                     return
-                chunks_with_embeddings = embed(text)
+                chunks_with_embeddings = embed(text, stats=embedding_stats)
                 logger.info(f"Generated embeddings for DOCX: {len(chunks_with_embeddings)} chunks")
                 if not chunks_with_embeddings:
                     logger.error("Failed to generate embeddings for DOCX.")
@@ -69,45 +87,34 @@ def process_context_embedding(
                     {"$set": {"file_key": file_key, "is_tabular": False}}
                 )
                 logger.info(f"Updated knowledge_db for DOCX context {context_id}")
+                try:
+                    add_to_org_index(user_org_id, context_id, chunks_with_embeddings)
+                except Exception as e:
+                    logger.error(f"Failed to index DOCX context {context_id}: {e}")
             elif content_type == "application/vnd.openxmlformats-officedocument.presentationml.presentation":
                 logger.error("PowerPoint upload not supported.")
                 return
             elif content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or content_type == "text/csv":
-                if content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-                    table_data = extract_table_from_excel(file_content)
-                else:
-                    table_data = extract_table_from_csv(file_content)
-
-                if table_data.get("shape", (0, 0))[0] > 300:
-                    logger.error("Spreadsheet exceeds 300-row limit.")
-                    raise HTTPException(status_code=400, detail="Spreadsheet exceeds limit of 300 rows.")
-
-                if not table_data:
-                    logger.error("No extractable table data in spreadsheet.")
-                    raise HTTPException(status_code=400, detail="Unrecognizable spreadsheet format.")
-
-                schema = table_data.get("schema", {})
-                sample = table_data.get("sample", [])[:10]
-                shape = table_data.get("shape", ())
-                dataframe = table_data.get("dataframe")
-                if dataframe is not None:
-                    try:
-                        data_json = dataframe.to_json(orient="split")
-                    except Exception as e:
-                        logger.error(f"Failed to serialize dataframe to JSON: {e}")
-                        data_json = None
-                else:
-                    logger.warning("No dataframe found in table_data; cannot serialize.")
-                    data_json = None
+                file_type = "excel" if content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" else "csv"
+                table_id = ObjectId()
+                try:
+                    table_data = ingest_table(table_id, file_content, file_type)
+                except Exception as e:
+                    logger.error(f"Failed to extract table from spreadsheet: {e}", exc_info=True)
+                    raise HTTPException(status_code=400, detail=f"Unrecognizable spreadsheet format: {e}")
                 doc = {
+                    "_id": table_id,
                     "file_key": file_key,
                     "is_tabular": True,
                     "org": user_org_id,
-                    "schema": schema,
-                    "sample": sample,
-                    "shape": shape,
-                    "data_json": data_json
+                    "schema": table_data["schema"],
+                    "sample": table_data["sample"][:10],
+                    "shape": table_data["shape"],
+                    "table": table_data["table"],
+                    "column_stats": table_data["column_stats"],
                 }
+                if table_data.get("sheets"):
+                    doc["sheets"] = table_data["sheets"]
                 result = knowledge_db.insert_one(doc)
                 context_id = result.inserted_id
                 logger.info(f"Inserted spreadsheet structured data to DB with context_id={context_id}")
@@ -115,11 +122,18 @@ def process_context_embedding(
             else:
                 logger.error(f"Unsupported file type: {content_type}")
                 return
+            if context_id and not is_tabular:
+                logger.info(
+                    f"Embedded {embedding_stats['embedded']} new chunks and reused "
+                    f"{embedding_stats['reused']} stored embeddings for context {context_id}"
+                )
+                knowledge_db.update_one({"_id": context_id}, {"$set": {"embedding_stats": embedding_stats}})
             if context_id:
                 agents_db.update_one(
                     {"_id": ObjectId(agent_id)},
                     {"$push": {"context": context_id}}
                 )
+                agent_graph_cache.invalidate(agent_id)
                 logger.info(f"Updated agent {agent_id} with new context {context_id}")
             token_usage["prompt_tokens"] = cb.prompt_tokens
             token_usage["completion_tokens"] = cb.completion_tokens
@@ -144,7 +158,7 @@ def list_context_entries(agent_id: str, token: str = Depends(oauth2_scheme)):
                 entry = knowledge_db.find_one({
                     "_id": ObjectId(cid),
                     "org": ObjectId(user["organization"])
-                })
+                }, CONTEXT_METADATA_PROJECTION)
                 if entry:
                     context_entries.append({
                         "context_id": str(entry["_id"]),
@@ -173,7 +187,7 @@ def get_context_entry(agent_id: str, context_id: str, token: str = Depends(oauth
     if not agent or ObjectId(context_id) not in agent.get("context", []):
         raise HTTPException(status_code=404, detail="Context entry not found for this agent.")
 
-    context_entry = knowledge_db.find_one({"_id": ObjectId(context_id), "org": ObjectId(user["organization"])})
+    context_entry = knowledge_db.find_one({"_id": ObjectId(context_id), "org": ObjectId(user["organization"])}, CONTEXT_METADATA_PROJECTION)
     if not context_entry:
         raise HTTPException(status_code=404, detail="Context entry not found or permission denied.")
 
@@ -185,23 +199,8 @@ def get_context_entry(agent_id: str, context_id: str, token: str = Depends(oauth
         "filename": "_".join(context_entry.get("file_key", "").split("_")[1:]) if context_entry.get("file_key") else "",
     }
 
-    if context_entry.get("is_tabular") and context_entry.get("file_key"):
-        try:
-            file_obj = minio_client.get_object("context-files", context_entry["file_key"])
-            file_content = file_obj.read()
-            if context_entry["file_key"].endswith(".csv"):
-                table_data = extract_table_from_csv(file_content)
-            else:
-                table_data = extract_table_from_excel(file_content)
-            
-            if table_data:
-                response["structured_data"] = {
-                    "schema": table_data.get("schema", {}),
-                    "sample": table_data.get("sample", []),
-                    "shape": table_data.get("shape", ())
-                }
-        except Exception as e:
-            logger.warning(f"Failed to load structured data from MinIO for context {context_id}: {e}")
+    if context_entry.get("is_tabular"):
+        response["structured_data"] = stored_structured_data(context_entry)
 
     return response
 
@@ -216,32 +215,20 @@ def get_ingested_content(agent_id: str, context_id: str, token: str = Depends(oa
     if not agent or ObjectId(context_id) not in agent.get("context", []):
         raise HTTPException(status_code=404, detail="Context entry not found for this agent.")
 
-    context_entry = knowledge_db.find_one({"_id": ObjectId(context_id), "org": ObjectId(user["organization"])})
+    context_entry = knowledge_db.find_one({"_id": ObjectId(context_id), "org": ObjectId(user["organization"])}, CONTEXT_METADATA_PROJECTION)
     if not context_entry:
         raise HTTPException(status_code=404, detail="Context entry not found or permission denied.")
 
     response = {
-        "ingested_content": context_entry.get("chunks", []),
+        "ingested_content": [
+            {"ordinal": chunk["ordinal"], "text": chunk.get("text", ""), "token_count": chunk.get("token_count")}
+            for chunk in iter_chunks(ObjectId(context_id))
+        ],
         "is_tabular": context_entry.get("is_tabular", False)
     }
 
-    if context_entry.get("is_tabular") and context_entry.get("file_key"):
-        try:
-            file_obj = minio_client.get_object("context-files", context_entry["file_key"])
-            file_content = file_obj.read()
-            if context_entry["file_key"].endswith(".csv"):
-                table_data = extract_table_from_csv(file_content)
-            else:
-                table_data = extract_table_from_excel(file_content)
-
-            if table_data:
-                response["structured_data"] = {
-                    "schema": table_data.get("schema", {}),
-                    "sample": table_data.get("sample", []),
-                    "shape": table_data.get("shape", ())
-                }
-        except Exception as e:
-            logger.warning(f"Failed to load structured data from MinIO for context {context_id}: {e}")
+    if context_entry.get("is_tabular"):
+        response["structured_data"] = stored_structured_data(context_entry)
 
     return response
 
@@ -327,9 +314,19 @@ def delete_context_entry(agent_id: str, context_id: str, token: str = Depends(oa
         {"_id": ObjectId(agent_id)},
         {"$pull": {"context": ObjectId(context_id)}}
     )
+    agent_graph_cache.invalidate(agent_id)
     result = knowledge_db.delete_one({"_id": ObjectId(context_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=500, detail="Failed to delete the context entry.")
+    delete_chunks([ObjectId(context_id)])
+    if context_entry.get("is_tabular"):
+        delete_table(context_id, context_entry.get("table"), context_entry.get("sheets"))
+    else:
+        delete_lexical_index(context_id)
+    try:
+        remove_from_org_index(user["organization"], [ObjectId(context_id)])
+    except Exception as e:
+        logger.warning(f"Failed to remove context {context_id} from the vector index: {e}")
     return {"message": "Context Entry Deleted successfully"}
 
 @router.get("/agents/{agent_id}/context/{context_id}/download")
@@ -358,4 +355,11 @@ def download_context_file(agent_id: str, context_id: str, token: str = Depends(o
     return {
         "download_url": presigned_url,
         "is_tabular": context_entry.get("is_tabular", False),
-    }
\ No newline at end of file
+    }
+
+@router.get("/context/cache/stats")
+def get_table_cache_stats(token: str = Depends(oauth2_scheme)):
+    user = verify_token(token)
+    if user.get("permission") != "sysadmin":
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return {"table_cache": table_cache.stats()}
@@ -1,35 +1,117 @@
 import logging
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
 
 from fastapi import HTTPException
 
+import os
+import codecs
+import tempfile
+import threading
 import traceback
+import multiprocessing
 
 import PyPDF2, io
 import docx
+import openpyxl
 import pandas as pd
 
 from api.schemas.base import PyObjectId
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    logger.info("Starting extraction of text from PDF file.")
+# PDFs are split into ranges of PDF_PAGES_PER_TASK pages that are parsed in a process pool;
+# documents no longer than one range are parsed inline.
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Spreadsheets are read and stored in blocks of this many rows, one Parquet row group each.
+SPREADSHEET_CHUNK_ROWS = int(os.getenv("SPREADSHEET_CHUNK_ROWS", "50000"))
+
+# One pool per API process, started on the first large PDF. Its workers are spawned rather
+# than forked: a fork of the threaded server could inherit a lock held by another thread
+# (pymongo, MinIO, logging) and block on it forever.
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+# The document a worker last parsed: (path, PdfReader). Ranges of one upload usually land on
+# the same workers, so each parses the file once rather than once per range.
+_worker_pdf_reader = None
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pdf_pool
+
+def _reset_pdf_pool(pool: ProcessPoolExecutor):
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_pdf_page_range(path: str, start: int, end: int) -> List[str]:
+    global _worker_pdf_reader
+    if _worker_pdf_reader is None or _worker_pdf_reader[0] != path:
+        with open(path, "rb") as f:
+            _worker_pdf_reader = (path, PyPDF2.PdfReader(io.BytesIO(f.read())))
+    pages = _worker_pdf_reader[1].pages
+    return [pages[i].extract_text() or "" for i in range(start, end)]
+
+def iter_pdf_pages(file_content: bytes, workers: int = None, pages_per_task: int = None) -> Iterator[str]:
+    """
+    Yield the text of each PDF page in order. Page ranges are extracted in parallel by the
+    shared worker pool, which reads the PDF from a temporary file, with at most two ranges
+    per worker in flight, so memory stays bounded and the caller can start chunking and
+    embedding before the last page is parsed.
+    """
+    workers = workers or PDF_EXTRACT_WORKERS
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
     try:
         pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
         num_pages = len(pdf_reader.pages)
         logger.debug(f"Number of pages in PDF: {num_pages}")
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        logger.info(f"Successfully extracted text from PDF file. Extracted text length: {len(text)} characters, Pages: {num_pages}")
-        return text
+        if workers <= 1 or num_pages <= pages_per_task:
+            for page in pdf_reader.pages:
+                yield page.extract_text() or ""
+            return
+
+        ranges = deque((start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task))
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        pool = _get_pdf_pool()
+        pending = deque()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(file_content)
+            while ranges or pending:
+                while ranges and len(pending) < workers * 2:
+                    pending.append(pool.submit(_extract_pdf_page_range, path, *ranges.popleft()))
+                yield from pending.popleft().result()
+        except BrokenProcessPool:
+            _reset_pdf_pool(pool)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+            os.remove(path)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to extract text from PDF file: {e}", exc_info=True)
-        traceback.print_exc()
         raise HTTPException(status_code=400, detail=f"Failed to extract text from PDF file: {e}")
 
+def extract_text_from_pdf(file_content: bytes) -> str:
+    logger.info("Starting extraction of text from PDF file.")
+    pages = [page + "\n" for page in iter_pdf_pages(file_content)]
+    text = "".join(pages)
+    logger.info(f"Successfully extracted text from PDF file. Extracted text length: {len(text)} characters, Pages: {len(pages)}")
+    return text
+
 def extract_text_from_docx(file_content: bytes) -> str:
     logger.info("Starting extraction of text from DOCX file.")
     try:
@@ -58,6 +140,85 @@ def _load_spreadsheet(file_content: bytes, file_type: str) -> pd.DataFrame:
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
 
+def _csv_encoding(file_content: bytes) -> str:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for start in range(0, len(file_content), 1 << 20):
+            decoder.decode(file_content[start:start + (1 << 20)])
+        decoder.decode(b"", final=True)
+        return "utf-8"
+    except UnicodeDecodeError:
+        logger.warning("CSV not UTF-8 encoded; using latin1 fallback.")
+        return "latin1"
+
+def _excel_header(row) -> List[str]:
+    """Column names from a header row, named and de-duplicated the way pandas.read_excel does."""
+    cells = list(row)
+    while cells and cells[-1] is None:
+        cells.pop()
+    names, seen = [], {}
+    for i, cell in enumerate(cells):
+        name = f"Unnamed: {i}" if cell is None else str(cell).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def list_excel_sheets(file_content: bytes) -> List[str]:
+    """Names of the workbook's sheets that have a header row, in workbook order."""
+    workbook = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+    try:
+        names = []
+        for sheet in workbook.worksheets:
+            header = next(sheet.iter_rows(max_row=1, values_only=True), None)
+            if header and any(cell is not None for cell in header):
+                names.append(sheet.title)
+        return names
+    finally:
+        workbook.close()
+
+def _iter_excel_chunks(file_content: bytes, sheet_name: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    workbook = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = _excel_header(next(rows, ()))
+        if not header:
+            return
+        width, chunk, yielded = len(header), [], False
+        for row in rows:
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            if all(cell is None for cell in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk, yielded = [], True
+        # A sheet with only a header still yields its (empty) columns.
+        if chunk or not yielded:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+def iter_spreadsheet_chunks(file_content: bytes, file_type: str, chunk_rows: int = None, sheet_name: str = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield a spreadsheet as DataFrames of at most `chunk_rows` rows. CSV files are parsed
+    incrementally and Excel sheets (`sheet_name`, by default the first) are streamed with
+    openpyxl in read-only mode. Dtypes are inferred per chunk, so callers must reconcile them.
+    """
+    chunk_rows = chunk_rows or SPREADSHEET_CHUNK_ROWS
+    if file_type == 'csv':
+        encoding = _csv_encoding(file_content)
+        with pd.read_csv(io.BytesIO(file_content), chunksize=chunk_rows, encoding=encoding) as reader:
+            yield from reader
+    elif file_type == 'excel':
+        yield from _iter_excel_chunks(file_content, sheet_name, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
 def extract_text_from_excel(file_content: bytes) -> str:
     logger.info("Starting extraction of text from Excel file.")
     try:
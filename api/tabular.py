@@ -0,0 +1,860 @@
+from collections import Counter, OrderedDict
+from typing import List, Optional
+
+import io
+import os
+import re
+import logging
+import tempfile
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas.tseries.api import guess_datetime_format
+
+from api.database import minio_client
+from api.schemas.context import iter_spreadsheet_chunks, list_excel_sheets
+from api.tabular_query import TableQueryClassifier
+from api.value_index import TableValueIndex, ValueIndexBuilder, normalize_series, normalize_value
+
+logger = logging.getLogger(__name__)
+
+TABLE_BUCKET = "context-files"
+TABLE_PREFIX = "tables"
+# Parquet objects are downloaded once per version into this directory and then read through
+# a memory map, so repeated questions reuse the page cache instead of parsing the table again.
+TABLE_CACHE_DIR = os.getenv("TABLE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nexa-tables"))
+TABLE_CACHE_BYTES = int(os.getenv("TABLE_CACHE_BYTES", str(512 * 1024 * 1024)))
+# Tables with more rows than this are never loaded whole; questions are answered by StoredTable
+# column scans instead. Filter results are capped at TABLE_RESULT_ROWS rows.
+TABLE_IN_MEMORY_ROWS = int(os.getenv("TABLE_IN_MEMORY_ROWS", "50000"))
+TABLE_RESULT_ROWS = int(os.getenv("TABLE_RESULT_ROWS", "1000"))
+TABLE_SCAN_BATCH_ROWS = 65536
+HISTOGRAM_BINS = 10
+STATS_TOP_VALUES = 5
+STATS_DISTINCT_LIMIT = 100_000
+# Text columns with at most this many distinct values, and no more than TABLE_CATEGORY_MAX_RATIO
+# of their non-null cells, are stored dictionary-encoded and load as pandas categoricals.
+TABLE_CATEGORY_MAX_DISTINCT = 65536
+TABLE_CATEGORY_MAX_RATIO = 0.5
+_INTEGER_TYPES = (pa.int8(), pa.int16(), pa.int32(), pa.int64())
+_DATE_PATTERN = r"^(\d{4}-\d{1,2}-\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})$"
+
+
+class DataFrameCache:
+    """
+    Thread-safe LRU cache of loaded tables, keyed by (context_id, version). Entries are sized
+    with memory_usage(deep=True), or by the `size` given for other objects such as value
+    indexes, and the least recently used ones are evicted once the total exceeds `max_bytes`.
+    A table larger than the whole budget is never cached. Cached frames are shared between
+    requests, so callers must not modify them in place. Data derived from a table, such as
+    normalized copies of its columns and its query classifier, is kept with the entry and
+    counts against it.
+    """
+
+    def __init__(self, max_bytes: int = TABLE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, context_id, version) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get((str(context_id), version))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((str(context_id), version))
+            self.hits += 1
+            return entry[0]
+
+    def derived(self, df, name, build, size):
+        """
+        `build()`, kept with the cache entry of `df` under `name` when `df` is a cached table,
+        so it is computed once per table version. `size(result)` is added to the entry's size.
+        """
+        with self._lock:
+            key = next((key for key, entry in self._entries.items() if entry[0] is df), None)
+            if key is not None and name in self._entries[key][2]:
+                return self._entries[key][2][name]
+        result = build()
+        if key is None:
+            return result
+        nbytes = size(result)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is df:
+                entry[2][name] = result
+                entry[1] += nbytes
+                self.size_bytes += nbytes
+                self._evict()
+        return result
+
+    def normalized_column(self, df: pd.DataFrame, col) -> pd.Series:
+        """
+        normalize_value of every cell of df[col]. When `df` is a cached table the result is kept
+        with its entry, so each column is normalized once per table version.
+        """
+        return self.derived(
+            df, ("normalized", col), lambda: normalize_series(df[col]),
+            lambda series: int(series.memory_usage(deep=True)),
+        )
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.evictions += 1
+
+    def set(self, context_id, version, df, size: Optional[int] = None):
+        if size is None:
+            size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        key = (str(context_id), version)
+        with self._lock:
+            if key in self._entries:
+                self.size_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = [df, size, {}]
+            self.size_bytes += size
+            self._evict()
+
+    def invalidate(self, context_id) -> int:
+        """Drop every cached version of a context's table."""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == str(context_id)]
+            for key in keys:
+                self.size_bytes -= self._entries.pop(key)[1]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+table_cache = DataFrameCache()
+
+
+def _table_object_name(context_id) -> str:
+    return f"{TABLE_PREFIX}/{context_id}.parquet"
+
+
+def _value_index_object_name(context_id) -> str:
+    return f"{TABLE_PREFIX}/{context_id}.values.parquet"
+
+
+def _local_path(table: dict) -> str:
+    name = table["object_name"].rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return os.path.join(TABLE_CACHE_DIR, f"{name}-{table.get('etag') or 'latest'}.parquet")
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert a spreadsheet DataFrame to Arrow. Column names become strings, and object columns
+    Arrow cannot type (e.g. numbers mixed with text) are stored as strings.
+    """
+    df = df.copy()
+    df.columns = [str(col) for col in df.columns]
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].map(lambda value: None if pd.isna(value) else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _is_numeric(data_type: pa.DataType) -> bool:
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_decimal(data_type)
+
+
+def _unify_types(types: set) -> pa.DataType:
+    """One Arrow type for a column whose chunks were inferred differently: widen numbers, else use strings."""
+    types = {data_type for data_type in types if not pa.types.is_null(data_type)}
+    if not types:
+        return pa.string()
+    if len(types) == 1:
+        return types.pop()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64() if any(pa.types.is_floating(t) for t in types) else pa.int64()
+    return pa.string()
+
+
+def _fits(data_type: pa.DataType, low, high) -> bool:
+    bounds = np.iinfo(data_type.to_pandas_dtype())
+    return bounds.min <= low and high <= bounds.max
+
+
+def _parse_dates(values: pd.Series, date_format: str) -> pd.Series:
+    return pd.to_datetime(values, format=date_format, errors="coerce")
+
+
+def _date_formats(value: str) -> List[str]:
+    """
+    The formats a date cell may be written in: one for ISO dates, and both the day-first and
+    the month-first reading of a `05/03/2024` style date, which only the other cells can settle.
+    """
+    numeric = re.match(r"^\d{1,2}([/.-])\d{1,2}\1(\d{2}|\d{4})$", value)
+    if numeric:
+        sep, year = numeric.group(1), "%Y" if len(numeric.group(2)) == 4 else "%y"
+        return [f"%d{sep}%m{sep}{year}", f"%m{sep}%d{sep}{year}"]
+    if not re.match(r"^\d{4}-", value):
+        return []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        date_format = guess_datetime_format(value)
+    return [date_format] if date_format and date_format.startswith("%Y-%m-%d") else []
+
+
+class _TypeProfiler:
+    """
+    First ingestion pass: settles one compact Arrow type per column from the chunks of a table.
+    Integers are narrowed to the smallest type that holds their range, text columns whose
+    cells all parse as dates with one format become timestamps (a column of dates like
+    `05/03/2024` only when some cell shows whether the day or the month comes first), and
+    low-cardinality text columns are dictionary-encoded. Floats stay float64 so sums and means keep their precision.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.types = {}
+        self.ranges = {}
+        self.date_formats = {}
+        self._values = {}
+        self._rows = {}
+        self._not_dates = set()
+
+    def update(self, frame: pd.DataFrame):
+        chunk = to_arrow(frame)
+        self.names = self.names or chunk.schema.names
+        for field in chunk.schema:
+            self.types.setdefault(field.name, set()).add(field.type)
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                self._profile_text(field.name, chunk.column(field.name))
+        _numeric_ranges(chunk, self.ranges)
+
+    def _profile_text(self, name, column: pa.ChunkedArray):
+        values = column.drop_null()
+        self._rows[name] = self._rows.get(name, 0) + len(values)
+        distinct = self._values.setdefault(name, set())
+        if distinct is not None:
+            distinct.update(pc.unique(values).to_pylist())
+            if len(distinct) > TABLE_CATEGORY_MAX_DISTINCT:
+                self._values[name] = None
+        if name in self._not_dates or len(values) == 0:
+            return
+        if not pc.all(pc.match_substring_regex(values, _DATE_PATTERN)).as_py():
+            self._not_dates.add(name)
+            return
+        if name not in self.date_formats:
+            self.date_formats[name] = _date_formats(values[0].as_py())
+        cells = values.to_pandas()
+        self.date_formats[name] = [
+            date_format for date_format in self.date_formats[name]
+            if not _parse_dates(cells, date_format).isna().any()
+        ]
+        if not self.date_formats[name]:
+            self._not_dates.add(name)
+
+    def _compact_type(self, name) -> pa.DataType:
+        data_type = _unify_types(self.types[name])
+        if pa.types.is_integer(data_type) and name in self.ranges:
+            low, high = self.ranges[name]
+            return next(t for t in _INTEGER_TYPES if _fits(t, low, high))
+        if not pa.types.is_string(data_type):
+            return data_type
+        if (
+            len(self.date_formats.get(name, ())) == 1 and name not in self._not_dates
+            and self.types[name] <= {pa.string(), pa.null()}
+        ):
+            return pa.timestamp("ns")
+        distinct = self._values.get(name)
+        if distinct and len(distinct) <= TABLE_CATEGORY_MAX_RATIO * self._rows[name]:
+            return pa.dictionary(pa.int32(), pa.string())
+        return data_type
+
+    def schema(self) -> pa.Schema:
+        if not self.names:
+            raise ValueError("Spreadsheet has no columns")
+        schema = pa.schema([(name, self._compact_type(name)) for name in self.names])
+        self.date_formats = {
+            name: date_formats[0] for name, date_formats in self.date_formats.items()
+            if pa.types.is_timestamp(schema.field(name).type)
+        }
+        return schema
+
+    def convert(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Parse the date columns of a chunk with the format found for them."""
+        if not self.date_formats:
+            return frame
+        frame = frame.copy()
+        for name in self.date_formats:
+            column = next(col for col in frame.columns if str(col) == name)
+            frame[column] = _parse_dates(frame[column], self.date_formats[name])
+        return frame
+
+
+def _cast_to_schema(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    columns = []
+    for field in schema:
+        column = table.column(field.name)
+        if column.type != field.type and pa.types.is_dictionary(field.type):
+            column = column.cast(field.type.value_type)
+        columns.append(column if column.type == field.type else column.cast(field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _decode(column):
+    """A dictionary-encoded column as plain values; other columns unchanged."""
+    return column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column
+
+
+def plain_values(series: pd.Series) -> pd.Series:
+    """A categorical column as its plain values, so min and max compare values, not categories."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(series.cat.categories.dtype)
+    return series
+
+
+def _pandas_dtypes(schema: pa.Schema) -> pd.Series:
+    return schema.empty_table().to_pandas().dtypes
+
+
+def _numeric_ranges(table: pa.Table, ranges: dict):
+    """Widen `ranges` ({column: [min, max]}) with the numeric columns of `table`."""
+    for field in table.schema:
+        if not _is_numeric(field.type):
+            continue
+        bounds = pc.min_max(table.column(field.name)).as_py()
+        if bounds["min"] is None:
+            continue
+        low, high = ranges.get(field.name, (bounds["min"], bounds["max"]))
+        ranges[field.name] = (min(low, bounds["min"]), max(high, bounds["max"]))
+
+
+def _bson_value(value):
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+class _ColumnStatsBuilder:
+    """
+    Accumulates column_stats over the chunks of a table without keeping the chunks. Numeric
+    columns get a histogram over the value range found beforehand (`ranges`); other columns
+    get their most frequent values. Distinct values are tracked up to STATS_DISTINCT_LIMIT per
+    column; past that, distinct_count is a lower bound and top_values an approximation.
+    """
+
+    def __init__(self, schema: pa.Schema, ranges: dict):
+        self.schema = schema
+        self._entries = {field.name: {"null_count": 0} for field in schema}
+        self._numeric = {field.name for field in schema if _is_numeric(field.type)}
+        self._sums = dict.fromkeys(self._numeric, 0)
+        self._counts = dict.fromkeys(self._numeric, 0)
+        self._edges = {}
+        for name in self._numeric:
+            if name in ranges:
+                low, high = (float(bound) for bound in ranges[name])
+                self._edges[name] = np.linspace(low, high, HISTOGRAM_BINS + 1) if high > low else np.array([low, high])
+        self._histograms = {name: np.zeros(len(edges) - 1, dtype=np.int64) for name, edges in self._edges.items()}
+        self._distinct = {name: set() for name in self._numeric}
+        self._frequencies = {field.name: Counter() for field in schema if field.name not in self._numeric}
+        self._exact = set(self._entries)
+
+    def update(self, table: pa.Table):
+        for field in self.schema:
+            name = field.name
+            column = _decode(table.column(name))
+            entry = self._entries[name]
+            entry["null_count"] += column.null_count
+            values = column.drop_null()
+            if len(values) == 0:
+                continue
+            if name in self._numeric:
+                bounds = pc.min_max(values).as_py()
+                entry["min"] = min(entry.get("min", bounds["min"]), bounds["min"])
+                entry["max"] = max(entry.get("max", bounds["max"]), bounds["max"])
+                self._sums[name] += pc.sum(values).as_py()
+                self._counts[name] += len(values)
+                if name in self._edges:
+                    floats = pc.cast(values, pa.float64()).to_numpy()
+                    self._histograms[name] += np.histogram(floats, bins=self._edges[name])[0]
+                if name in self._exact:
+                    self._distinct[name].update(pc.unique(values).to_pylist())
+                    if len(self._distinct[name]) > STATS_DISTINCT_LIMIT:
+                        self._exact.discard(name)
+            else:
+                counts = pc.value_counts(values)
+                frequencies = self._frequencies[name]
+                frequencies.update(dict(zip(counts.field("values").to_pylist(), counts.field("counts").to_pylist())))
+                if len(frequencies) > STATS_DISTINCT_LIMIT:
+                    self._exact.discard(name)
+                    self._frequencies[name] = Counter(dict(frequencies.most_common(STATS_DISTINCT_LIMIT // 2)))
+
+    def result(self, dtypes) -> dict:
+        stats = {}
+        for name, entry in self._entries.items():
+            entry = {"dtype": str(dtypes[name]), **entry}
+            if name in self._numeric:
+                entry["distinct_count"] = len(self._distinct[name])
+                if self._counts[name]:
+                    entry.update({
+                        "min": float(entry["min"]),
+                        "max": float(entry["max"]),
+                        "mean": float(self._sums[name]) / self._counts[name],
+                    })
+                if name in self._edges:
+                    entry["histogram"] = {
+                        "edges": [float(edge) for edge in self._edges[name]],
+                        "counts": [int(count) for count in self._histograms[name]],
+                    }
+            else:
+                entry["distinct_count"] = len(self._frequencies[name])
+                entry["top_values"] = [
+                    {"value": _bson_value(value), "count": int(count)}
+                    for value, count in self._frequencies[name].most_common(STATS_TOP_VALUES)
+                ]
+            if name not in self._exact:
+                entry["approximate"] = True
+            stats[name] = entry
+        return stats
+
+
+def column_stats(df: pd.DataFrame) -> dict:
+    """Per-column summary kept in Mongo next to the schema and served by the context read paths."""
+    table = to_arrow(df)
+    ranges = {}
+    _numeric_ranges(table, ranges)
+    builder = _ColumnStatsBuilder(table.schema, ranges)
+    builder.update(table)
+    return builder.result({str(col): dtype for col, dtype in df.dtypes.items()})
+
+
+def format_column_stats(stats: dict) -> str:
+    """One line per column of stored column_stats, for prompts and summaries."""
+    lines = []
+    for name, entry in stats.items():
+        parts = [f"{entry.get('null_count', 0)} nulls", f"{entry.get('distinct_count', 0)} distinct"]
+        for key in ("min", "max", "mean"):
+            if key in entry:
+                parts.append(f"{key} {entry[key]:g}")
+        if entry.get("top_values"):
+            parts.append("top " + ", ".join(f"{top['value']} ({top['count']})" for top in entry["top_values"]))
+        approximate = " (approximate)" if entry.get("approximate") else ""
+        lines.append(f"- {name} ({entry.get('dtype', 'unknown')}): {'; '.join(parts)}{approximate}")
+    return "\n".join(lines)
+
+
+def stored_column_stats(table: dict) -> dict:
+    """column_stats of an already stored table, computed one row group at a time."""
+    parquet_file = pq.ParquetFile(_ensure_local_copy(table), memory_map=True)
+    ranges = {}
+    for i in range(parquet_file.num_row_groups):
+        _numeric_ranges(parquet_file.read_row_group(i), ranges)
+    builder = _ColumnStatsBuilder(parquet_file.schema_arrow, ranges)
+    for i in range(parquet_file.num_row_groups):
+        builder.update(parquet_file.read_row_group(i))
+    return builder.result(_pandas_dtypes(parquet_file.schema_arrow))
+
+
+def _write_table(context_id, frames) -> tuple:
+    """
+    Stream the DataFrames returned by `frames()` into one Parquet object, one row group per
+    frame. `frames` is called twice: the first pass only settles one compact Arrow type per
+    column (see _TypeProfiler) and the numeric ranges for histograms, the second converts,
+    writes and collects column stats, so a single chunk is in memory at a time. Returns the
+    table metadata and a summary of the table (schema, sample, shape, column_stats). The
+    table's value index is stored next to it, and `memory_bytes` records the pandas memory of
+    the table with default and with compact dtypes.
+    """
+    profiler = _TypeProfiler()
+    for frame in frames():
+        profiler.update(frame)
+    schema = profiler.schema()
+    names = schema.names
+
+    os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".parquet.part", dir=TABLE_CACHE_DIR)
+    os.close(fd)
+    stats = _ColumnStatsBuilder(schema, profiler.ranges)
+    values = ValueIndexBuilder(schema)
+    num_rows, sample = 0, []
+    memory = {"default": 0, "compact": 0}
+    try:
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for frame in frames():
+                if frame.empty:
+                    continue
+                chunk = _cast_to_schema(to_arrow(profiler.convert(frame)), schema)
+                writer.write_table(chunk, row_group_size=chunk.num_rows)
+                memory["default"] += int(frame.memory_usage(deep=True, index=False).sum())
+                memory["compact"] += int(chunk.to_pandas().memory_usage(deep=True, index=False).sum())
+                stats.update(chunk)
+                values.update(chunk)
+                if not sample:
+                    sample = [
+                        {key: value if value is None else _bson_value(value) for key, value in row.items()}
+                        for row in chunk.slice(0, 5).to_pylist()
+                    ]
+                num_rows += chunk.num_rows
+        size = os.path.getsize(path)
+        object_name = _table_object_name(context_id)
+        result = minio_client.fput_object(
+            TABLE_BUCKET, object_name, path, content_type="application/vnd.apache.parquet"
+        )
+        table = {
+            "object_name": object_name,
+            "etag": result.etag,
+            "format": "parquet",
+            "num_rows": num_rows,
+            "num_columns": len(names),
+            "size_bytes": size,
+            "memory_bytes": memory,
+        }
+        # The written file is exactly the uploaded version, so keep it as the local copy.
+        os.replace(path, _local_path(table))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    logger.info(f"Stored table for context {context_id} as {object_name} ({size} bytes, {num_rows} rows)")
+    logger.info(
+        f"Compact dtypes of context {context_id} table: {memory['default']} -> {memory['compact']} bytes in memory"
+    )
+    table["value_index"] = save_value_index(context_id, values.build())
+    dtypes = _pandas_dtypes(schema)
+    summary = {
+        "schema": {name: str(dtype) for name, dtype in dtypes.items()},
+        "sample": sample,
+        "shape": (num_rows, len(names)),
+        "column_stats": stats.result(dtypes),
+    }
+    return table, summary
+
+
+def save_value_index(context_id, index: TableValueIndex) -> dict:
+    """Store a table's value index as a Parquet object and return its metadata."""
+    buffer = io.BytesIO()
+    pq.write_table(index.to_arrow(), buffer, compression="zstd")
+    data = buffer.getvalue()
+    object_name = _value_index_object_name(context_id)
+    result = minio_client.put_object(
+        bucket_name=TABLE_BUCKET,
+        object_name=object_name,
+        data=io.BytesIO(data),
+        length=len(data),
+        content_type="application/vnd.apache.parquet",
+    )
+    return {"object_name": object_name, "etag": result.etag, "size_bytes": len(data)}
+
+
+def save_table(context_id, df: pd.DataFrame) -> dict:
+    """Write `df` as a Parquet object and return the metadata stored on the context document."""
+    return _write_table(context_id, lambda: [df])[0]
+
+
+def ingest_table(context_id, file_content: bytes, file_type: str) -> dict:
+    """
+    Store an uploaded CSV or Excel file as Parquet tables, reading it in chunks. Every sheet
+    of a workbook that has a header row becomes its own table. Returns the context document
+    fields of the first table (table, schema, sample, shape and column_stats) and, for a
+    workbook with several sheets, `sheets`: the same fields and the name of each sheet.
+    """
+    if file_type != "excel":
+        table, summary = _write_table(context_id, lambda: iter_spreadsheet_chunks(file_content, file_type))
+        return {"table": table, **summary}
+    names = list_excel_sheets(file_content)
+    if not names:
+        raise ValueError("Spreadsheet has no columns")
+    sheets = []
+    try:
+        for i, name in enumerate(names):
+            # The first sheet keeps the context's own object name; later sheets are numbered.
+            sheet_id = context_id if i == 0 else f"{context_id}.{i}"
+            table, summary = _write_table(
+                sheet_id, lambda name=name: iter_spreadsheet_chunks(file_content, file_type, sheet_name=name)
+            )
+            sheets.append({"name": name, "table": table, **summary})
+    except Exception:
+        delete_table(context_id, sheets=sheets)
+        raise
+    result = {key: value for key, value in sheets[0].items() if key != "name"}
+    if len(sheets) > 1:
+        result["sheets"] = sheets
+    return result
+
+
+def select_sheets(question: str, sheets: List[dict]) -> List[dict]:
+    """
+    The sheets of a workbook that a question is about: those whose name or one of whose
+    columns the question mentions. A question that mentions none of them gets every sheet.
+    """
+    text = normalize_value(question)
+
+    def mentioned(name) -> bool:
+        name = normalize_value(name).strip()
+        return bool(name) and re.search(rf"(?<!\w){re.escape(name)}(?!\w)", text) is not None
+
+    selected = [
+        sheet for sheet in sheets
+        if mentioned(sheet["name"]) or any(mentioned(col) for col in sheet.get("schema", {}))
+    ]
+    return selected or list(sheets)
+
+
+def _ensure_local_copy(table: dict) -> str:
+    path = _local_path(table)
+    if not os.path.exists(path):
+        os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+        partial = f"{path}.{os.getpid()}.part"
+        minio_client.fget_object(TABLE_BUCKET, table["object_name"], partial)
+        os.replace(partial, path)
+    return path
+
+
+def load_table(table: dict, columns: Optional[list] = None) -> pd.DataFrame:
+    """Load a stored table (the `table` metadata of a context document) into a DataFrame."""
+    arrow_table = pq.read_table(_ensure_local_copy(table), columns=columns, memory_map=True)
+    return arrow_table.to_pandas()
+
+
+class StoredTable:
+    """
+    Out-of-core view of a stored table that is too large to load. It provides the DataFrame
+    members the tabular question helpers use (columns, dtypes, empty, head, describe) and
+    answers filters and aggregates by scanning single columns of the memory-mapped Parquet
+    file. A filter first finds the matching values of its column, then reads full rows through
+    an `isin` predicate, so only row groups whose statistics can contain a match are decoded.
+    """
+
+    def __init__(self, table: dict, stats: Optional[dict] = None):
+        self.table = table
+        self.stats = stats or {}
+        self.path = _ensure_local_copy(table)
+        self._file = pq.ParquetFile(self.path, memory_map=True)
+        self.schema = self._file.schema_arrow
+        self.columns = pd.Index(self.schema.names)
+        self.dtypes = _pandas_dtypes(self.schema)
+        self.num_rows = self._file.metadata.num_rows
+        self.classifier = None
+
+    @property
+    def empty(self) -> bool:
+        return self.num_rows == 0 or len(self.columns) == 0
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, col) -> pd.Series:
+        """Distinct non-null values of `col`, which is all the value matching helpers need."""
+        return pd.Series(self.distinct_values(col), name=col, dtype=object)
+
+    def iter_column(self, col):
+        for batch in self._file.iter_batches(batch_size=TABLE_SCAN_BATCH_ROWS, columns=[col]):
+            yield _decode(batch.column(0))
+
+    def distinct_values(self, col) -> list:
+        values = {}
+        for array in self.iter_column(col):
+            values.update(dict.fromkeys(pc.unique(array.drop_null()).to_pylist()))
+        return list(values)
+
+    def _value_type(self, col) -> pa.DataType:
+        return _decode(pa.array([], self.schema.field(col).type)).type
+
+    def _to_pandas(self, batches, limit: int) -> pd.DataFrame:
+        return pa.Table.from_batches(batches, schema=self.schema).slice(0, limit).to_pandas()
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        batches, rows = [], 0
+        if n > 0:
+            for batch in self._file.iter_batches(batch_size=n):
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= n:
+                    break
+        return self._to_pandas(batches, n)
+
+    def _filter_isin(self, col, values: pa.Array, limit: int) -> pd.DataFrame:
+        if len(values) == 0:
+            return self.head(0)
+        dataset = ds.dataset(self.path, format="parquet")
+        batches, rows = [], 0
+        for batch in dataset.to_batches(filter=ds.field(col).isin(values)):
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= limit:
+                break
+        return self._to_pandas(batches, limit)
+
+    def filter_normalized(self, col, value, contains: bool = False, limit: int = None) -> pd.DataFrame:
+        """
+        Up to `limit` rows whose normalized `col` equals, or with `contains` contains, the
+        normalized `value`. Only the column's distinct values are normalized and compared.
+        """
+        distinct = pd.Series(self.distinct_values(col))
+        normalized = normalize_series(distinct)
+        value = normalize_value(value)
+        mask = normalized.str.contains(value, regex=False, na=False) if contains else normalized.eq(value)
+        values = pa.array(distinct[mask.to_numpy(dtype=bool)].tolist(), type=self._value_type(col))
+        return self._filter_isin(col, values, limit or TABLE_RESULT_ROWS)
+
+    def filter_values(self, col, values: List[str], limit: int = None) -> pd.DataFrame:
+        """Up to `limit` rows whose `col` value, as a string, is one of `values`."""
+        values = pa.array(values, type=pa.string()).cast(self._value_type(col))
+        return self._filter_isin(col, values, limit or TABLE_RESULT_ROWS)
+
+    def aggregate(self, col, func: str):
+        """count, sum, mean, min or max of one column, computed a batch at a time."""
+        count, total, low, high = 0, 0, None, None
+        for array in self.iter_column(col):
+            count += len(array) - array.null_count
+            if func in ("sum", "mean"):
+                total += pc.sum(array).as_py() or 0
+            elif func in ("min", "max"):
+                bounds = pc.min_max(array).as_py()
+                if bounds["min"] is not None:
+                    low = bounds["min"] if low is None else min(low, bounds["min"])
+                    high = bounds["max"] if high is None else max(high, bounds["max"])
+        if func == "count":
+            return count
+        if func == "sum":
+            return total
+        if func == "mean":
+            return total / count if count else None
+        return low if func == "min" else high
+
+    def group_aggregate(self, group_col, col, func: str) -> pd.Series:
+        """
+        count, sum, mean, min or max of `col` (None counts rows) for each value of `group_col`.
+        Each batch of the two columns is grouped by Arrow and the partial results are merged.
+        """
+        columns = [group_col] if col is None or col == group_col else [group_col, col]
+        if col is None:
+            aggregations = [([], "count_all")]
+        elif func == "mean":
+            aggregations = [(col, "sum"), (col, "count")]
+        else:
+            aggregations = [(col, func)]
+        partials = []
+        for batch in self._file.iter_batches(batch_size=TABLE_SCAN_BATCH_ROWS, columns=columns):
+            chunk = pa.Table.from_arrays([_decode(column) for column in batch.columns], names=batch.schema.names)
+            partials.append(chunk.group_by(group_col).aggregate(aggregations).to_pandas())
+        merged = pd.concat(partials) if partials else pd.DataFrame(columns=[group_col])
+        grouped = merged.groupby(group_col, dropna=False)
+        if col is None:
+            return grouped["count_all"].sum()
+        if func == "mean":
+            return grouped[f"{col}_sum"].sum() / grouped[f"{col}_count"].sum()
+        merge = {"count": "sum", "sum": "sum", "min": "min", "max": "max"}[func]
+        return grouped[f"{col}_{func}"].agg(merge)
+
+    def describe(self, include=None) -> pd.DataFrame:
+        """The stored column_stats laid out like DataFrame.describe(), without histograms."""
+        return pd.DataFrame({
+            col: {key: value for key, value in self.stats.get(col, {}).items() if key != "histogram"}
+            for col in self.columns
+        })
+
+
+def open_table(context_id, table: dict, stats: Optional[dict] = None):
+    """
+    Open a context's stored table for querying: a cached DataFrame, or a StoredTable when it
+    has more than TABLE_IN_MEMORY_ROWS rows. A StoredTable gets its query classifier from
+    the cache, where it is kept per table version.
+    """
+    if table.get("num_rows", 0) > TABLE_IN_MEMORY_ROWS:
+        stored = StoredTable(table, stats)
+        version = f"classifier:{table.get('etag') or table['object_name']}"
+        stored.classifier = table_cache.get(context_id, version)
+        if stored.classifier is None:
+            stored.classifier = TableQueryClassifier(stored.columns)
+            table_cache.set(context_id, version, stored.classifier, size=stored.classifier.nbytes)
+        return stored
+    return get_table(context_id, table)
+
+
+def query_classifier(table) -> TableQueryClassifier:
+    """The query classifier of a loaded table, built once per cached table (or StoredTable)."""
+    if isinstance(table, StoredTable):
+        if table.classifier is None:
+            table.classifier = TableQueryClassifier(table.columns)
+        return table.classifier
+    return table_cache.derived(
+        table, ("classifier",), lambda: TableQueryClassifier(table.columns), lambda classifier: classifier.nbytes
+    )
+
+
+def get_table(context_id, table: dict) -> pd.DataFrame:
+    """Load a context's table through the process-wide cache; the object etag is its version."""
+    version = table.get("etag") or table["object_name"]
+    df = table_cache.get(context_id, version)
+    if df is None:
+        df = load_table(table)
+        table_cache.set(context_id, version, df)
+    return df
+
+
+def build_value_index(table: dict) -> TableValueIndex:
+    """Build the value index of an already stored table, one row group at a time."""
+    parquet_file = pq.ParquetFile(_ensure_local_copy(table), memory_map=True)
+    builder = ValueIndexBuilder(parquet_file.schema_arrow)
+    for i in range(parquet_file.num_row_groups):
+        builder.update(parquet_file.read_row_group(i))
+    return builder.build()
+
+
+def get_value_index(context_id, table: dict) -> Optional[TableValueIndex]:
+    """Load a table's value index through the table cache, or None for tables stored without one."""
+    meta = table.get("value_index")
+    if not meta:
+        return None
+    version = f"values:{meta.get('etag') or meta['object_name']}"
+    index = table_cache.get(context_id, version)
+    if index is None:
+        index = TableValueIndex.from_arrow(pq.read_table(_ensure_local_copy(meta), memory_map=True))
+        table_cache.set(context_id, version, index, size=index.nbytes)
+    return index
+
+
+def get_legacy_table(context_id, data_json: str) -> pd.DataFrame:
+    """Parse a legacy data_json table through the cache. Such documents are never rewritten in place."""
+    df = table_cache.get(context_id, "data_json")
+    if df is None:
+        df = pd.read_json(io.StringIO(data_json), orient="split")
+        table_cache.set(context_id, "data_json", df)
+    return df
+
+
+def delete_table(context_id, table: dict = None, sheets: List[dict] = None):
+    """Remove a context's stored table, or the tables of all its `sheets`, and their value indexes."""
+    table_cache.invalidate(context_id)
+    tables = [table] + [sheet["table"] for sheet in sheets or []]
+    stored = {meta["object_name"]: meta for meta in tables if meta}
+    for meta in [meta for entry in stored.values() for meta in (entry, entry.get("value_index")) if meta]:
+        try:
+            minio_client.remove_object(TABLE_BUCKET, meta["object_name"])
+        except Exception as e:
+            logger.warning(f"Failed to remove table object {meta.get('object_name')}: {e}")
+        try:
+            os.remove(_local_path(meta))
+        except FileNotFoundError:
+            pass
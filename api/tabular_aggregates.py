@@ -0,0 +1,216 @@
+from typing import List, Optional, Tuple
+
+import os
+import re
+import difflib
+import logging
+
+import pandas as pd
+
+from api.tabular import StoredTable, plain_values
+from api.value_index import normalize_value
+
+logger = logging.getLogger(__name__)
+
+# Aggregate questions parsed with at least this confidence are answered without an LLM call.
+AGGREGATE_MIN_CONFIDENCE = float(os.getenv("AGGREGATE_MIN_CONFIDENCE", "0.8"))
+AGGREGATE_MAX_GROUPS = 50
+LIST_ALL_ROWS = 20
+
+_AGGREGATES = {
+    "average": "mean", "avg": "mean", "mean": "mean",
+    "sum": "sum", "total": "sum",
+    "count": "count", "number of": "count", "how many": "count",
+    "min": "min", "minimum": "min", "lowest": "min", "smallest": "min",
+    "max": "max", "maximum": "max", "highest": "max", "largest": "max",
+}
+_LABELS = {"mean": "Average", "sum": "Sum", "count": "Count", "min": "Minimum", "max": "Maximum"}
+_AGGREGATE_PATTERN = re.compile(r"\b(" + "|".join(sorted(_AGGREGATES, key=len, reverse=True)) + r")\b")
+_GROUP_PATTERN = re.compile(r"\b(?:grouped by|group by|broken down by|for each|for every|per|by)\s+(?:each\s+|the\s+)?(.+?)\s*[?.!]*$")
+# Words that usually introduce a condition the engine cannot apply ("total amount where city is X").
+_CONDITION_PATTERN = re.compile(r"\b(?:where|when|whose|which|that|only|except|between|after|before|since|during|for|from|in|on|with|if)\b|[<>=]")
+_FILLER = re.compile(r"\b(?:of|the|all|a|an|is|are|there|what|whats|value|values|column|field)\b")
+_ROW_WORDS = {"rows", "row", "records", "record", "entries", "entry", "items", "lines"}
+
+
+class AggregatePlan:
+    """
+    A parsed aggregate question: `func` over `column` (None counts rows), optionally grouped by
+    `group_by`. `confidence` is 1.0 for an unambiguous parse and drops for fuzzy column
+    matches, conflicting aggregate words and conditions the engine cannot apply; `notes`
+    says why.
+    """
+
+    def __init__(self, func=None, column=None, group_by=None, confidence: float = 0.0, notes: List[str] = None):
+        self.func = func
+        self.column = column
+        self.group_by = group_by
+        self.confidence = confidence
+        self.notes = notes or []
+
+    @property
+    def label(self) -> str:
+        return f"{self.func}_{self.column if self.column is not None else 'rows'}"
+
+    def describe(self) -> str:
+        text = f"{_LABELS[self.func]} of {self.column if self.column is not None else 'rows'}"
+        return f"{text} by {self.group_by}" if self.group_by is not None else text
+
+
+def _mentioned_columns(text: str, columns) -> List:
+    """Columns whose normalized name appears in `text` as whole words, longest names first."""
+    found = []
+    for col in sorted(columns, key=lambda c: len(str(c)), reverse=True):
+        name = normalize_value(col)
+        if name and re.search(rf"(?<!\w){re.escape(name)}(?!\w)", text):
+            found.append(col)
+            text = re.sub(rf"(?<!\w){re.escape(name)}(?!\w)", " ", text)
+    return found
+
+
+def _unplaced_words(text: str) -> List[str]:
+    """The words of `text` that are not filler, i.e. that the parse has not accounted for."""
+    return re.findall(r"\w+", _FILLER.sub(" ", text))
+
+
+def _match_column(phrase: str, columns) -> Tuple[Optional[object], bool, str]:
+    """
+    The column that `phrase` starts with: (column, True, rest) for an exact mention and
+    (column, False, rest) for a fuzzy one, where `rest` is what follows the column's words.
+    """
+    phrase = _FILLER.sub(" ", phrase).strip()
+    if not phrase:
+        return None, False, ""
+    names = {normalize_value(col): col for col in columns}
+    words = phrase.split()
+    for n in range(len(words), 0, -1):
+        if " ".join(words[:n]) in names:
+            return names[" ".join(words[:n])], True, " ".join(words[n:])
+    for n in range(min(len(words), 4), 0, -1):
+        close = difflib.get_close_matches(" ".join(words[:n]), list(names), n=1, cutoff=0.8)
+        if close:
+            return names[close[0]], False, " ".join(words[n:])
+    return None, False, phrase
+
+
+def parse_aggregate(question: str, columns, dtypes=None) -> AggregatePlan:
+    q = normalize_value(question)
+    matches = list(_AGGREGATE_PATTERN.finditer(q))
+    if not matches:
+        return AggregatePlan(notes=["no aggregate function"])
+    plan = AggregatePlan(func=_AGGREGATES[matches[0].group(1)], confidence=1.0)
+    if len({_AGGREGATES[m.group(1)] for m in matches}) > 1:
+        plan.confidence *= 0.4
+        plan.notes.append("several aggregate functions")
+    prefix, rest = q[:matches[0].start()], q[matches[-1].end():]
+
+    unplaced = []
+    group = _GROUP_PATTERN.search(rest)
+    if group:
+        rest = rest[:group.start()]
+        plan.group_by, exact, group_rest = _match_column(group.group(1), columns)
+        if plan.group_by is not None:
+            unplaced += _unplaced_words(group_rest)
+        if plan.group_by is None:
+            plan.confidence *= 0.4
+            plan.notes.append(f"unknown group column {group.group(1)!r}")
+        elif not exact:
+            plan.confidence *= 0.85
+            plan.notes.append(f"group column matched fuzzily to {plan.group_by!r}")
+
+    mentioned = [col for col in _mentioned_columns(rest, columns) if col != plan.group_by]
+    leftover = rest
+    if mentioned:
+        plan.column = mentioned[0]
+        if len(mentioned) > 1:
+            plan.confidence *= 0.5
+            plan.notes.append(f"several columns mentioned: {mentioned}")
+        for col in mentioned:
+            leftover = leftover.replace(normalize_value(col), " ")
+    else:
+        words = _FILLER.sub(" ", rest).split()
+        if plan.func == "count" and (not words or words[0] in _ROW_WORDS):
+            leftover = " ".join(words[1:])
+        else:
+            plan.column, _, leftover = _match_column(rest, columns)
+            if plan.column is None:
+                plan.confidence = 0.0
+                plan.notes.append("no column found")
+                return plan
+            plan.confidence *= 0.85
+            plan.notes.append(f"column matched fuzzily to {plan.column!r}")
+
+    if _CONDITION_PATTERN.search(prefix) or _CONDITION_PATTERN.search(leftover):
+        plan.confidence *= 0.5
+        plan.notes.append("question has conditions")
+    # Words the parse could not place may qualify the question ("last month", "excluding
+    # refunds") in ways the engine would silently ignore.
+    unplaced += _unplaced_words(leftover)
+    if unplaced:
+        plan.confidence *= 0.5
+        plan.notes.append(f"unparsed words: {' '.join(unplaced)}")
+    if plan.func in ("sum", "mean") and dtypes is not None and plan.column is not None:
+        dtype = dtypes[plan.column]
+        if not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            plan.confidence = 0.0
+            plan.notes.append(f"{plan.column!r} is not numeric")
+    return plan
+
+
+def run_aggregate(table, plan: AggregatePlan) -> pd.DataFrame:
+    """Compute `plan` over a DataFrame or StoredTable; grouped results are sorted by value."""
+    if plan.group_by is None:
+        if plan.column is None:
+            value = len(table)
+        elif isinstance(table, StoredTable):
+            value = table.aggregate(plan.column, plan.func)
+        else:
+            value = getattr(plain_values(table[plan.column]), plan.func)()
+        return pd.DataFrame({plan.label: [value]})
+
+    if isinstance(table, StoredTable):
+        series = table.group_aggregate(plan.group_by, plan.column, plan.func)
+    else:
+        groups = plain_values(table[plan.group_by])
+        if plan.column is None:
+            series = groups.groupby(groups, dropna=False).size()
+        else:
+            series = plain_values(table[plan.column]).groupby(groups, dropna=False).agg(plan.func)
+    series = series.sort_values(ascending=plan.func == "min", kind="stable")
+    return series.rename(plan.label).reset_index()
+
+
+def answer_directly(question: str, query_type: str, table, filename: str) -> Optional[str]:
+    """
+    A formatted answer for `list_all` questions and confidently parsed aggregates, computed
+    from the table without an LLM. Returns None when the question should go to the LLM.
+    """
+    total_rows = len(table)
+    if query_type == "list_all":
+        rows = table.head(LIST_ALL_ROWS)
+        return (
+            f"Table '{filename}' has {total_rows} rows; the first {len(rows)} are:\n"
+            f"{rows.to_markdown(index=False)}"
+        )
+    if query_type != "aggregate":
+        return None
+    plan = parse_aggregate(question, table.columns, table.dtypes)
+    logger.info(
+        "Parsed aggregate for table %s: %s (confidence %.2f; %s)",
+        filename, plan.describe() if plan.func else None, plan.confidence, "; ".join(plan.notes) or "exact parse",
+    )
+    if plan.confidence < AGGREGATE_MIN_CONFIDENCE:
+        return None
+    try:
+        result = run_aggregate(table, plan)
+    except Exception as exc:
+        logger.warning("Direct aggregate failed for table %s: %s", filename, exc)
+        return None
+    note = ""
+    if len(result) > AGGREGATE_MAX_GROUPS:
+        note = f"\n(showing {AGGREGATE_MAX_GROUPS} of {len(result)} groups)"
+        result = result.head(AGGREGATE_MAX_GROUPS)
+    return (
+        f"{plan.describe()}, computed over all {total_rows} rows of '{filename}' "
+        f"(parse confidence {plan.confidence:.2f}):\n{result.to_markdown(index=False)}{note}"
+    )
@@ -0,0 +1,127 @@
+from typing import Dict, Optional, Tuple
+
+import re
+import difflib
+
+from api.value_index import normalize_value
+
+_LIST_ALL = re.compile(r"^\s*(?:list|show) all\b")
+_PATTERN_QUERY = re.compile(r"(contains|starts with|ends with|pattern)")
+_AGGREGATE_QUERY = re.compile(r"\b(average|mean|sum|total|count|min|max)\b")
+_ROW_QUERY = re.compile(r"(info for|details for|row for|record for)")
+_GENERIC_FILTER = re.compile(r"\b([\w@.\- ]+)\b.*\b(is|=|equals|named|with|of|to)\b\s*['\"]?([\w@.\- ]+)['\"]?")
+_PATTERN_VALUE = re.compile(r"(?:contains|starts with|ends with)\s+['\"]?([\w@.\- ]+)['\"]?", re.IGNORECASE)
+_ROW_IDENTIFIER = re.compile(r"(?:info for|details for|row for|record for)\s+['\"]?([\w@.\- ]+)['\"]?", re.IGNORECASE)
+_WORDS = re.compile(r"\b[\w@.\- ]+\b")
+_AGGREGATES = {
+    "average": "mean",
+    "mean": "mean",
+    "sum": "sum",
+    "total": "sum",
+    "count": "count",
+    "min": "min",
+    "max": "max",
+}
+_AGGREGATE_PATTERNS = [
+    (func, re.compile(rf"{word}\s+(?:of\s+)?([\w_ ]+)", re.IGNORECASE)) for word, func in _AGGREGATES.items()
+]
+
+
+class TableQueryClassifier:
+    """
+    Classifies tabular questions and pulls out the column and value they refer to. The
+    normalized column names and the per-column patterns are built once per table (see
+    query_classifier in api.tabular), so a question on a wide table compiles no regexes and
+    only tries the patterns of columns whose name occurs in it.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.normalized = [normalize_value(col) for col in self.columns]
+        self._by_normalized: Dict[str, object] = {}
+        for col, name in zip(self.columns, self.normalized):
+            self._by_normalized.setdefault(name, col)
+        self._patterns = []
+        for col, name in zip(self.columns, self.normalized):
+            mention = rf"\b{re.escape(name)}\b"
+            self._patterns.append((
+                col,
+                name,
+                re.compile(mention),
+                re.compile(rf"{mention}.*\b(is|=|equals|named|with|of|to)\b.*\b([\w@.\- ]+)"),
+                re.compile(rf"{mention}.*\b(is|=|equals|named|with|of|to)\b\s*['\"]?([\w@.\- ]+)['\"]?"),
+            ))
+
+    @property
+    def nbytes(self) -> int:
+        return 200 * len(self._patterns) + sum(len(name) for name in self.normalized)
+
+    def _mentioned(self, q: str):
+        """Patterns of the columns whose normalized name occurs in `q`, in column order."""
+        return [patterns for patterns in self._patterns if patterns[1] in q]
+
+    def classify(self, question: str) -> str:
+        q = normalize_value(question)
+        if _LIST_ALL.match(q):
+            return "list_all"
+        if any(filter_query.search(q) for _, _, _, filter_query, _ in self._mentioned(q)):
+            return "filter_exact"
+        if _PATTERN_QUERY.search(q):
+            return "filter_pattern"
+        if _AGGREGATE_QUERY.search(q):
+            return "aggregate"
+        if _ROW_QUERY.search(q):
+            return "full_row"
+        return "unknown"
+
+    def best_column(self, candidate: str):
+        """The column named by `candidate`: an exact normalized match, else the closest name."""
+        name = normalize_value(candidate)
+        if name in self._by_normalized:
+            return self._by_normalized[name]
+        close = difflib.get_close_matches(name, self.normalized, n=1, cutoff=0.8)
+        return self._by_normalized[close[0]] if close else None
+
+    def column_value(self, question: str) -> Tuple[Optional[object], Optional[str]]:
+        """(column, value as written) of a `<column> is <value>` question."""
+        q = normalize_value(question)
+        for col, _, _, _, filter_value in self._mentioned(q):
+            m = filter_value.search(q)
+            if m:
+                return col, m.group(2).strip()
+        m = _GENERIC_FILTER.search(q)
+        if m:
+            col = self.best_column(m.group(1).strip())
+            if col is not None:
+                return col, m.group(3).strip()
+        return None, None
+
+    def pattern(self, question: str) -> Optional[str]:
+        m = _PATTERN_VALUE.search(normalize_value(question))
+        return m.group(1).strip() if m else None
+
+    def pattern_column(self, question: str):
+        q = normalize_value(question)
+        for col, _, mention, _, _ in self._mentioned(q):
+            if mention.search(q):
+                return col
+        for word in _WORDS.findall(q):
+            col = self.best_column(word)
+            if col is not None:
+                return col
+        return None
+
+    def aggregate(self, question: str) -> Tuple[Optional[str], Optional[object]]:
+        q = normalize_value(question)
+        for func, pattern in _AGGREGATE_PATTERNS:
+            m = pattern.search(q)
+            if m:
+                col = self.best_column(m.group(1).strip())
+                if col is not None:
+                    return func, col
+        return None, None
+
+    def row_identifier(self, question: str) -> Optional[str]:
+        m = _ROW_IDENTIFIER.search(normalize_value(question))
+        return m.group(1).strip() if m else None
+
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+
+# The Sheets connector also reads file metadata from Drive to tell whether a spreadsheet changed.
+SHEETS_SCOPES = (
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",
+)
+DRIVE_SCOPES = ("https://www.googleapis.com/auth/drive.readonly",)
+# Idle service objects kept per connector and API; a busier connector builds extra ones on demand.
+GOOGLE_CLIENT_POOL_SIZE = int(os.getenv("GOOGLE_CLIENT_POOL_SIZE", "4"))
+
+
+def service_account_info(settings) -> Optional[Dict[str, Any]]:
+    """The service account JSON of a Google connector's settings, parsed if stored as a string."""
+    if not settings:
+        return None
+    if isinstance(settings, str):
+        return json.loads(settings)
+    return settings
+
+
+def settings_fingerprint(info: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(info, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _ConnectorClients:
+    """Credentials of one connector and scope set, and the idle service objects built on them."""
+
+    def __init__(self, fingerprint: str, credentials):
+        self.fingerprint = fingerprint
+        self.credentials = credentials
+        self.refresh_lock = threading.Lock()
+        self.idle: Dict[tuple, list] = {}
+
+
+class GoogleClientPool:
+    """
+    Per-connector pool of Google API service objects. Credentials are parsed from the service
+    account key once and keep their access token until it expires; a token is refreshed by
+    one caller at a time. Service objects are built from the discovery document shipped with
+    google-api-python-client and, since their HTTP transport is not thread-safe, each is lent
+    to one caller at a time through `service()`.
+
+    Entries are keyed by connector id and remember a fingerprint of the settings they were
+    built from, so a connector whose settings changed in another worker gets new clients;
+    update_connector_settings also invalidates the connector here.
+    """
+
+    def __init__(self, max_idle: int = GOOGLE_CLIENT_POOL_SIZE):
+        self.max_idle = max_idle
+        self._clients: Dict[tuple, _ConnectorClients] = {}
+        self._lock = threading.Lock()
+        self.credentials_built = 0
+        self.services_built = 0
+
+    def _connector_clients(self, connector_id, info: Dict[str, Any], scopes) -> _ConnectorClients:
+        fingerprint = settings_fingerprint(info)
+        key = (str(connector_id or fingerprint), tuple(scopes))
+        with self._lock:
+            clients = self._clients.get(key)
+            if clients is not None and clients.fingerprint == fingerprint:
+                return clients
+        credentials = service_account.Credentials.from_service_account_info(info, scopes=list(scopes))
+        with self._lock:
+            clients = self._clients.get(key)
+            if clients is None or clients.fingerprint != fingerprint:
+                clients = _ConnectorClients(fingerprint, credentials)
+                self._clients[key] = clients
+                self.credentials_built += 1
+            return clients
+
+    @contextmanager
+    def service(self, connector_id, settings, api: str, version: str, scopes):
+        """
+        Lends a `build(api, version)` service object authorized with the connector's service
+        account. `connector_id` may be None, in which case the settings identify the entry.
+        """
+        info = service_account_info(settings)
+        clients = self._connector_clients(connector_id, info, scopes)
+        with clients.refresh_lock:
+            if not clients.credentials.valid:
+                clients.credentials.refresh(Request())
+        with self._lock:
+            idle = clients.idle.setdefault((api, version), [])
+            service = idle.pop() if idle else None
+        if service is None:
+            service = build(
+                api, version, credentials=clients.credentials, static_discovery=True, cache_discovery=False,
+            )
+            with self._lock:
+                self.services_built += 1
+        try:
+            yield service
+        finally:
+            with self._lock:
+                if len(idle) < self.max_idle:
+                    idle.append(service)
+
+    def invalidate(self, connector_id) -> int:
+        """Drops the credentials and services of a connector; returns how many entries were removed."""
+        with self._lock:
+            keys = [key for key in self._clients if key[0] == str(connector_id)]
+            for key in keys:
+                del self._clients[key]
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "connectors": len({key[0] for key in self._clients}),
+                "idle_services": sum(len(idle) for clients in self._clients.values() for idle in clients.idle.values()),
+                "credentials_built": self.credentials_built,
+                "services_built": self.services_built,
+            }
+
+
+google_clients = GoogleClientPool()
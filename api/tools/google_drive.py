@@ -1,31 +1,25 @@
 import io
-import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
-from google.oauth2 import service_account
 from langchain.tools import tool
 
-def _run_google_drive_tool(file_id: str, settings: Dict[str, Any]) -> str:
+from api.tools.google_clients import DRIVE_SCOPES, google_clients, service_account_info
+
+def _run_google_drive_tool(file_id: str, settings: Dict[str, Any], connector_id: Optional[str] = None) -> str:
     try:
-        creds_info = settings
-        if not creds_info:
+        if not service_account_info(settings):
             return "Error: Service account information not found in connector settings."
-        if isinstance(creds_info, str):
-            creds_info = json.loads(creds_info)
 
-        scopes = ['https://www.googleapis.com/auth/drive.readonly']
-        creds = service_account.Credentials.from_service_account_info(creds_info, scopes=scopes)
-        service = build('drive', 'v3', credentials=creds)
-        request = service.files().get_media(fileId=file_id)
         file_buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_buffer, request)
-        
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
+        with google_clients.service(connector_id, settings, 'drive', 'v3', DRIVE_SCOPES) as service:
+            request = service.files().get_media(fileId=file_id)
+            downloader = MediaIoBaseDownload(file_buffer, request)
+
+            done = False
+            while not done:
+                _, done = downloader.next_chunk()
 
         file_buffer.seek(0)
         try:
@@ -43,7 +37,7 @@ def _run_google_drive_tool(file_id: str, settings: Dict[str, Any]) -> str:
     except Exception as e:
         return f"An unexpected error occurred: {e}"
 
-def get_google_drive_tool(settings: Dict[str, Any], name: str):
+def get_google_drive_tool(settings: Dict[str, Any], name: str, llm_label: Optional[str] = None, connector_id: Optional[str] = None):
     """
     Factory function to create a Google Drive file reader tool.
     Returns a @tool-decorated function that reads a file from Google Drive given its file_id.
@@ -60,7 +54,7 @@ def get_google_drive_tool(settings: Dict[str, Any], name: str):
         """
         Reads the content of a Google Drive file by file_id using the provided service account settings.
         """
-        return _run_google_drive_tool(file_id, settings)
+        return _run_google_drive_tool(file_id, settings, connector_id)
 
     google_drive_tool.name = name
     return google_drive_tool
\ No newline at end of file
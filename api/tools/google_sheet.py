@@ -1,47 +1,199 @@
-import json
-from typing import Dict, Any
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import logging
+import os
+import threading
+import time
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from langchain.tools import tool
 from pydantic import BaseModel, Field
 
+from api.tools.google_clients import SHEETS_SCOPES, google_clients, service_account_info, settings_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# A cached range is refetched after this many seconds even if the spreadsheet looks unchanged.
+SHEET_CACHE_TTL_SECONDS = float(os.getenv("SHEET_CACHE_TTL_SECONDS", "300"))
+# A spreadsheet's Drive revision is looked up again after this many seconds.
+SHEET_REVISION_CHECK_SECONDS = float(os.getenv("SHEET_REVISION_CHECK_SECONDS", "10"))
+SHEET_CACHE_MAX_ENTRIES = int(os.getenv("SHEET_CACHE_MAX_ENTRIES", "512"))
+
 class GoogleSheetInput(BaseModel):
     spreadsheet_id: str = Field(description="The unique ID of the Google Sheet to read from.")
     range_name: str = Field(description="The range of cells to read in A1 notation (e.g., 'Sheet1!A1:B10').")
 
-def get_google_sheet_tool(settings: Dict[str, Any], name: str):
+class SheetRangeCache:
+    """
+    Thread-safe LRU cache of Google Sheets range reads, shared by every agent and user of a
+    connector. An entry holds the values of one (connector, spreadsheet, range) at one
+    revision of the spreadsheet, which is read from Drive's file metadata (`version` and
+    `modifiedTime`) at most every `revision_check` seconds. An entry is served while the
+    revision is unchanged and it is younger than `ttl`.
+
+    The revision is only looked up when some requested range is cached: a read with nothing
+    to validate goes straight to the Sheets API and stores its ranges without a revision. Such
+    an entry is served on a later read if the spreadsheet was not modified after it was
+    fetched, and from then on carries the revision it was checked against. When the revision
+    cannot be read, entries rely on the TTL alone; a connector whose service account is denied
+    Drive access (for example because the Drive API is not enabled for its project) is not
+    asked again for `ttl` seconds. Ranges that are not cached are fetched with one batchGet call.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SHEET_CACHE_TTL_SECONDS,
+        revision_check: float = SHEET_REVISION_CHECK_SECONDS,
+        max_entries: int = SHEET_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.revision_check = revision_check
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._revisions: Dict[tuple, tuple] = {}
+        self._drive_denied: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revision_checks = 0
+        self.fetches = 0
+
+    def _revision(self, connector_key: str, connector_id, settings, spreadsheet_id: str):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._revisions.get((connector_key, spreadsheet_id))
+            denied_at = self._drive_denied.get(connector_key)
+        if cached is not None and now - cached[1] < self.revision_check:
+            return cached[0]
+        if denied_at is not None and now - denied_at < self.ttl:
+            return None
+        try:
+            with google_clients.service(connector_id, settings, "drive", "v3", SHEETS_SCOPES) as drive:
+                metadata = drive.files().get(
+                    fileId=spreadsheet_id, fields="version,modifiedTime", supportsAllDrives=True,
+                ).execute()
+            revision = (metadata.get("version"), metadata.get("modifiedTime"))
+        except HttpError as err:
+            logger.warning(f"Could not read the Drive revision of spreadsheet {spreadsheet_id}: {err}")
+            if err.resp.status == 403:
+                with self._lock:
+                    self._drive_denied[connector_key] = now
+            revision = None
+        with self._lock:
+            self.revision_checks += 1
+            self._revisions[(connector_key, spreadsheet_id)] = (revision, now)
+        return revision
+
+    @staticmethod
+    def _is_current(entry: tuple, revision) -> bool:
+        if entry[0] == revision:
+            return True
+        if entry[0] is None and revision is not None and revision[1]:
+            modified = datetime.fromisoformat(revision[1].replace("Z", "+00:00")).timestamp()
+            return modified < entry[3]
+        return False
+
+    def read(self, connector_id, settings, spreadsheet_id: str, ranges: List[str]) -> List[list]:
+        """The values of each of `ranges`, in order, from the cache or one Sheets API call."""
+        connector_key = str(connector_id or settings_fingerprint(service_account_info(settings)))
+        now = time.monotonic()
+        with self._lock:
+            cached = {}
+            for range_name in dict.fromkeys(ranges):
+                entry = self._entries.get((connector_key, spreadsheet_id, range_name))
+                if entry is not None and now - entry[1] < self.ttl:
+                    cached[range_name] = entry
+        revision = self._revision(connector_key, connector_id, settings, spreadsheet_id) if cached else None
+        values = {}
+        with self._lock:
+            for range_name in dict.fromkeys(ranges):
+                key = (connector_key, spreadsheet_id, range_name)
+                entry = cached.get(range_name)
+                if entry is not None and key in self._entries and self._is_current(entry, revision):
+                    self._entries[key] = (revision,) + entry[1:]
+                    self._entries.move_to_end(key)
+                    values[range_name] = entry[2]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        missing = [range_name for range_name in dict.fromkeys(ranges) if range_name not in values]
+        if missing:
+            fetched_at = time.time()
+            with google_clients.service(connector_id, settings, "sheets", "v4", SHEETS_SCOPES) as service:
+                if len(missing) == 1:
+                    value_ranges = [
+                        service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=missing[0]).execute()
+                    ]
+                else:
+                    value_ranges = service.spreadsheets().values().batchGet(
+                        spreadsheetId=spreadsheet_id, ranges=missing,
+                    ).execute().get("valueRanges", [])
+            with self._lock:
+                self.fetches += 1
+                for range_name, value_range in zip(missing, value_ranges):
+                    values[range_name] = value_range.get("values", [])
+                    self._entries[(connector_key, spreadsheet_id, range_name)] = (
+                        revision, now, values[range_name], fetched_at,
+                    )
+                    self._entries.move_to_end((connector_key, spreadsheet_id, range_name))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return [values.get(range_name, []) for range_name in ranges]
+
+    def invalidate(self, connector_id) -> int:
+        """Drops the cached ranges and revisions of a connector; returns how many ranges were removed."""
+        with self._lock:
+            self._drive_denied.pop(str(connector_id), None)
+            keys = [key for key in self._entries if key[0] == str(connector_id)]
+            for key in keys:
+                del self._entries[key]
+            for key in [key for key in self._revisions if key[0] == str(connector_id)]:
+                del self._revisions[key]
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revision_checks": self.revision_checks,
+                "fetches": self.fetches,
+            }
+
+sheet_range_cache = SheetRangeCache()
+
+def get_google_sheet_tool(settings: Dict[str, Any], name: str, llm_label: Optional[str] = None, connector_id: Optional[str] = None):
     @tool
     def google_sheet_tool(spreadsheet_id: str, range_name: str) -> str:
         """
         Reads data from a specified Google Sheet and range using the provided service account credentials.
-        
+
         Args:
             spreadsheet_id (str): The unique ID of the Google Sheet to read from.
             range_name (str): The range of cells to read in A1 notation (e.g., 'Sheet1!A1:B10').
+                Several ranges can be read at once by separating them with ';' (e.g., 'Sheet1!A1:B10;Sheet2!A:A').
 
         Returns:
             str: The data read from the Google Sheet as a comma-separated string, or an error message.
         """
         try:
-            creds_info = settings
-            if not creds_info:
+            if not service_account_info(settings):
                 return "Error: Service account information not found in connector settings."
-            if isinstance(creds_info, str):
-                creds_info = json.loads(creds_info)
-
-            scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly']
-            creds = service_account.Credentials.from_service_account_info(creds_info, scopes=scopes)
-            service = build('sheets', 'v4', credentials=creds)
-            result = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name).execute()
-            values = result.get('values', [])
 
-            if not values:
-                return f"No data found in range '{range_name}' of spreadsheet '{spreadsheet_id}'."
+            ranges = [part.strip() for part in range_name.split(";") if part.strip()] or [range_name]
+            results = sheet_range_cache.read(connector_id, settings, spreadsheet_id, ranges)
 
-            output_string = "\n".join([",".join(map(str, row)) for row in values])
-            return f"Successfully read data from spreadsheet '{spreadsheet_id}', range '{range_name}':\n{output_string}"
+            outputs = []
+            for range_part, values in zip(ranges, results):
+                if not values:
+                    outputs.append(f"No data found in range '{range_part}' of spreadsheet '{spreadsheet_id}'.")
+                    continue
+                output_string = "\n".join([",".join(map(str, row)) for row in values])
+                outputs.append(f"Successfully read data from spreadsheet '{spreadsheet_id}', range '{range_part}':\n{output_string}")
+            return "\n\n".join(outputs)
 
         except HttpError as err:
             if err.resp.status == 403:
@@ -53,4 +205,4 @@ def get_google_sheet_tool(settings: Dict[str, Any], name: str):
             return f"An unexpected error occurred: {e}"
 
     google_sheet_tool.name = name
-    return google_sheet_tool
\ No newline at end of file
+    return google_sheet_tool
@@ -2,12 +2,11 @@ import os
 from typing import Dict, Any, List
 import numpy as np
 from bson import ObjectId
-from langchain_community.embeddings import OpenAIEmbeddings
 from langchain.tools import tool
 from pydantic import BaseModel, Field
 from pymongo import MongoClient
 
-from api.embed import similarity
+from api.embed import decode_embedding, embed_question, embedding_matrix, top_k_similar, iter_chunk_batches
 
 try:
     knowledge_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.embeddings
@@ -15,8 +14,6 @@ except Exception as e:
     print(f"Error connecting to MongoDB: {e}")
     knowledge_db = None
 
-embedding_model = OpenAIEmbeddings()
-
 class PDFSourceInput(BaseModel):
     query: str = Field(description="The question or topic to search for within the PDF document.")
 
@@ -47,7 +44,7 @@ def get_pdf_source_tool(settings: Dict[str, Any], name: str):
             if the document is missing, misconfigured, or no relevant information is found.
         """
         
-        if not knowledge_db:
+        if knowledge_db is None:
             return "Error: Database connection for the knowledge base is not available."
 
         document_id = settings.get("document_id")
@@ -55,20 +52,29 @@ def get_pdf_source_tool(settings: Dict[str, Any], name: str):
             return "Error: Connector is misconfigured. 'document_id' is missing from its settings."
 
         try:
-            source_document = knowledge_db.find_one({"_id": ObjectId(document_id)})
+            source_document = knowledge_db.find_one({"_id": ObjectId(document_id)}, {"_id": 1})
         except Exception as e:
             return f"Error: The provided 'document_id' is invalid or a database error occurred: {e}"
 
-        if not source_document or "chunks" not in source_document:
+        if not source_document:
             return f"Error: No document or text chunks were found for the document ID: {document_id}."
 
-        query_embedding = embedding_model.embed_query(query)
+        query_embedding = embed_question(query)
 
         all_chunks = []
-        for chunk in source_document.get("chunks", []):
-            if "text" in chunk and "embedding" in chunk:
-                score = similarity(query_embedding, chunk["embedding"])
-                all_chunks.append({"text": chunk["text"], "score": score})
+        for batch in iter_chunk_batches(source_document["_id"], with_embeddings=True):
+            scored_chunks, embeddings = [], []
+            for chunk in batch:
+                embedding = decode_embedding(chunk.get("embedding"))
+                if chunk.get("text") and embedding.size:
+                    scored_chunks.append(chunk)
+                    embeddings.append(embedding)
+            matrix = embedding_matrix(embeddings)
+            for idx, score in top_k_similar(query_embedding, matrix, TOP_K):
+                all_chunks.append({"text": scored_chunks[idx]["text"], "score": score})
+
+        if not all_chunks:
+            return f"Error: No document or text chunks were found for the document ID: {document_id}."
 
         sorted_chunks = sorted(all_chunks, key=lambda x: x["score"], reverse=True)
         top_chunks = [chunk for chunk in sorted_chunks if chunk["score"] >= SIMILARITY_THRESHOLD][:TOP_K]
@@ -0,0 +1,180 @@
+from typing import Dict, Iterable, List, Optional
+
+import bisect
+import difflib
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import unidecode
+
+FUZZY_CUTOFF = 0.8
+# Fuzzy lookups compare the query with at most this many values, those sharing the most trigrams.
+FUZZY_CANDIDATES = 64
+
+
+def normalize_value(value) -> str:
+    """Normalization used to compare question values with cell values: NFKC, casefold, ASCII transliteration."""
+    if not isinstance(value, str):
+        value = str(value)
+    return unidecode.unidecode(unicodedata.normalize("NFKC", value).casefold())
+
+
+def normalize_series(series: pd.Series) -> pd.Series:
+    """
+    normalize_value of every cell of `series` as a categorical Series. Each distinct value is
+    normalized once, and `eq` / `str.contains` on the result only look at the categories.
+    Missing cells stay missing, so they never match a filter. Dates are compared in the form
+    pandas prints them, without a time when every value is at midnight.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.astype(str).where(series.notna())
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    norm_codes, categories = pd.factorize(np.array([normalize_value(value) for value in uniques], dtype=object))
+    codes = np.append(norm_codes, -1)[codes]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=series.index, name=series.name)
+
+
+def trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def _is_indexed(data_type: pa.DataType) -> bool:
+    if pa.types.is_dictionary(data_type):
+        return _is_indexed(data_type.value_type)
+    return pa.types.is_string(data_type) or pa.types.is_large_string(data_type) or pa.types.is_integer(data_type)
+
+
+class ColumnValueIndex:
+    """
+    Distinct values of one table column, keyed by their normalized form. `originals[i]` lists
+    the cell values (as strings) that normalize to `normalized[i]`. Trigram postings are kept
+    in CSR form like LexicalIndex: the value ids containing terms[j] are ids[offsets[j]:offsets[j + 1]].
+    """
+
+    def __init__(self, normalized: List[str], originals: List[List[str]], terms: List[str], offsets, ids):
+        self.normalized = normalized
+        self.originals = originals
+        self.terms = terms
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self._positions = {value: i for i, value in enumerate(normalized)}
+        self._series = None
+
+    @classmethod
+    def build(cls, values: Iterable[str]) -> "ColumnValueIndex":
+        groups: Dict[str, List[str]] = {}
+        for value in values:
+            groups.setdefault(normalize_value(value), []).append(value)
+        normalized = sorted(groups)
+        postings: Dict[str, List[int]] = {}
+        for value_id, value in enumerate(normalized):
+            for term in trigrams(value):
+                postings.setdefault(term, []).append(value_id)
+        terms = sorted(postings)
+        offsets, ids = [0], []
+        for term in terms:
+            ids.extend(postings[term])
+            offsets.append(len(ids))
+        return cls(normalized, [groups[value] for value in normalized], terms, offsets, ids)
+
+    @property
+    def nbytes(self) -> int:
+        strings = sum(len(value) for value in self.normalized) + sum(len(o) for group in self.originals for o in group)
+        return 2 * strings + 64 * len(self.normalized) + self.offsets.nbytes + self.ids.nbytes
+
+    def _closest(self, query: str, cutoff: float) -> Optional[int]:
+        counts = np.zeros(len(self.normalized), dtype=np.int32)
+        for term in trigrams(query):
+            j = bisect.bisect_left(self.terms, term)
+            if j < len(self.terms) and self.terms[j] == term:
+                counts[self.ids[self.offsets[j]:self.offsets[j + 1]]] += 1
+        candidates = np.flatnonzero(counts)
+        if len(candidates) > FUZZY_CANDIDATES:
+            candidates = candidates[np.argpartition(counts[candidates], -FUZZY_CANDIDATES)[-FUZZY_CANDIDATES:]]
+        best, best_ratio = None, cutoff
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(query)
+        for value_id in candidates:
+            matcher.set_seq1(self.normalized[value_id])
+            if matcher.real_quick_ratio() >= best_ratio and matcher.quick_ratio() >= best_ratio:
+                ratio = matcher.ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = int(value_id), ratio
+        return best
+
+    def matches(self, query, cutoff: float = FUZZY_CUTOFF) -> List[str]:
+        """Cell values equal to `query` after normalization, else those of the closest fuzzy match."""
+        query = normalize_value(query)
+        value_id = self._positions.get(query)
+        if value_id is None:
+            value_id = self._closest(query, cutoff)
+        return list(self.originals[value_id]) if value_id is not None else []
+
+    def containing(self, pattern) -> List[str]:
+        """Cell values whose normalized form contains the normalized `pattern`."""
+        if self._series is None:
+            self._series = pd.Series(self.normalized, dtype=object)
+        mask = self._series.str.contains(normalize_value(pattern), regex=False, na=False).to_numpy()
+        return [value for i in np.flatnonzero(mask) for value in self.originals[i]]
+
+    def best_match(self, query, cutoff: float = FUZZY_CUTOFF) -> Optional[str]:
+        matches = self.matches(query, cutoff)
+        return matches[0] if matches else None
+
+
+class TableValueIndex:
+    """ColumnValueIndex of every string and integer column of a table, built once at ingestion."""
+
+    def __init__(self, columns: Dict[str, ColumnValueIndex]):
+        self.columns = columns
+
+    def get(self, col) -> Optional[ColumnValueIndex]:
+        return self.columns.get(str(col))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(index.nbytes for index in self.columns.values())
+
+    def to_arrow(self) -> pa.Table:
+        indexes = list(self.columns.values())
+        return pa.table({
+            "column": pa.array(list(self.columns), pa.string()),
+            "normalized": pa.array([index.normalized for index in indexes], pa.list_(pa.string())),
+            "originals": pa.array([index.originals for index in indexes], pa.list_(pa.list_(pa.string()))),
+            "terms": pa.array([index.terms for index in indexes], pa.list_(pa.string())),
+            "offsets": pa.array([index.offsets for index in indexes], pa.list_(pa.int32())),
+            "ids": pa.array([index.ids for index in indexes], pa.list_(pa.int32())),
+        })
+
+    @classmethod
+    def from_arrow(cls, table: pa.Table) -> "TableValueIndex":
+        table = table.combine_chunks()
+        columns = {}
+        for i, name in enumerate(table.column("column").to_pylist()):
+            columns[name] = ColumnValueIndex(
+                table.column("normalized")[i].as_py(),
+                table.column("originals")[i].as_py(),
+                table.column("terms")[i].as_py(),
+                table.column("offsets")[i].values.to_numpy(zero_copy_only=False),
+                table.column("ids")[i].values.to_numpy(zero_copy_only=False),
+            )
+        return cls(columns)
+
+
+class ValueIndexBuilder:
+    """Collects the distinct values of the indexed columns over the chunks of a table."""
+
+    def __init__(self, schema: pa.Schema):
+        self._values = {field.name: {} for field in schema if _is_indexed(field.type)}
+
+    def update(self, table: pa.Table):
+        for name, values in self._values.items():
+            distinct = pc.unique(table.column(name).drop_null()).cast(pa.string())
+            values.update(dict.fromkeys(distinct.to_pylist()))
+
+    def build(self) -> TableValueIndex:
+        return TableValueIndex({name: ColumnValueIndex.build(values) for name, values in self._values.items()})
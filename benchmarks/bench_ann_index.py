@@ -0,0 +1,94 @@
+"""
+Measures recall@k and query latency of the per-org `ChunkIndex` against the exact
+`top_k_similar` scorer, with and without an agent's context-id filter.
+
+Embeddings are synthetic: points scattered around random topic centres, which is closer to
+real document embeddings than uniform noise. Each context document holds `--chunks-per-doc`
+chunks and is added to the index the way ingestion does it, one document at a time.
+
+Usage:
+    PYTHONPATH=. python benchmarks/bench_ann_index.py [--sizes 10000 100000] [--dim 1536] [--k 3 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from api.embed import embedding_matrix, top_k_similar
+from api.index import ChunkIndex
+
+
+def _synthetic_embeddings(rng, size, dim, topics):
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, size=size)
+    return centres[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32), centres
+
+
+def _percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def run(size, args, rng):
+    vectors, centres = _synthetic_embeddings(rng, size, args.dim, args.topics)
+    context_ids = [f"ctx{i}" for i in range(0, size // args.chunks_per_doc)]
+
+    index = ChunkIndex()
+    start = time.perf_counter()
+    for doc_no, context_id in enumerate(context_ids):
+        rows = vectors[doc_no * args.chunks_per_doc:(doc_no + 1) * args.chunks_per_doc]
+        index.add(context_id, rows, list(range(rows.shape[0])))
+    build_time = time.perf_counter() - start
+    matrix = embedding_matrix(vectors[:len(context_ids) * args.chunks_per_doc])
+    agent_contexts = context_ids[::2]
+    agent_rows = np.concatenate([
+        np.arange(i * args.chunks_per_doc, (i + 1) * args.chunks_per_doc)
+        for i in range(0, len(context_ids), 2)
+    ])
+    agent_matrix = matrix[agent_rows]
+
+    queries = centres[rng.integers(0, args.topics, size=args.queries)] + 0.8 * rng.standard_normal(
+        (args.queries, args.dim)
+    ).astype(np.float32)
+
+    print(f"\n{size} chunks, {len(context_ids)} documents, dim={args.dim}, build {build_time:.2f}s")
+    print(f"{'k':>4} {'filter':>8} {'recall':>8} {'exact p50 ms':>13} {'ann p50 ms':>11} {'ann p95 ms':>11}")
+    for k in args.k:
+        for label, contexts, exact_matrix, row_ids in (
+            ("none", None, matrix, np.arange(matrix.shape[0])),
+            ("agent", agent_contexts, agent_matrix, agent_rows),
+        ):
+            hits, exact_times, ann_times = 0, [], []
+            for query in queries:
+                start = time.perf_counter()
+                exact = top_k_similar(query, exact_matrix, k)
+                exact_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                approx = index.search(query, k, context_ids=contexts)
+                ann_times.append(time.perf_counter() - start)
+
+                expected = {(f"ctx{row_ids[i] // args.chunks_per_doc}", int(row_ids[i] % args.chunks_per_doc)) for i, _ in exact}
+                hits += len(expected & {(cid, ordinal) for cid, ordinal, _ in approx})
+            print(
+                f"{k:>4} {label:>8} {hits / (k * len(queries)):>8.3f} {_percentile_ms(exact_times, 50):>13.2f} "
+                f"{_percentile_ms(ann_times, 50):>11.2f} {_percentile_ms(ann_times, 95):>11.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--chunks-per-doc", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        run(size, args, rng)
+
+
+if __name__ == "__main__":
+    main()
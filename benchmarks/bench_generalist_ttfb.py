@@ -0,0 +1,111 @@
+"""
+Measures time to first byte and total time of a Generalist answer on the previous graph path
+(a new LoggingChatOpenAI and a tool-less `create_react_agent` graph per request, prompt
+formatted per request) and on the `GeneralistGraph` fast path of `get_agent_graph`.
+
+No OpenAI call is made: both paths stream from a simulated chat model that answers after
+`--first-token-ms` and then emits one token every `--token-ms`. The graph path still builds
+its per-request LoggingChatOpenAI, so that construction cost is included. Chunks are read the
+way the /ask route reads them.
+
+Usage:
+    PYTHONPATH=. python benchmarks/bench_generalist_ttfb.py [--requests 20] [--tokens 200] [--token-ms 5]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import numpy as np
+from bson import ObjectId
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.prebuilt import create_react_agent
+
+import api.agent
+from api.agent import GENERALIST_SYSTEM_PROMPT, LoggingChatOpenAI, get_agent_graph
+from api.routes.agents import _prepare_astream_input
+
+
+class SimulatedChatModel(BaseChatModel):
+    tokens: int
+    first_token: float
+    per_token: float
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError("the benchmark only calls the model asynchronously")
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.first_token)
+        for i in range(self.tokens):
+            if i:
+                await asyncio.sleep(self.per_token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"token{i} "))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join([chunk.message.content async for chunk in self._astream(messages)])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+async def graph_path(model, question, organization_id):
+    LoggingChatOpenAI(model="gpt-4o-mini", streaming=True, temperature=0.7, max_retries=3)
+    graph = create_react_agent(model, tools=[])
+    setattr(graph, "_is_react_agent", True)
+    graph.system_prompt = f"{GENERALIST_SYSTEM_PROMPT}\nAlso, User's Organization ID is {organization_id}."
+    return {"graph": graph, "system_prompt": graph.system_prompt}
+
+
+async def fast_path(model, question, organization_id):
+    return await get_agent_graph(question, organization_id)
+
+
+async def _timed(path, model, question, organization_id):
+    start = time.perf_counter()
+    agent_graph = await path(model, question, organization_id)
+    graph = agent_graph["graph"]
+    messages = _prepare_astream_input(graph, agent_graph["system_prompt"], [], question)
+    first_byte = None
+    async for chunk in graph.astream({"messages": messages}):
+        if isinstance(chunk, dict) and "agent" in chunk:
+            contents = [msg.content for msg in chunk["agent"]["messages"] if isinstance(msg, AIMessage)]
+        else:
+            contents = [chunk.content] if isinstance(chunk, BaseMessage) else [str(chunk)]
+        if first_byte is None and any(contents):
+            first_byte = time.perf_counter() - start
+    return first_byte, time.perf_counter() - start
+
+
+async def main(args):
+    model = SimulatedChatModel(tokens=args.tokens, first_token=args.first_token_ms / 1000, per_token=args.token_ms / 1000)
+    api.agent._generalist_llm = model
+    organization_id = ObjectId()
+    print(
+        f"{args.requests} requests, first token after {args.first_token_ms} ms, "
+        f"{args.tokens} tokens at {args.token_ms} ms each"
+    )
+    print(f"{'path':>8} {'ttfb p50 ms':>12} {'ttfb p95 ms':>12} {'total p50 ms':>13}")
+    for name, path in (("graph", graph_path), ("fast", fast_path)):
+        await _timed(path, model, "warm up", organization_id)
+        samples = [await _timed(path, model, f"question {i}", organization_id) for i in range(args.requests)]
+        ttfb = np.array([first for first, _ in samples]) * 1000
+        total = np.array([whole for _, whole in samples]) * 1000
+        print(
+            f"{name:>8} {np.percentile(ttfb, 50):>12.1f} {np.percentile(ttfb, 95):>12.1f} "
+            f"{np.percentile(total, 50):>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""
+Compares the per-chunk `similarity` loop that `retrieve_relevant_context` used to run with
+the batched `embedding_matrix` + `top_k_similar` scorer.
+
+Chunk embeddings are plain Python lists, as pymongo returns them. To keep memory bounded at
+100k chunks, the lists are drawn from a pool of distinct vectors and reused by reference;
+each scorer still converts every chunk it is given.
+
+Usage:
+    PYTHONPATH=. python benchmarks/bench_similarity.py [--sizes 1000 10000 100000] [--dim 1536]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from api.embed import similarity, embedding_matrix, top_k_similar
+
+
+def legacy_top_n(question_emb, embeddings, top_n):
+    scored = [(similarity(question_emb, emb), idx) for idx, emb in enumerate(embeddings)]
+    scored.sort(reverse=True, key=lambda x: x[0])
+    return [idx for _, idx in scored[:top_n]]
+
+
+def batched_top_n(question_emb, embeddings, top_n):
+    matrix = embedding_matrix(embeddings)
+    return [idx for idx, _ in top_k_similar(question_emb, matrix, top_n)]
+
+
+def _timed(func, *args, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--pool", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pool = [row.tolist() for row in rng.standard_normal((args.pool, args.dim))]
+    question_emb = rng.standard_normal(args.dim).tolist()
+
+    print(f"{'chunks':>8} {'legacy (s)':>12} {'batched (s)':>12} {'score only (s)':>15} {'speed-up':>9} {'same top-n':>11}")
+    for size in args.sizes:
+        embeddings = [pool[i % args.pool] for i in range(size)]
+        legacy_time, legacy_result = _timed(legacy_top_n, question_emb, embeddings, args.top_n, repeat=1)
+        batched_time, batched_result = _timed(batched_top_n, question_emb, embeddings, args.top_n)
+        matrix = embedding_matrix(embeddings)
+        score_time, _ = _timed(top_k_similar, question_emb, matrix, args.top_n)
+        print(
+            f"{size:>8} {legacy_time:>12.4f} {batched_time:>12.4f} {score_time:>15.5f} "
+            f"{legacy_time / batched_time:>8.1f}x {str(legacy_result == batched_result):>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
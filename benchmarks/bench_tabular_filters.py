@@ -0,0 +1,90 @@
+"""
+Compares the per-cell `apply` filters that `retrieve_relevant_context` used to build for
+`filter_exact` and `filter_pattern` questions with vectorized `eq` / `str.contains` on the
+normalized column kept in the table cache.
+
+The normalized column is built once per table version; its cost is reported separately
+("normalize once") and is not part of the per-question timings.
+
+Usage:
+    PYTHONPATH=. python benchmarks/bench_tabular_filters.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.tabular import DataFrameCache
+from api.value_index import normalize_value
+
+
+def legacy_exact(df, col, val):
+    return df[df[col].astype(str).apply(lambda x: normalize_value(x) == normalize_value(val))]
+
+
+def legacy_pattern(df, col, pattern):
+    norm_pattern = normalize_value(pattern)
+    return df[df[col].astype(str).apply(lambda x: norm_pattern in normalize_value(x))]
+
+
+def vectorized_exact(cache, df, col, val):
+    mask = cache.normalized_column(df, col).eq(normalize_value(val))
+    return df[mask.to_numpy(dtype=bool)]
+
+
+def vectorized_pattern(cache, df, col, pattern):
+    mask = cache.normalized_column(df, col).str.contains(normalize_value(pattern), regex=False, na=False)
+    return df[mask.to_numpy(dtype=bool)]
+
+
+def _timed(func, *args, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def make_table(rows: int, rng) -> pd.DataFrame:
+    cities = np.array(["Tehran", "Shiraz", "Isfahan", "Tabriz", "Mashhad", "Café Roma", "São Paulo"])
+    return pd.DataFrame({
+        "customer": [f"Customer {i:07d}" for i in range(rows)],
+        "city": cities[rng.integers(0, len(cities), rows)],
+        "amount": rng.random(rows) * 1000,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'rows':>8} {'filter':>8} {'legacy (s)':>11} {'vectorized (s)':>15} {'speed-up':>9} "
+        f"{'normalize once (s)':>19} {'same rows':>10}"
+    )
+    for rows in args.sizes:
+        df = make_table(rows, rng)
+        cache = DataFrameCache(max_bytes=1 << 34)
+        cache.set("bench", "v1", df)
+        cases = [
+            ("exact", "customer", f"customer {rows // 2:07d}", legacy_exact, vectorized_exact),
+            ("pattern", "city", "cafe", legacy_pattern, vectorized_pattern),
+        ]
+        for name, col, value, legacy, vectorized in cases:
+            normalize_time, _ = _timed(cache.normalized_column, df, col, repeat=1)
+            legacy_time, legacy_result = _timed(legacy, df, col, value, repeat=1)
+            vectorized_time, vectorized_result = _timed(vectorized, cache, df, col, value)
+            print(
+                f"{rows:>8} {name:>8} {legacy_time:>11.4f} {vectorized_time:>15.5f} "
+                f"{legacy_time / vectorized_time:>8.0f}x {normalize_time:>19.4f} "
+                f"{str(legacy_result.index.equals(vectorized_result.index)):>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
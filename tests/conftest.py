@@ -0,0 +1,65 @@
+import io
+
+import mongomock
+import pytest
+from minio.error import S3Error
+
+
+class FakeMinio:
+    """In-memory MinIO client holding objects by name; every write gets a new etag."""
+
+    def __init__(self):
+        self.objects = {}
+        self.etags = {}
+        self.writes = 0
+
+    def put_object(self, bucket_name, object_name, data, length, content_type=None):
+        self.writes += 1
+        self.objects[object_name] = data.read()
+        self.etags[object_name] = f"etag-{self.writes}"
+        return type("Result", (), {"etag": self.etags[object_name]})()
+
+    def fput_object(self, bucket_name, object_name, file_path, content_type=None):
+        with open(file_path, "rb") as f:
+            return self.put_object(bucket_name, object_name, f, 0)
+
+    def fget_object(self, bucket_name, object_name, file_path):
+        with open(file_path, "wb") as f:
+            f.write(self.objects[object_name])
+
+    def get_object(self, bucket_name, object_name):
+        response = io.BytesIO(self.objects[object_name])
+        response.release_conn = lambda: None
+        return response
+
+    def stat_object(self, bucket_name, object_name):
+        if object_name not in self.objects:
+            raise S3Error(None, "NoSuchKey", "Object does not exist", object_name, None, None, bucket_name, object_name)
+        return type("Stat", (), {"etag": self.etags[object_name], "size": len(self.objects[object_name])})()
+
+    def remove_object(self, bucket_name, object_name):
+        self.objects.pop(object_name, None)
+        self.etags.pop(object_name, None)
+
+
+@pytest.fixture
+def minio():
+    return FakeMinio()
+
+
+def _ignore_sort(add):
+    def wrapper(self, *args, sort=None, **kwargs):
+        return add(self, *args, **kwargs)
+    return wrapper
+
+
+# pymongo 4.11+ passes `sort` to bulk builders for UpdateOne/ReplaceOne; mongomock 4.3 does not
+# accept it. Updates by _id, the only kind the code under test sends, do not need it.
+for _name in ("add_update", "add_replace"):
+    setattr(mongomock.collection.BulkOperationBuilder, _name, _ignore_sort(getattr(mongomock.collection.BulkOperationBuilder, _name)))
+
+
+@pytest.fixture
+def mongo():
+    """A fresh in-memory `nexa` database with the same collection names as api.database."""
+    return mongomock.MongoClient().nexa
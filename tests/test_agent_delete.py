@@ -0,0 +1,45 @@
+import io
+
+import openpyxl
+from bson import ObjectId
+
+import api.embed
+import api.lexical
+import api.routes.agents
+import api.schemas.context
+import api.tabular
+from api.tabular import ingest_table
+
+
+def test_delete_agent_removes_the_tables_of_every_sheet(monkeypatch, tmp_path, minio, mongo):
+    monkeypatch.setattr(api.tabular, "minio_client", minio)
+    monkeypatch.setattr(api.tabular, "TABLE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api.schemas.context, "SPREADSHEET_CHUNK_ROWS", 3)
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["order", "amount"])
+    workbook.active.append(["O-1", 10])
+    staff = workbook.create_sheet("Staff")
+    staff.append(["employee", "team"])
+    staff.append(["Sara", "Sales"])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    org, context_id, agent_id = ObjectId(), ObjectId(), ObjectId()
+    table_data = ingest_table(context_id, buffer.getvalue(), "excel")
+    assert len(table_data["sheets"]) == 2 and minio.objects
+    mongo.embeddings.insert_one({
+        "_id": context_id, "org": org, "is_tabular": True,
+        "table": table_data["table"], "sheets": table_data["sheets"],
+    })
+    mongo.agents.insert_one({"_id": agent_id, "org": org, "context": [context_id]})
+    monkeypatch.setattr(api.routes.agents, "verify_token", lambda token: {"organization": str(org), "permission": "orgadmin"})
+    monkeypatch.setattr(api.routes.agents, "agents_db", mongo.agents)
+    monkeypatch.setattr(api.routes.agents, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.embed, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.embed, "knowledge_chunks_db", mongo.knowledge_chunks)
+    monkeypatch.setattr(api.lexical, "minio_client", minio)
+    monkeypatch.setattr(api.routes.agents, "remove_from_org_index", lambda org_id, context_ids: None)
+
+    api.routes.agents.delete_agent(str(agent_id), token="token")
+    assert not minio.objects
+    assert mongo.agents.count_documents({}) == 0 and mongo.embeddings.count_documents({}) == 0
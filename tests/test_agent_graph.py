@@ -0,0 +1,72 @@
+import pytest
+from bson import ObjectId
+from langchain_core.messages import AIMessageChunk
+
+import api.agent
+
+
+@pytest.mark.asyncio
+async def test_agent_graphs_are_cached_per_agent_version(monkeypatch, mongo):
+    builds = []
+
+    def fake_create_react_agent(llm, tools):
+        builds.append(tools)
+        return type("Graph", (), {})()
+
+    org = ObjectId()
+    connector_id = ObjectId()
+    agent = {"_id": ObjectId(), "org": org, "name": "Sales", "model": "gpt-4o-mini", "updated_at": "1", "connector_ids": [connector_id]}
+    mongo.agents.insert_one(agent)
+    mongo.connectors.insert_one({"_id": connector_id, "name": "Docs", "connector_type": "unknown", "settings": {}})
+    monkeypatch.setattr(api.agent, "create_react_agent", fake_create_react_agent)
+    monkeypatch.setattr(api.agent, "agents_db", mongo.agents)
+    monkeypatch.setattr(api.agent, "connectors_db", mongo.connectors)
+    monkeypatch.setattr(api.agent, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.agent, "agent_graph_cache", api.agent.AgentGraphCache(max_entries=4))
+    cache = api.agent.agent_graph_cache
+
+    first = await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    second = await api.agent.get_agent_graph("another question", org, agent_id=str(agent["_id"]))
+    assert len(builds) == 1 and second["graph"] is first["graph"]
+    assert "**Sales**" in second["system_prompt"] and not hasattr(second["graph"], "system_prompt")
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    mongo.connectors.update_one({"_id": connector_id}, {"$set": {"updated_at": "2"}})
+    await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    context_id = mongo.embeddings.insert_one({"is_tabular": True, "updated_at": "1"}).inserted_id
+    mongo.agents.update_one({"_id": agent["_id"]}, {"$set": {"context": [context_id]}})
+    monkeypatch.setattr(api.agent, "get_org_index", lambda org_id: None)
+    await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    assert len(builds) == 3
+    mongo.embeddings.update_one({"_id": context_id}, {"$set": {"updated_at": "2"}})
+    await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    assert len(builds) == 4
+
+    assert cache.invalidate(connector_id=ObjectId()) == 0
+    assert cache.invalidate(connector_id=connector_id) == 1
+    await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    assert cache.invalidate(agent["_id"]) == 1
+    await api.agent.get_agent_graph("hello", org, agent_id=str(agent["_id"]))
+    assert len(builds) == 6
+
+
+@pytest.mark.asyncio
+async def test_generalist_streams_from_the_shared_chat_model(monkeypatch):
+    class StreamingChat:
+        async def astream(self, messages):
+            for token in ["Hello", " there"]:
+                yield AIMessageChunk(content=token)
+
+    llm = StreamingChat()
+    monkeypatch.setattr(api.agent, "_generalist_llm", llm)
+    org = ObjectId()
+
+    first = await api.agent.get_agent_graph("hi", org)
+    second = await api.agent.get_agent_graph("hello", org, agent_id="generalist")
+    assert first["graph"].llm is llm and second["graph"].llm is llm
+    assert first["final_agent_name"] == "Generalist" and first["final_agent_id"] is None
+    assert first["system_prompt"].startswith(api.agent.GENERALIST_SYSTEM_PROMPT)
+    assert first["system_prompt"].endswith(f"Organization ID is {org}.")
+    chunks = [chunk.content async for chunk in first["graph"].astream({"messages": []})]
+    assert chunks == ["Hello", " there"]
@@ -0,0 +1,89 @@
+import logging
+
+import pytest
+from bson import Binary, ObjectId
+
+import api.agent
+import api.embed
+import api.jobs.backfill_embeddings
+from api.embed import decode_embedding, save_chunks
+from api.jobs.backfill_embeddings import backfill_embeddings, mark_missing_embeddings
+
+
+@pytest.fixture
+def chunks_db(monkeypatch, mongo):
+    monkeypatch.setattr(api.embed, "knowledge_chunks_db", mongo.knowledge_chunks)
+    monkeypatch.setattr(api.jobs.backfill_embeddings, "knowledge_chunks_db", mongo.knowledge_chunks)
+    return mongo.knowledge_chunks
+
+
+@pytest.fixture
+def embedded_texts(monkeypatch):
+    texts = []
+
+    def fake_embed_texts(batch, stats=None):
+        texts.extend(batch)
+        if stats is not None:
+            stats["embedded"] = stats.get("embedded", 0) + len(batch)
+        return [[float(len(text)), 1.0] for text in batch]
+
+    monkeypatch.setattr(api.jobs.backfill_embeddings, "embed_texts", fake_embed_texts)
+    return texts
+
+
+def _chunk(text, embedding=None):
+    return {"text": text, "token_count": len(text), "embedding": embedding}
+
+
+def test_backfill_embeds_only_flagged_chunks_and_clears_the_flag(chunks_db, embedded_texts, monkeypatch):
+    reindexed = []
+    monkeypatch.setattr(
+        api.jobs.backfill_embeddings, "add_to_org_index",
+        lambda org_id, context_id, chunks: reindexed.append((org_id, context_id, len(list(chunks)))),
+    )
+    org, first, second = ObjectId(), ObjectId(), ObjectId()
+    save_chunks(first, org, [_chunk("already embedded", [1.0, 0.0]), _chunk("needs one"), _chunk("  ")])
+    save_chunks(second, org, [_chunk("also needs one")])
+    legacy = chunks_db.insert_one({"context_id": second, "org": org, "ordinal": 1, "text": "legacy", "embedding": []}).inserted_id
+
+    stats = backfill_embeddings(batch_size=1)
+    assert embedded_texts == ["needs one", "also needs one"]
+    assert stats["chunks"] == 3 and stats["embedded"] == 2 and stats["contexts"] == 2
+    assert chunks_db.count_documents({"needs_embedding": {"$exists": True}}) == 0
+    stored = {chunk["text"]: chunk for chunk in chunks_db.find()}
+    assert isinstance(stored["needs one"]["embedding"], Binary)
+    assert decode_embedding(stored["also needs one"]["embedding"]).tolist() == [14.0, 1.0]
+    assert decode_embedding(stored["already embedded"]["embedding"]).tolist() == [1.0, 0.0]
+    assert "embedding" not in stored["  "]
+    assert sorted(reindexed) == sorted([(org, first, 3), (org, second, 2)])
+
+    # Chunks written before the flag existed are only picked up once marked. The blank chunk
+    # is marked again, but there is still nothing to embed in it.
+    assert mark_missing_embeddings() == 2
+    backfill_embeddings()
+    assert embedded_texts[2:] == ["legacy"]
+    assert decode_embedding(chunks_db.find_one({"_id": legacy})["embedding"]).size == 2
+
+
+def test_backfill_dry_run_writes_nothing(chunks_db, embedded_texts, monkeypatch):
+    monkeypatch.setattr(api.jobs.backfill_embeddings, "add_to_org_index", lambda *args: pytest.fail("re-indexed on a dry run"))
+    save_chunks(ObjectId(), ObjectId(), [_chunk("needs one"), _chunk("and another")])
+    before = list(chunks_db.find())
+
+    assert backfill_embeddings(batch_size=1, dry_run=True)["chunks"] == 2
+    assert embedded_texts == []
+    assert list(chunks_db.find()) == before
+
+
+@pytest.mark.asyncio
+async def test_retrieval_skips_unembedded_chunks_with_a_warning(chunks_db, monkeypatch, caplog):
+    monkeypatch.setattr(api.agent, "embed_question", lambda text: [1.0, 0.0])
+    context_id = ObjectId()
+    save_chunks(context_id, ObjectId(), [_chunk("not embedded yet"), _chunk("embedded refund policy", [1.0, 0.1])])
+
+    with caplog.at_level(logging.WARNING, logger="context_retriever"):
+        context = await api.agent.retrieve_relevant_context(
+            "refund policy", [{"context_id": str(context_id), "lexical_index": None}], top_n=3,
+        )
+    assert context == "embedded refund policy"
+    assert "Skipped 1 chunks without embeddings" in caplog.text
@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+from bson import Binary, ObjectId
+
+import api.embed
+import api.jobs.migrate_chunks
+import api.jobs.migrate_embeddings
+import api.lexical
+import api.routes.context
+from api.embed import decode_embedding, delete_chunks, encode_embedding, get_chunk_texts, get_chunks, iter_chunk_batches, save_chunks
+from api.jobs.migrate_chunks import migrate_chunks
+from api.jobs.migrate_embeddings import migrate_embeddings
+
+
+@pytest.fixture
+def chunk_store(monkeypatch, minio, mongo):
+    monkeypatch.setattr(api.embed, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.embed, "knowledge_chunks_db", mongo.knowledge_chunks)
+    monkeypatch.setattr(api.jobs.migrate_chunks, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.lexical, "minio_client", minio)
+    return mongo
+
+
+def _chunks(texts, embedded=True):
+    return [
+        {"text": text, "token_count": len(text.split()), "embedding": [float(i), 1.0] if embedded else None}
+        for i, text in enumerate(texts)
+    ]
+
+
+def test_save_chunks_writes_one_document_per_chunk_with_ordinal_and_org(chunk_store):
+    org, context_id = ObjectId(), ObjectId()
+    assert save_chunks(context_id, org, _chunks(["alpha", "beta"]), batch_size=1) == 2
+    assert save_chunks(context_id, org, _chunks(["gamma"], embedded=False), start_ordinal=2) == 1
+
+    stored = list(chunk_store.knowledge_chunks.find({}, {"_id": 0}).sort("ordinal", 1))
+    assert [(c["context_id"], c["org"], c["ordinal"], c["text"]) for c in stored] == [
+        (context_id, org, 0, "alpha"), (context_id, org, 1, "beta"), (context_id, org, 2, "gamma"),
+    ]
+    assert isinstance(stored[1]["embedding"], Binary)
+    assert decode_embedding(stored[1]["embedding"]).tolist() == [1.0, 1.0]
+    assert "embedding" not in stored[2] and stored[2]["needs_embedding"] is True
+
+
+def test_chunk_batches_come_back_in_ordinal_order(chunk_store):
+    org, first, second = ObjectId(), ObjectId(), ObjectId()
+    save_chunks(second, org, _chunks(["s0", "s1"]))
+    save_chunks(first, org, _chunks(["f2", "f3"]), start_ordinal=2)
+    save_chunks(first, org, _chunks(["f0", "f1"]))
+    save_chunks(ObjectId(), ObjectId(), _chunks(["other org"]))
+
+    batches = list(iter_chunk_batches([second, first], batch_size=3, org_id=org))
+    assert [len(batch) for batch in batches] == [3, 3]
+    texts = [chunk["text"] for batch in batches for chunk in batch]
+    expected = ["f0", "f1", "f2", "f3", "s0", "s1"] if first < second else ["s0", "s1", "f0", "f1", "f2", "f3"]
+    assert texts == expected
+    assert all("embedding" not in chunk for batch in batches for chunk in batch)
+
+    with_embeddings = next(iter_chunk_batches(first, with_embeddings=True))
+    assert np.allclose(decode_embedding(with_embeddings[3]["embedding"]), [1.0, 1.0])
+
+
+def test_get_chunks_returns_only_the_requested_ordinals(chunk_store):
+    org, first, second = ObjectId(), ObjectId(), ObjectId()
+    save_chunks(first, org, _chunks(["a0", "a1", "a2", "a3"]))
+    save_chunks(second, org, _chunks(["b0", "b1"]))
+
+    chunks = get_chunks([(first, 1), (str(first), 3), (second, 0)])
+    assert sorted((str(c["context_id"]), c["ordinal"]) for c in chunks) == sorted(
+        [(str(first), 1), (str(first), 3), (str(second), 0)]
+    )
+    assert all("embedding" not in chunk for chunk in chunks)
+    assert get_chunk_texts([(first, 2), (second, 1)]) == {(str(first), 2): "a2", (str(second), 1): "b1"}
+    assert get_chunks([]) == []
+
+    assert delete_chunks([first]) == 4
+    assert chunk_store.knowledge_chunks.count_documents({"context_id": second}) == 2
+
+
+def test_migrating_inline_chunks_is_idempotent(chunk_store, minio):
+    org = ObjectId()
+    text_id = chunk_store.embeddings.insert_one(
+        {"org": org, "is_tabular": False, "chunks": _chunks(["invoice INV-7", "shipping"])}
+    ).inserted_id
+    table_id = chunk_store.embeddings.insert_one(
+        {"org": org, "is_tabular": True, "chunks": _chunks(["row one"])}
+    ).inserted_id
+    # A previous run stopped after writing this chunk but before unsetting the array.
+    save_chunks(text_id, org, _chunks(["invoice INV-7"]))
+
+    assert migrate_chunks(dry_run=True) == {"documents": 2, "chunks": 3}
+    assert chunk_store.knowledge_chunks.count_documents({}) == 1
+
+    assert migrate_chunks() == {"documents": 2, "chunks": 3}
+    assert migrate_chunks() == {"documents": 0, "chunks": 0}
+    assert chunk_store.embeddings.count_documents({"chunks": {"$exists": True}}) == 0
+    assert [c["text"] for c in chunk_store.knowledge_chunks.find({"context_id": text_id}).sort("ordinal", 1)] == [
+        "invoice INV-7", "shipping",
+    ]
+    text_doc = chunk_store.embeddings.find_one({"_id": text_id})
+    assert text_doc["chunk_count"] == 2 and text_doc["lexical_index"]["object_name"] in minio.objects
+    assert "lexical_index" not in chunk_store.embeddings.find_one({"_id": table_id})
+
+
+def test_migrating_embeddings_repacks_lists_and_other_dtypes(chunk_store, monkeypatch):
+    monkeypatch.setattr(api.jobs.migrate_embeddings, "knowledge_chunks_db", chunk_store.knowledge_chunks)
+    half = encode_embedding([0.5, 0.25], "float16")
+    chunk_store.knowledge_chunks.insert_many([
+        {"text": "legacy", "embedding": [0.5, 0.25]},
+        {"text": "float32", "embedding": encode_embedding([0.5, 0.25], "float32")},
+        {"text": "float16", "embedding": half},
+        {"text": "unembedded", "needs_embedding": True},
+    ])
+    before = list(chunk_store.knowledge_chunks.find())
+
+    assert migrate_embeddings("float16", batch_size=1, dry_run=True) == {"chunks": 3, "migrated_chunks": 2}
+    assert list(chunk_store.knowledge_chunks.find()) == before
+
+    assert migrate_embeddings("float16", batch_size=1) == {"chunks": 3, "migrated_chunks": 2}
+    assert migrate_embeddings("float16") == {"chunks": 3, "migrated_chunks": 0}
+    stored = {chunk["text"]: chunk for chunk in chunk_store.knowledge_chunks.find()}
+    for text in ("legacy", "float32", "float16"):
+        assert stored[text]["embedding"] == half and stored[text]["embedding"].subtype == half.subtype
+        assert decode_embedding(stored[text]["embedding"]).tolist() == [0.5, 0.25]
+    assert "embedding" not in stored["unembedded"]
+
+
+class RecordingCollection:
+    """Wraps a collection and keeps every document find_one returned."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.returned = []
+
+    def find_one(self, query, projection=None):
+        document = self.collection.find_one(query, projection)
+        self.returned.append(document)
+        return document
+
+
+def test_context_metadata_endpoints_do_not_load_chunks(chunk_store, monkeypatch):
+    org, agent_id = ObjectId(), ObjectId()
+    context_id = chunk_store.embeddings.insert_one({
+        "org": org, "is_tabular": False, "file_key": "1_notes.pdf",
+        "chunks": _chunks(["legacy inline chunk"]), "lexical_index": {"terms": []},
+    }).inserted_id
+    save_chunks(context_id, org, _chunks(["stored chunk", "another"]))
+    chunk_store.agents.insert_one({"_id": agent_id, "org": org, "context": [context_id]})
+    knowledge = RecordingCollection(chunk_store.embeddings)
+    monkeypatch.setattr(api.routes.context, "verify_token", lambda token: {"organization": str(org)})
+    monkeypatch.setattr(api.routes.context, "agents_db", chunk_store.agents)
+    monkeypatch.setattr(api.routes.context, "knowledge_db", knowledge)
+
+    listed = api.routes.context.list_context_entries(str(agent_id), token="token")
+    entry = api.routes.context.get_context_entry(str(agent_id), str(context_id), token="token")
+    content = api.routes.context.get_ingested_content(str(agent_id), str(context_id), token="token")
+
+    assert listed[0]["filename"] == "notes.pdf" and entry["context_id"] == str(context_id)
+    assert "chunks" not in listed[0] and "chunks" not in entry
+    assert [chunk["text"] for chunk in content["ingested_content"]] == ["stored chunk", "another"]
+    assert len(knowledge.returned) == 3
+    assert all("chunks" not in doc and "lexical_index" not in doc for doc in knowledge.returned)
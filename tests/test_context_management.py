@@ -35,6 +35,8 @@ def mock_dependencies(mocker):
     # Mock embeddings
     mocker.patch("api.routes.context.embed", return_value=["chunk1", "chunk2"])
     mocker.patch("api.routes.context.save_embedding", return_value=ObjectId())
+    mocker.patch("api.routes.context.embed_stream", return_value=iter([[{"text": "chunk1"}]]))
+    mocker.patch("api.routes.context.save_embedding_stream", return_value=ObjectId())
     mocker.patch("api.routes.context.get_embeddings", return_value={"content": "mocked embedding"})
 
     # Mock minio_client.put_object to avoid real MinIO connection
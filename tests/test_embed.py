@@ -0,0 +1,198 @@
+import re
+
+import numpy as np
+from bson import ObjectId
+
+import api.embed
+import api.lexical
+from api.embed import similarity, embedding_matrix, top_k_similar, embed_question, EmbeddingCache
+
+
+def test_top_k_similar_matches_pairwise_similarity():
+    rng = np.random.default_rng(42)
+    embeddings = rng.standard_normal((200, 64)).tolist()
+    question = rng.standard_normal(64).tolist()
+
+    expected = sorted(
+        ((similarity(question, emb), idx) for idx, emb in enumerate(embeddings)),
+        key=lambda x: x[0],
+        reverse=True,
+    )[:5]
+    result = top_k_similar(question, embedding_matrix(embeddings), 5)
+
+    assert [idx for idx, _ in result] == [idx for _, idx in expected]
+    for (_, score), (sim, _) in zip(result, expected):
+        assert abs(score - sim) < 1e-5
+
+
+def test_top_k_similar_keeps_row_order_on_ties_and_zero_vectors():
+    embeddings = [[0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [0.0, 1.0]]
+    result = top_k_similar([1.0, 0.0], embedding_matrix(embeddings), 3)
+    assert [idx for idx, _ in result] == [1, 2, 0]
+    assert top_k_similar([0.0, 0.0], embedding_matrix(embeddings), 2)[0] == (0, 0.0)
+    assert top_k_similar([1.0, 0.0], embedding_matrix([]), 3) == []
+
+
+def test_embed_question_is_cached_on_normalized_text(monkeypatch):
+    calls = []
+
+    def fake_embed(text, chunk_tokens=400, overlap_tokens=40, stats=None, use_store=True):
+        calls.append(text)
+        return [{"text": text, "embedding": [float(len(text)), 1.0]}]
+
+    monkeypatch.setattr(api.embed, "embed", fake_embed)
+    monkeypatch.setattr(api.embed, "question_embedding_cache", EmbeddingCache(maxsize=8, ttl=60))
+
+    first = embed_question("What is  the refund policy? ")
+    second = embed_question("What is the refund policy?")
+    assert first == second
+    assert calls == ["What is the refund policy?"]
+    assert api.embed.question_embedding_cache.stats()["hits"] == 1
+    assert api.embed.question_embedding_cache.stats()["misses"] == 1
+
+
+class WordEncoding:
+    """Stand-in for tiktoken: one token per word or run of whitespace."""
+
+    def encode(self, text, disallowed_special=()):
+        return re.findall(r"\S+|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class FakeEmbeddingModel:
+    model = "fake"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def test_embed_chunks_on_token_budget_and_sentence_boundaries(monkeypatch):
+    monkeypatch.setattr(api.embed, "_token_encoding", lambda: WordEncoding())
+    monkeypatch.setattr(api.embed, "embedding_model", FakeEmbeddingModel())
+    sentences = [f"Sentence {i} has a few words in it." for i in range(30)]
+    text = " ".join(sentences[:12]) + "\n\n" + " ".join(sentences[12:])
+
+    chunks = api.embed.embed(text, chunk_tokens=60, overlap_tokens=20, use_store=False)
+    assert all(chunk["token_count"] <= 60 for chunk in chunks)
+    assert all(chunk["text"].endswith(".") for chunk in chunks)
+    assert all(chunk["token_count"] == api.embed.count_tokens(chunk["text"]) for chunk in chunks)
+    # The paragraph break ends a chunk without overlap; other chunks share a trailing sentence.
+    assert any(chunk["text"].endswith(sentences[11]) for chunk in chunks)
+    assert not any(sentences[11] in chunk["text"] and sentences[12] in chunk["text"] for chunk in chunks)
+    assert sum(chunk["text"].count("Sentence") for chunk in chunks) > len(sentences)
+
+    long_word = "x" * 10
+    chunks = api.embed.embed(" ".join([long_word] * 100), chunk_tokens=25, overlap_tokens=0, use_store=False)
+    assert all(chunk["token_count"] <= 25 for chunk in chunks)
+    assert sum(chunk["text"].count(long_word) for chunk in chunks) == 100
+
+
+def test_embed_texts_reuses_stored_embeddings(monkeypatch, mongo):
+    model = FakeEmbeddingModel()
+    monkeypatch.setattr(api.embed, "embedding_model", model)
+    monkeypatch.setattr(api.embed, "embedding_store_db", mongo.embedding_store)
+
+    stats = {}
+    first = api.embed.embed_texts(["alpha", "beta", "alpha"], stats)
+    assert model.embedded == ["alpha", "beta"]
+    assert stats == {"embedded": 2, "reused": 1}
+
+    stats = {}
+    second = api.embed.embed_texts(["beta", "gamma", "alpha"], stats)
+    assert model.embedded == ["alpha", "beta", "gamma"]
+    assert stats == {"embedded": 1, "reused": 2}
+    assert np.allclose(second[0], first[1]) and np.allclose(second[2], first[0])
+
+
+def test_embed_stream_chunks_pages_like_the_whole_text(monkeypatch):
+    monkeypatch.setattr(api.embed, "_token_encoding", lambda: WordEncoding())
+    monkeypatch.setattr(api.embed, "embedding_model", FakeEmbeddingModel())
+    pages = [
+        "\n\n".join(f"Page {p} paragraph {i}. " + "word " * (20 + i * 7 % 30) + "end." for i in range(12)) + "\n"
+        for p in range(40)
+    ]
+
+    batches = list(api.embed.embed_stream(pages, chunk_tokens=120, overlap_tokens=20, batch_size=16, use_store=False))
+    assert all(len(batch) <= 16 for batch in batches)
+    streamed = [chunk["text"] for batch in batches for chunk in batch]
+    whole = api.embed.embed("".join(pages), chunk_tokens=120, overlap_tokens=20, use_store=False)
+    assert streamed == [chunk["text"] for chunk in whole]
+
+
+def test_embedding_cache_evicts_least_recently_used_and_expired(monkeypatch):
+    cache = EmbeddingCache(maxsize=2, ttl=10)
+    now = [100.0]
+    monkeypatch.setattr(api.embed.time, "monotonic", lambda: now[0])
+
+    cache.set("a", (1.0,))
+    cache.set("b", (2.0,))
+    assert cache.get("a") == (1.0,)
+    cache.set("c", (3.0,))
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 1, "misses": 2, "evictions": 1}
+
+
+def test_embedding_encoding_round_trip_and_legacy_lists():
+    from bson import BSON
+    from api.embed import encode_embedding, decode_embedding
+
+    embedding = [0.25, -1.5, 3.0]
+    stored = BSON.decode(BSON.encode({"embedding": encode_embedding(embedding)}))["embedding"]
+    assert decode_embedding(stored).dtype == np.float32
+    assert decode_embedding(stored).tolist() == embedding
+
+    half = encode_embedding(embedding, "float16")
+    assert len(half) == 6
+    assert decode_embedding(half).tolist() == embedding
+
+    assert decode_embedding(embedding).tolist() == embedding
+    assert decode_embedding(None).size == 0
+
+
+def test_streamed_upload_stores_its_lexical_index_as_an_object(monkeypatch, minio, mongo):
+    monkeypatch.setattr(api.embed, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.embed, "knowledge_chunks_db", mongo.knowledge_chunks)
+    monkeypatch.setattr(api.embed, "_token_encoding", lambda: WordEncoding())
+    monkeypatch.setattr(api.lexical, "minio_client", minio)
+    org = ObjectId()
+    batches = [[{"text": "invoice INV-7 total", "embedding": [1.0, 0.0]}], [{"text": "shipping policy", "embedding": [0.0, 1.0]}]]
+
+    context_id = api.embed.save_embedding_stream(iter(batches), org_id=org)
+    meta = mongo.embeddings.find_one({"_id": context_id})["lexical_index"]
+    assert set(meta) == {"object_name", "etag", "size_bytes"} and meta["object_name"] in minio.objects
+    index = api.lexical.load_lexical_index(meta)
+    assert index.chunk_count == 2
+    assert api.lexical.bm25_search({"a": index}, "INV-7", 1)[0][:2] == ("a", 0)
+
+    api.embed.delete_embeddings(context_id, org)
+    assert not minio.objects
+    assert mongo.embeddings.count_documents({}) == 0 and mongo.knowledge_chunks.count_documents({}) == 0
+
+
+def test_failed_streamed_upload_leaves_no_document_or_chunks(monkeypatch, minio, mongo):
+    monkeypatch.setattr(api.lexical, "minio_client", minio)
+    monkeypatch.setattr(api.embed, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.embed, "knowledge_chunks_db", mongo.knowledge_chunks)
+    monkeypatch.setattr(api.embed, "_token_encoding", lambda: WordEncoding())
+
+    def batches():
+        yield [{"text": "first page", "embedding": [1.0, 0.0]}]
+        raise RuntimeError("embedding service unavailable")
+
+    try:
+        api.embed.save_embedding_stream(batches(), org_id=ObjectId())
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("the stream error should be re-raised")
+    assert mongo.embeddings.count_documents({}) == 0 and mongo.knowledge_chunks.count_documents({}) == 0
@@ -0,0 +1,52 @@
+import datetime
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.oauth2 import service_account
+
+from api.tools.google_clients import DRIVE_SCOPES, SHEETS_SCOPES, GoogleClientPool
+
+
+def _service_account_settings(email="reader@example.iam.gserviceaccount.com"):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return {
+        "type": "service_account",
+        "client_email": email,
+        "private_key": pem,
+        "private_key_id": "key-1",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+
+
+def test_pool_reuses_credentials_tokens_and_services(monkeypatch):
+    refreshes = []
+
+    def fake_refresh(self, request):
+        refreshes.append(self.service_account_email)
+        self.token = "token"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    monkeypatch.setattr(service_account.Credentials, "refresh", fake_refresh)
+    pool = GoogleClientPool(max_idle=2)
+    settings = _service_account_settings()
+
+    with pool.service("c1", settings, "sheets", "v4", SHEETS_SCOPES) as first:
+        with pool.service("c1", settings, "sheets", "v4", SHEETS_SCOPES) as concurrent:
+            assert concurrent is not first
+    with pool.service("c1", settings, "sheets", "v4", SHEETS_SCOPES) as again:
+        assert again in (first, concurrent)
+    assert refreshes == [settings["client_email"]]
+    assert pool.stats() == {"connectors": 1, "idle_services": 2, "credentials_built": 1, "services_built": 2}
+
+    with pool.service("c1", settings, "drive", "v3", DRIVE_SCOPES) as drive:
+        assert hasattr(drive, "files")
+    assert pool.stats()["credentials_built"] == 2
+
+    changed = _service_account_settings("other@example.iam.gserviceaccount.com")
+    with pool.service("c1", changed, "sheets", "v4", SHEETS_SCOPES) as service:
+        assert service not in (first, concurrent)
+    assert pool.invalidate("c1") == 2
+    assert pool.stats()["connectors"] == 0
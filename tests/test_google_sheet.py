@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import api.tools.google_sheet
+from api.tools.google_sheet import SheetRangeCache, get_google_sheet_tool
+
+
+class _Call:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class StubGoogleApis:
+    """Answers the Sheets values and Drive files calls the sheet tool makes from in-memory sheets."""
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.version = 1
+        self.modified_time = "2024-01-01T00:00:00.000Z"
+        self.drive_status = 200
+        self.calls = []
+
+    def files(self):
+        return self
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId=None, range=None, fileId=None, **kwargs):
+        if fileId is not None:
+            self.calls.append(("revision", fileId))
+            if self.drive_status != 200:
+                raise HttpError(httplib2.Response({"status": self.drive_status}), b"denied")
+            return _Call({"version": str(self.version), "modifiedTime": self.modified_time})
+        self.calls.append(("get", range))
+        return _Call({"range": range, "values": self.ranges[range]})
+
+    def batchGet(self, spreadsheetId, ranges):
+        self.calls.append(("batchGet", tuple(ranges)))
+        return _Call({"valueRanges": [{"range": r, "values": self.ranges[r]} for r in ranges]})
+
+    @contextmanager
+    def service(self, connector_id, settings, api, version, scopes):
+        yield self
+
+
+def test_sheet_reads_are_cached_per_revision_and_batched(monkeypatch):
+    stub = StubGoogleApis({"Sheet1!A1:B2": [["name", "qty"], ["Ali", "3"]], "Sheet2!A:A": [["x"]], "Empty!A1": []})
+    monkeypatch.setattr(api.tools.google_sheet, "google_clients", stub)
+    cache = SheetRangeCache(ttl=300, revision_check=0)
+    monkeypatch.setattr(api.tools.google_sheet, "sheet_range_cache", cache)
+    sheet_tool = get_google_sheet_tool({"client_email": "reader"}, name="google_sheet_sales", connector_id="c1")
+
+    first = sheet_tool.invoke({"spreadsheet_id": "s1", "range_name": "Sheet1!A1:B2"})
+    assert first == "Successfully read data from spreadsheet 's1', range 'Sheet1!A1:B2':\nname,qty\nAli,3"
+    assert sheet_tool.invoke({"spreadsheet_id": "s1", "range_name": "Sheet1!A1:B2"}) == first
+    assert [call[0] for call in stub.calls] == ["get", "revision"]
+
+    stub.calls.clear()
+    both = sheet_tool.invoke({"spreadsheet_id": "s1", "range_name": "Sheet1!A1:B2; Sheet2!A:A;Empty!A1"})
+    assert stub.calls == [("revision", "s1"), ("batchGet", ("Sheet2!A:A", "Empty!A1"))]
+    assert both.split("\n\n")[1:] == [
+        "Successfully read data from spreadsheet 's1', range 'Sheet2!A:A':\nx",
+        "No data found in range 'Empty!A1' of spreadsheet 's1'.",
+    ]
+
+    stub.calls.clear()
+    stub.version, stub.modified_time = 2, "2024-01-02T00:00:00.000Z"
+    stub.ranges["Sheet1!A1:B2"] = [["name", "qty"], ["Ali", "4"]]
+    assert sheet_tool.invoke({"spreadsheet_id": "s1", "range_name": "Sheet1!A1:B2"}).endswith("Ali,4")
+    assert stub.calls == [("revision", "s1"), ("get", "Sheet1!A1:B2")]
+
+    assert cache.invalidate("c1") == 3
+    assert cache.stats()["entries"] == 0
+
+
+def test_ranges_modified_after_an_unchecked_read_are_refetched(monkeypatch):
+    stub = StubGoogleApis({"Sheet1!A1": [["1"]]})
+    monkeypatch.setattr(api.tools.google_sheet, "google_clients", stub)
+    cache = SheetRangeCache(ttl=300, revision_check=0)
+
+    assert cache.read("c1", {}, "s1", ["Sheet1!A1"]) == [[["1"]]]
+    stub.ranges["Sheet1!A1"], stub.modified_time = [["2"]], "2999-01-01T00:00:00.000Z"
+    assert cache.read("c1", {}, "s1", ["Sheet1!A1"]) == [[["2"]]]
+    assert [call[0] for call in stub.calls] == ["get", "revision", "get"]
+
+
+def test_drive_denial_is_remembered_per_connector(monkeypatch):
+    stub = StubGoogleApis({"Sheet1!A1": [["1"]]})
+    stub.drive_status = 403
+    monkeypatch.setattr(api.tools.google_sheet, "google_clients", stub)
+    cache = SheetRangeCache(ttl=300, revision_check=0)
+
+    for spreadsheet_id in ["s1", "s1", "s2", "s2"]:
+        assert cache.read("c1", {}, spreadsheet_id, ["Sheet1!A1"]) == [[["1"]]]
+    assert stub.calls == [("get", "Sheet1!A1"), ("revision", "s1"), ("get", "Sheet1!A1")]
+    assert cache.stats()["hits"] == 2
+
+    cache.invalidate("c1")
+    stub.calls.clear()
+    cache.read("c1", {}, "s1", ["Sheet1!A1"])
+    cache.read("c1", {}, "s1", ["Sheet1!A1"])
+    assert [call[0] for call in stub.calls] == ["get", "revision"]
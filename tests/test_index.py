@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import api.index
+import api.database
+from api.embed import encode_embedding
+from api.index import ChunkIndex, add_to_org_index, get_org_index, rebuild_org_index, remove_from_org_index
+
+
+def _random_docs(rng, docs, chunks, dim):
+    return {f"ctx{i}": rng.standard_normal((chunks, dim)).astype(np.float32) for i in range(docs)}
+
+
+def test_index_search_filters_by_context_and_survives_round_trip():
+    rng = np.random.default_rng(7)
+    docs = _random_docs(rng, docs=6, chunks=500, dim=32)
+    index = ChunkIndex()
+    for context_id, vectors in docs.items():
+        index.add(context_id, vectors, list(range(len(vectors))))
+    assert index.centroids is not None
+
+    query = docs["ctx2"][17]
+    hits = index.search(query, 3, context_ids=["ctx2", "ctx4"])
+    assert hits[0][:2] == ("ctx2", 17)
+    assert all(cid in ("ctx2", "ctx4") for cid, _, _ in hits)
+
+    restored = ChunkIndex.from_bytes(index.to_bytes())
+    assert restored.search(query, 3, context_ids=["ctx2", "ctx4"]) == hits
+
+
+def test_index_remove_drops_context_rows():
+    rng = np.random.default_rng(3)
+    docs = _random_docs(rng, docs=2, chunks=10, dim=8)
+    index = ChunkIndex()
+    for context_id, vectors in docs.items():
+        index.add(context_id, vectors, list(range(len(vectors))))
+
+    assert index.remove(["ctx0", "missing"]) == 10
+    assert not index.has_context("ctx0")
+    assert len(index) == 10
+    assert all(cid == "ctx1" for cid, _, _ in index.search(docs["ctx0"][0], 5))
+    assert index.search(docs["ctx0"][0], 5, context_ids=["ctx0"]) == []
+
+
+def test_removed_contexts_leave_no_slots_behind():
+    rng = np.random.default_rng(5)
+    docs = _random_docs(rng, docs=3, chunks=4, dim=8)
+    index = ChunkIndex()
+    for context_id, vectors in docs.items():
+        index.add(context_id, vectors, list(range(len(vectors))))
+    index.add("ctx0", docs["ctx0"], list(range(4)))
+    index.remove(["ctx1"])
+    assert index.contexts == ["ctx2", "ctx0"]
+
+    restored = ChunkIndex.from_bytes(index.to_bytes())
+    assert restored.contexts == ["ctx2", "ctx0"]
+    assert restored.search(docs["ctx0"][1], 1)[0][:2] == ("ctx0", 1)
+
+
+def _chunks(rng, count=3, dim=8):
+    return [{"text": f"chunk {i}", "embedding": rng.standard_normal(dim).tolist()} for i in range(count)]
+
+
+@pytest.fixture
+def org_index_store(monkeypatch, minio, mongo):
+    monkeypatch.setattr(api.index, "minio_client", minio)
+    monkeypatch.setattr(api.index, "index_locks_db", mongo.index_locks)
+    monkeypatch.setattr(api.index, "_org_indexes", {})
+    return mongo.index_locks
+
+
+def test_org_index_writes_keep_changes_made_by_other_workers(org_index_store):
+    rng = np.random.default_rng(11)
+    add_to_org_index("org", "ctxA", _chunks(rng))
+    this_worker = dict(api.index._org_indexes)
+
+    # Another worker, with its own registry, adds a context and removes ctxA.
+    api.index._org_indexes.clear()
+    add_to_org_index("org", "ctxB", _chunks(rng))
+    remove_from_org_index("org", ["ctxA"])
+
+    # This worker's copy is still fresh for readers, but writers reload the stored index.
+    api.index._org_indexes.clear()
+    api.index._org_indexes.update(this_worker)
+    assert get_org_index("org").has_context("ctxA")
+    add_to_org_index("org", "ctxC", _chunks(rng))
+    index = get_org_index("org")
+    assert index.contexts == ["ctxB", "ctxC"]
+    assert org_index_store.count_documents({}) == 0
+
+
+def test_org_index_writers_wait_for_the_lock_until_it_expires(org_index_store, monkeypatch):
+    monkeypatch.setattr(api.index, "INDEX_LOCK_WAIT_SECONDS", 0.2)
+    rng = np.random.default_rng(13)
+    org_index_store.insert_one({"_id": "org", "owner": "other", "expires_at": datetime.utcnow() + timedelta(minutes=5)})
+    with pytest.raises(TimeoutError):
+        add_to_org_index("org", "ctxA", _chunks(rng))
+    assert get_org_index("org") is None
+
+    org_index_store.update_one({"_id": "org"}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    add_to_org_index("org", "ctxA", _chunks(rng))
+    assert get_org_index("org").has_context("ctxA")
+    assert org_index_store.count_documents({}) == 0
+
+
+def test_rebuild_indexes_only_text_documents_like_uploads_do(org_index_store, monkeypatch, mongo):
+    monkeypatch.setattr(api.database, "knowledge_db", mongo.embeddings)
+    monkeypatch.setattr(api.database, "knowledge_chunks_db", mongo.knowledge_chunks)
+    rng = np.random.default_rng(17)
+    text_id = mongo.embeddings.insert_one({"org": "org", "is_tabular": False}).inserted_id
+    table_id = mongo.embeddings.insert_one({"org": "org", "is_tabular": True}).inserted_id
+    for context_id in (text_id, table_id):
+        mongo.knowledge_chunks.insert_many([
+            {"context_id": context_id, "org": "org", "ordinal": i, "text": chunk["text"], "embedding": encode_embedding(chunk["embedding"])}
+            for i, chunk in enumerate(_chunks(rng))
+        ])
+
+    index = rebuild_org_index("org")
+    assert index.contexts == [str(text_id)] and len(index) == 3
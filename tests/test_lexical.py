@@ -0,0 +1,29 @@
+from api.lexical import LexicalIndex, bm25_search, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_folds_arabic_letters_and_persian_digits():
+    assert tokenize("كتاب‌هاي ۱۲۳") == tokenize("کتابهای 123")
+    assert "123" in tokenize("شماره ۱۲۳")
+
+
+def test_tokenize_keeps_identifiers_whole_and_split():
+    tokens = tokenize("Invoice INV-2023/0042 is due")
+    assert "inv-2023/0042" in tokens
+    assert {"inv", "2023", "0042"} <= set(tokens)
+    assert "is" not in tokens
+
+
+def test_bm25_finds_exact_identifier_across_documents():
+    first = LexicalIndex.build(["general terms of payment", "invoice INV-2023/0042 total 1200"])
+    second = LexicalIndex.build(["invoice INV-2023/0043 total 900", "shipping policy"])
+    indexes = {"a": first, "b": LexicalIndex.from_document(second.to_document())}
+
+    hits = bm25_search(indexes, "what is the total of INV-2023/0042?", 3)
+    assert hits[0][:2] == ("a", 1)
+    assert all(score > 0 for _, _, score in hits)
+    assert bm25_search(indexes, "unrelated words", 3) == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "w"]])
+    assert [key for key, _ in fused] == ["y", "x", "w", "z"]
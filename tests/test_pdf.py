@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import api.schemas.context
+from api.schemas.context import iter_pdf_pages
+
+
+def _pdf_with_pages(texts):
+    """A minimal PDF whose page i shows texts[i] in Helvetica."""
+    count = len(texts)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(count)) + b"] /Count %d >>" % count,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(texts):
+        stream = b"BT /F1 12 Tf 72 720 Td (" + text.encode() + b") Tj ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+@pytest.fixture
+def pdf_pool(monkeypatch):
+    monkeypatch.setattr(api.schemas.context, "_pdf_pool", None)
+    monkeypatch.setattr(api.schemas.context, "PDF_EXTRACT_WORKERS", 2)
+    yield
+    if api.schemas.context._pdf_pool is not None:
+        api.schemas.context._pdf_pool.shutdown()
+
+
+def test_pdf_pages_parsed_by_worker_processes_come_back_in_order(pdf_pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(api.schemas.context.tempfile, "tempdir", str(tmp_path))
+    texts = [f"Page {i}" for i in range(23)]
+    content = _pdf_with_pages(texts)
+
+    pages = list(iter_pdf_pages(content, workers=2, pages_per_task=3))
+    assert [page.strip() for page in pages] == texts
+    pool = api.schemas.context._pdf_pool
+    assert pool is not None and pool._mp_context.get_start_method() == "spawn"
+
+    # The pool is kept for the next upload, and each upload's temporary copy is removed.
+    assert [page.strip() for page in iter_pdf_pages(content, workers=2, pages_per_task=5)] == texts
+    assert api.schemas.context._pdf_pool is pool
+    assert os.listdir(tmp_path) == []
+
+
+def test_short_pdfs_are_parsed_inline(pdf_pool):
+    pages = list(iter_pdf_pages(_pdf_with_pages(["only page"]), workers=2, pages_per_task=3))
+    assert [page.strip() for page in pages] == ["only page"]
+    assert api.schemas.context._pdf_pool is None
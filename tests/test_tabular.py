@@ -0,0 +1,217 @@
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import api.tabular
+import api.schemas.context
+from api.tabular import save_table, load_table, delete_table, column_stats, ingest_table, open_table, StoredTable
+
+
+def test_table_round_trip_through_parquet(monkeypatch, tmp_path, minio):
+    monkeypatch.setattr(api.tabular, "minio_client", minio)
+    monkeypatch.setattr(api.tabular, "TABLE_CACHE_DIR", str(tmp_path))
+    df = pd.DataFrame({
+        "name": ["Ali", "Sara", None],
+        "amount": [10.5, 20.0, np.nan],
+        "code": [1, "A-2", 3],
+        2024: [1, 2, 3],
+    })
+
+    table = save_table("ctx1", df)
+    assert table["num_rows"] == 3 and table["object_name"] == "tables/ctx1.parquet"
+
+    loaded = load_table(table)
+    assert list(loaded.columns) == ["name", "amount", "code", "2024"]
+    assert loaded["code"].tolist() == ["1", "A-2", "3"]
+    assert loaded["amount"].iloc[1] == 20.0
+    assert load_table(table, columns=["name"]).shape == (3, 1)
+
+    delete_table("ctx1", table)
+    assert not minio.objects
+    assert not list(tmp_path.iterdir())
+
+
+def test_column_stats_summarizes_numeric_and_text_columns():
+    stats = column_stats(pd.DataFrame({"amount": [1, 2, None], "city": ["a", "b", "a"]}))
+    assert stats["amount"]["min"] == 1.0 and stats["amount"]["max"] == 2.0 and stats["amount"]["null_count"] == 1
+    assert stats["city"]["distinct_count"] == 2
+
+
+def test_dataframe_cache_evicts_by_memory_budget_and_invalidates():
+    small = pd.DataFrame({"a": np.arange(100)})
+    size = int(small.memory_usage(deep=True).sum())
+    cache = api.tabular.DataFrameCache(max_bytes=2 * size)
+
+    cache.set("ctx1", "v1", small)
+    cache.set("ctx2", "v1", small.copy())
+    assert cache.get("ctx1", "v1") is small
+    cache.set("ctx3", "v1", small.copy())
+    assert cache.get("ctx2", "v1") is None
+    assert cache.get("ctx1", "v2") is None
+
+    cache.set("ctx4", "v1", pd.DataFrame({"a": np.arange(1000)}))
+    assert cache.get("ctx4", "v1") is None
+
+    assert cache.invalidate("ctx1") == 1
+    assert cache.get("ctx1", "v1") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["evictions"], stats["entries"]) == (1, 1, 1)
+    assert stats["size_bytes"] == size
+
+
+def test_ingest_table_reads_csv_in_chunks_and_scans_by_column(monkeypatch, tmp_path, minio):
+    monkeypatch.setattr(api.tabular, "minio_client", minio)
+    monkeypatch.setattr(api.tabular, "TABLE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api.tabular, "TABLE_IN_MEMORY_ROWS", 10)
+    monkeypatch.setattr(api.schemas.context, "SPREADSHEET_CHUNK_ROWS", 4)
+    lines = ["invoice,amount,city"]
+    lines += [f"INV-{i},{i},{'Tehran' if i % 3 else 'Shiraz'}" for i in range(10)]
+    # Later chunks switch the invoice column to numbers and the amount column to floats.
+    lines += [f"{i},{i}.5," for i in range(10, 12)]
+    data = ("\n".join(lines) + "\n").encode()
+
+    result = ingest_table("ctx2", data, "csv")
+    assert result["shape"] == (12, 3)
+    assert result["schema"] == {"invoice": "object", "amount": "float64", "city": "category"}
+    assert result["column_stats"]["amount"]["max"] == 11.5
+    city = result["column_stats"]["city"]
+    assert (city["dtype"], city["null_count"], city["distinct_count"]) == ("category", 2, 2)
+    assert city["top_values"] == [{"value": "Tehran", "count": 6}, {"value": "Shiraz", "count": 4}]
+    amount = result["column_stats"]["amount"]
+    assert amount["histogram"]["edges"][0] == 0.0 and amount["histogram"]["edges"][-1] == 11.5
+    assert sum(amount["histogram"]["counts"]) == 12
+    assert api.tabular.stored_column_stats(result["table"]) == result["column_stats"]
+    assert result["sample"][0]["invoice"] == "INV-0"
+    assert len(list(tmp_path.iterdir())) == 1
+
+    table = open_table("ctx2", result["table"], result["column_stats"])
+    assert isinstance(table, StoredTable) and len(table) == 12
+    assert sorted(table["city"]) == ["Shiraz", "Tehran"]
+    rows = table.filter_normalized("invoice", "inv-7")
+    assert rows.to_dict(orient="records") == [{"invoice": "INV-7", "amount": 7.0, "city": "Tehran"}]
+    assert len(table.filter_normalized("city", "SHIRAZ")) == 4
+    assert len(table.filter_normalized("city", "hra", contains=True)) == 6
+    assert table.filter_normalized("city", "Isfahan").empty
+    assert table.aggregate("amount", "sum") == sum(range(10)) + 10.5 + 11.5
+    assert table.aggregate("city", "count") == 10
+    assert table.aggregate("amount", "max") == 11.5
+    assert table.head(3)["invoice"].tolist() == ["INV-0", "INV-1", "INV-2"]
+    assert table.describe().T.loc["amount", "max"] == 11.5
+
+    value_index = api.tabular.get_value_index("ctx2", result["table"])
+    assert value_index.get("amount") is None
+    assert value_index.get("invoice").best_match("zzz") is None
+    matches = value_index.get("invoice").matches("inv-7")
+    assert matches == ["INV-7"]
+    assert table.filter_values("invoice", matches)["amount"].tolist() == [7.0]
+    assert api.tabular.get_value_index("ctx2", result["table"]) is value_index
+
+    delete_table("ctx2", result["table"])
+    assert not minio.objects
+
+
+def test_ingested_tables_get_compact_dtypes(monkeypatch, tmp_path, minio):
+    monkeypatch.setattr(api.tabular, "minio_client", minio)
+    monkeypatch.setattr(api.tabular, "TABLE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api.tabular, "TABLE_IN_MEMORY_ROWS", 10)
+    monkeypatch.setattr(api.schemas.context, "SPREADSHEET_CHUNK_ROWS", 8)
+    lines = ["id,qty,big,city,day,mixed_day,note"]
+    lines += [
+        f"{i},{i % 7},{i * 100000},{['Tehran', 'Shiraz'][i % 2]},2024-01-{i % 28 + 1:02d},"
+        f"{'2024-01-05' if i < 15 else 'soon'},note {i}"
+        for i in range(20)
+    ]
+    data = ("\n".join(lines) + "\n").encode()
+
+    result = ingest_table("ctx5", data, "csv")
+    assert result["schema"] == {
+        "id": "int8", "qty": "int8", "big": "int32", "city": "category",
+        "day": "datetime64[ns]", "mixed_day": "category", "note": "object",
+    }
+    memory = result["table"]["memory_bytes"]
+    assert 0 < memory["compact"] < memory["default"]
+
+    df = load_table(result["table"])
+    assert df["day"].iloc[3] == pd.Timestamp("2024-01-04")
+    assert df["city"].cat.categories.tolist() == ["Tehran", "Shiraz"]
+
+    table = open_table("ctx5", result["table"], result["column_stats"])
+    assert table.filter_normalized("day", "2024-01-04")["id"].tolist() == [3]
+    assert len(table.filter_normalized("city", "shiraz")) == 10
+    assert table.aggregate("city", "min") == "Shiraz"
+    assert table.group_aggregate("city", "qty", "sum").to_dict() == {"Shiraz": 30, "Tehran": 27}
+    value_index = api.tabular.get_value_index("ctx5", result["table"])
+    assert value_index.get("city").matches("TEHRAN") == ["Tehran"]
+    delete_table("ctx5", result["table"])
+
+
+def test_only_dates_with_a_known_day_month_order_are_converted(monkeypatch, tmp_path, minio):
+    monkeypatch.setattr(api.tabular, "minio_client", minio)
+    monkeypatch.setattr(api.tabular, "TABLE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api.schemas.context, "SPREADSHEET_CHUNK_ROWS", 2)
+    data = (
+        "ambiguous,day_first,month_first\n"
+        "05/03/2024,05/03/2024,05/03/2024\n"
+        "07/04/2024,07/04/2024,07/04/2024\n"
+        "01/02/2024,25/12/2024,12/25/2024\n"
+    ).encode()
+
+    result = ingest_table("ctx7", data, "csv")
+    assert result["schema"] == {"ambiguous": "object", "day_first": "datetime64[ns]", "month_first": "datetime64[ns]"}
+    df = load_table(result["table"])
+    assert df["ambiguous"].tolist() == ["05/03/2024", "07/04/2024", "01/02/2024"]
+    assert df["day_first"].iloc[0] == pd.Timestamp("2024-03-05")
+    assert df["month_first"].iloc[0] == pd.Timestamp("2024-05-03")
+    assert result["sample"][0] == {"ambiguous": "05/03/2024", "day_first": "2024-03-05 00:00:00", "month_first": "2024-05-03 00:00:00"}
+    delete_table("ctx7", result["table"])
+
+
+def test_ingest_table_stores_each_excel_sheet_as_its_own_table(monkeypatch, tmp_path, minio):
+    monkeypatch.setattr(api.tabular, "minio_client", minio)
+    monkeypatch.setattr(api.tabular, "TABLE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api.schemas.context, "SPREADSHEET_CHUNK_ROWS", 3)
+    workbook = openpyxl.Workbook()
+    orders = workbook.active
+    orders.title = "Orders"
+    orders.append(["order", "amount", None])
+    for i in range(7):
+        orders.append([f"O-{i}", i * 10])
+    orders.append([None, None])
+    orders.append(["O-7", 70])
+    workbook.create_sheet("Empty")
+    staff = workbook.create_sheet("Staff")
+    staff.append(["employee", "team", "team"])
+    staff.append(["Sara", "Sales", "North"])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    result = ingest_table("ctx6", buffer.getvalue(), "excel")
+    assert [sheet["name"] for sheet in result["sheets"]] == ["Orders", "Staff"]
+    assert result["table"] == result["sheets"][0]["table"]
+    assert result["shape"] == (8, 2)
+    assert result["sheets"][1]["schema"] == {"employee": "object", "team": "object", "team.1": "object"}
+    assert load_table(result["sheets"][1]["table"])["team.1"].tolist() == ["North"]
+
+    sheets = result["sheets"]
+    assert [s["name"] for s in api.tabular.select_sheets("Which team is Sara in?", sheets)] == ["Staff"]
+    assert [s["name"] for s in api.tabular.select_sheets("total amount of orders", sheets)] == ["Orders"]
+    assert len(api.tabular.select_sheets("anything about O-3?", sheets)) == 2
+
+    delete_table("ctx6", result["table"], sheets)
+    assert not minio.objects
+
+
+def test_normalized_columns_are_cached_with_their_table():
+    df = pd.DataFrame({"city": ["Café Roma", "Tehran", None, "CAFE ROMA"]})
+    size = int(df.memory_usage(deep=True).sum())
+    cache = api.tabular.DataFrameCache(max_bytes=100 * size)
+    cache.set("ctx1", "v1", df)
+
+    normalized = cache.normalized_column(df, "city")
+    assert normalized.eq("cafe roma").tolist() == [True, False, False, True]
+    assert normalized.str.contains("ehr", regex=False, na=False).tolist() == [False, True, False, False]
+    assert cache.normalized_column(df, "city") is normalized
+    assert cache.stats()["size_bytes"] > size
+    assert cache.normalized_column(df.copy(), "city") is not normalized
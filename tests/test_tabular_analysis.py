@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+import api.agent
+from api.tabular import query_classifier
+from api.tabular_aggregates import answer_directly, parse_aggregate
+
+
+class SlowChatOpenAI:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def ainvoke(self, messages):
+        if "slow" in messages[0].content:
+            await asyncio.sleep(5)
+        await asyncio.sleep(0.2)
+        return type("Response", (), {"content": "table answer"})()
+
+
+@pytest.mark.asyncio
+async def test_tables_are_analyzed_concurrently_and_slow_ones_degrade(monkeypatch):
+    def fake_embed_question(question):
+        return [0.0, 0.0]
+
+    monkeypatch.setattr(api.agent, "ChatOpenAI", SlowChatOpenAI)
+    monkeypatch.setattr(api.agent, "embed_question", fake_embed_question)
+    monkeypatch.setattr(api.agent, "TABULAR_ANALYSIS_TIMEOUT", 0.5)
+    docs = [
+        {
+            "data_json": pd.DataFrame({"name": [name], "amount": [1]}).to_json(orient="split"),
+            "context_id": f"analysis-{name}",
+            "file_key": f"user_{name}.csv",
+            "is_tabular": True,
+        }
+        for name in ["a", "b", "c", "slow"]
+    ]
+
+    start = time.perf_counter()
+    context = await api.agent.retrieve_relevant_context("tell me about these customers", docs)
+    assert time.perf_counter() - start < 1.5
+    assert context.count("table answer") == 3
+    assert "'slow.csv' (not analyzed; schema summary only)" in context
+    assert "Columns: name, amount" in context
+
+
+@pytest.mark.asyncio
+async def test_confident_aggregates_are_answered_without_an_llm_call(monkeypatch):
+    class FailingChatOpenAI:
+        def __init__(self, *args, **kwargs):
+            raise AssertionError("LLM should not be called")
+
+    monkeypatch.setattr(api.agent, "ChatOpenAI", FailingChatOpenAI)
+    monkeypatch.setattr(api.agent, "embed_question", lambda question: [0.0, 0.0])
+    df = pd.DataFrame({"city": ["Tehran", "Shiraz", "Tehran"], "amount": [10.0, 5.0, 2.5]})
+    docs = [{"data_json": df.to_json(orient="split"), "context_id": "aggregate-1", "file_key": "user_sales.csv", "is_tabular": True}]
+
+    context = await api.agent.retrieve_relevant_context("What is the total amount by city?", docs)
+    assert "Sum of amount by city, computed over all 3 rows of 'sales.csv' (parse confidence 1.00)" in context
+    assert context.index("Tehran") < context.index("Shiraz")
+    assert "12.5" in context
+
+
+def test_aggregate_parse_confidence_drops_for_ambiguous_questions():
+    columns = pd.Index(["city", "amount", "customer name"])
+    dtypes = pd.Series({"city": "object", "amount": "float64", "customer name": "object"})
+
+    plan = parse_aggregate("average amount per city", columns, dtypes)
+    assert (plan.func, plan.column, plan.group_by, plan.confidence) == ("mean", "amount", "city", 1.0)
+    assert parse_aggregate("how many records", columns, dtypes).column is None
+    assert parse_aggregate("total amount where city is Tehran", columns, dtypes).confidence < 0.8
+    assert parse_aggregate("min amount and max amount", columns, dtypes).confidence < 0.8
+    assert parse_aggregate("sum of customer name", columns, dtypes).confidence == 0.0
+    assert parse_aggregate("average amounts by town", columns, dtypes).confidence < 0.8
+    assert parse_aggregate("how many rows are there?", columns, dtypes).confidence == 1.0
+    for question in [
+        "total amount last month",
+        "sum amount excluding refunds",
+        "total amount not including tax",
+        "average amount per customer name in 2023",
+    ]:
+        assert parse_aggregate(question, columns, dtypes).confidence < 0.8, question
+
+
+def test_aggregates_with_unparsed_qualifiers_go_to_the_llm():
+    df = pd.DataFrame({"customer": ["a", "b"], "amount": [10.0, 5.0]})
+    classifier = query_classifier(df)
+    for question in ["total amount last month", "sum amount excluding refunds", "average amount per customer in 2023"]:
+        assert classifier.classify(question) == "aggregate"
+        assert answer_directly(question, "aggregate", df, "sales.csv") is None
+    assert answer_directly("total amount", "aggregate", df, "sales.csv").startswith("Sum of amount")
@@ -0,0 +1,35 @@
+import pandas as pd
+
+import api.tabular
+from api.tabular import DataFrameCache, query_classifier
+from api.tabular_query import TableQueryClassifier
+
+
+def test_classifier_finds_query_type_column_and_value():
+    classifier = TableQueryClassifier(["Customer Name", "City", "amount ($)", "Invoice"])
+    assert classifier.classify("List all customers") == "list_all"
+    assert classifier.classify("Which rows have city is Tehran?") == "filter_exact"
+    assert classifier.column_value("Which rows have city is Tehran?") == ("City", "tehran")
+    assert classifier.column_value("customer nme is Sara") == ("Customer Name", "sara")
+    assert classifier.classify("names that contains ali") == "filter_pattern"
+    assert (classifier.pattern("city contains shi"), classifier.pattern_column("city contains shi")) == ("shi", "City")
+    assert classifier.classify("total amount ($)") == "aggregate"
+    assert classifier.aggregate("what is the total amount ($)") == (None, None)
+    assert classifier.aggregate("sum of invoice") == ("sum", "Invoice")
+    assert classifier.row_identifier("details for INV-7") == "inv-7"
+    assert classifier.classify("hello") == "unknown"
+
+
+def test_classifier_is_kept_with_the_cached_table(monkeypatch):
+    cache = DataFrameCache(max_bytes=1 << 20)
+    monkeypatch.setattr(api.tabular, "table_cache", cache)
+    df = pd.DataFrame({"city": ["Tehran"], "amount": [1]})
+    cache.set("ctx1", "v1", df)
+    size = cache.stats()["size_bytes"]
+
+    classifier = query_classifier(df)
+    assert query_classifier(df) is classifier
+    assert cache.stats()["size_bytes"] == size + classifier.nbytes
+    assert query_classifier(df.copy()) is not classifier
+    cache.invalidate("ctx1")
+    assert query_classifier(df) is not classifier
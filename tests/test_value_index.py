@@ -0,0 +1,34 @@
+import difflib
+
+import pyarrow as pa
+
+from api.value_index import ColumnValueIndex, TableValueIndex, ValueIndexBuilder, normalize_value
+
+
+def test_exact_lookup_groups_values_by_normalized_form():
+    index = ColumnValueIndex.build(["Café Roma", "CAFE ROMA", "Tehran", "Shiraz"])
+    assert normalize_value("Café Roma") == "cafe roma"
+    assert sorted(index.matches("cafe roma")) == ["CAFE ROMA", "Café Roma"]
+    assert index.best_match("tehran") == "Tehran"
+
+
+def test_fuzzy_lookup_only_accepts_close_trigram_candidates():
+    values = [f"customer-{i:05d}" for i in range(5000)] + ["Isfahan Branch"]
+    index = ColumnValueIndex.build(values)
+    assert index.best_match("isfahan brnch") == "Isfahan Branch"
+    # Same score as a difflib scan over every value.
+    best = index.best_match("customer-0042")
+    expected = difflib.get_close_matches("customer-0042", values, n=1, cutoff=0.8)[0]
+    ratio = lambda value: difflib.SequenceMatcher(None, value, "customer-0042").ratio()
+    assert ratio(best) == ratio(expected)
+    assert index.matches("completely unrelated") == []
+
+
+def test_table_value_index_round_trips_through_arrow():
+    builder = ValueIndexBuilder(pa.schema([("name", pa.string()), ("code", pa.int64()), ("amount", pa.float64())]))
+    builder.update(pa.table({"name": ["Ali", None, "ali"], "code": [7, 8, None], "amount": [1.5, 2.0, 3.0]}))
+    index = TableValueIndex.from_arrow(builder.build().to_arrow())
+    assert index.get("amount") is None
+    assert sorted(index.get("name").matches("ALI")) == ["Ali", "ali"]
+    assert index.get("code").matches("8") == ["8"]
+    assert index.nbytes > 0